@@ -1,172 +1,371 @@
-import pandas as pd
 import datetime
 import os
 import json
-from artifacts.logs_func import log_mysql
+from concurrent.futures import ProcessPoolExecutor
 import sys
 sys.path.append(os.getcwd()+'\\src')
 import download_files_functions as dw 
 import utils_file_functions as uf
 import process_file_functions as pf
+import snapshot_functions as sf
+import instrumentation_functions as ins
+import backend_functions as bk
+import indice_cuit_functions as ic
+import prefiltro_functions as pfl
+import indice_nombres_functions as inm
+import lago_functions as lg
+import cdc_functions as cdc
+import checkpoint_functions as ck
 
-# Parametros Globales -> Se tienen que definir en todos los procesos
-fecha_corrida = datetime.datetime.now()
-last_period_updated = uf.get_last_period_updated()
-url = 'http://datos.jus.gob.ar/dataset/ee83de85-4305-4c53-9a9f-fd3d15e42c36'
+## La preparacion de los periodos corre en otro proceso, que vuelve a importar este modulo (spawn en Windows)
+if __name__ == '__main__':
 
-# Parametros locales
+    # Parametros Globales -> Se tienen que definir en todos los procesos
+    fecha_corrida = datetime.datetime.now()
+    last_period_updated = uf.get_last_period_updated()
+    url = 'http://datos.jus.gob.ar/dataset/ee83de85-4305-4c53-9a9f-fd3d15e42c36'
 
-## Cargo parametrios de logs para MySql
-log_base = log_mysql(nb_proceso= 'Registro_Nacional_Sociedades', database= 'empresas')
+    # Parametros locales
 
-## Cargo parametros para logs Local
-log_local = {'periodo_actual_en_mysql': last_period_updated}
+    ## Instrumentacion: tiempos, memoria, registros por segundo y llamadas a MySql de cada paso en el log local.
+    ## Para perfilar un paso poner parte de su nombre en paso_perfilado (por ejemplo 'Updateo'), el perfil queda en logs/.
+    ## tipo_perfil: 'cprofile' (solo el hilo principal) o 'muestreo' (todos los hilos). Los pasos de la preparacion del periodo
+    ## (leo, proceso columnas, filtro y codifico) se miden y se perfilan en el proceso que prepara (logs/perfil_AAAAMM_preparacion_N)
+    paso_perfilado = None
+    tipo_perfil = 'cprofile'
+    ins.instrumento_conexiones(pf)
 
-local_log_file = open(f'./logs/log_{fecha_corrida.strftime("%Y%m%d_%H%M%S")}.json','w')
+    ## Backend de las tablas: 'mysql' o embebido en archivos locales de data/embebido, 'duckdb' o 'sqlite' (sin servidor, 
+    ## para analisis local y corridas de prueba; los lookups se cargan con bk.cargo_lookups_embebido)
+    backend = 'mysql'
+    bk.configuro_backend(backend)
 
-# Corro el proceso, si no hay archivos a actualizar finaliza
-try:
-    ## Veo si hay un archivo a actualizar y lo actualizo
-    files_downloaded = uf.check_local_files_to_update(last_period_updated)
+    ## Cargo parametrios de logs para MySql (con un backend embebido el log queda solo en memoria y en el log local,
+    ## no hace falta artifacts)
+    if backend == 'mysql':
+        from artifacts.logs_func import log_mysql
+    else:
+        log_mysql = bk.log_sin_mysql
+    log_base = ins.log_instrumentado(log_mysql(nb_proceso= 'Registro_Nacional_Sociedades', database= 'empresas'), 
+                                     paso_perfilado= paso_perfilado, tipo_perfil= tipo_perfil)
+
+    ## Lectura del archivo por lotes para acotar la memoria usada (memoria maxima por lote en MB)
+    lectura_por_lotes = True
+    memoria_maxima_mb = 1024
+
+    ## Como comparo la novedad contra MySql: 'digest' (solo pares CUIT-digest), 'sql' (compara MySql) o 'completo' (todas las columnas,
+    ## usando el snapshot local de la base vigente en data/snapshot si esta al dia con MySql)
+    modo_comparacion = 'digest'
+
+    ## Como inserto en MySql: 'load_data' (LOAD DATA LOCAL INFILE, si falla sigue con executemany), 'paralelo' o 'executemany'
+    metodo_insert = 'load_data'
+    conexiones_insert = 4
+
+    ## Exporto la base vigente como indice por CUIT con memory map (data/indice_cuit) despues de cada periodo, para buscar
+    ## atributos desde otros procesos con ic.indice_cuit
+    exporto_indice_cuit = True
+
+    ## Actualizo el indice de trigramas sobre nb_razon_social (data/indice_nombres) despues de cada periodo, para buscar
+    ## empresas por nombre aproximado con inm.indice_nombres o scripts/busco_nombre.py
+    exporto_indice_nombres = True
+
+    ## Exporto las altas, cambios y cierres de cada periodo al lago Parquet particionado por cd_periodo_proceso
+    ## (data/lago), para los reportes sobre la historia sin consultar MySql (ver lg.leo_lago)
+    exporto_lago = True
+
+    ## Exporto los cambios de cada periodo (CUITs insertados, versiones cerradas y columnas que cambiaron) a data/cdc,
+    ## para que otros sistemas lean solo lo nuevo con cdc.sigo_cdc o cdc.consumidor_cdc. El periodo no termina hasta
+    ## que su archivo quedo escrito, para regenerarlo si falla hacen falta los checkpoints
+    exporto_cdc = True
+
+    ## Checkpoints por periodo en data/checkpoints/AAAAMM (bases a insertar y updatear, etapas terminadas y chunks
+    ## commiteados): si un periodo falla, la corrida siguiente sigue desde ahi sin volver a leer ni comparar el archivo
+    checkpoints = True
+
+    ## Descargas simultaneas cuando hay que bajar varios zips para ponerse al dia (por ejemplo despues de un corte que cruza de año)
+    descargas_simultaneas = 3
+
+    ## Preparo el archivo del periodo siguiente en otro proceso mientras escribo el actual en MySql (los periodos se escriben en orden)
+    pipeline_periodos = True
+
+    ## Prefiltro de lineas: solo paso a pandas las lineas nuevas o que cambiaron contra el archivo del periodo anterior
+    ## (estado en data/prefiltro, se guarda cuando el periodo quedo en MySql). Los CUITs que faltan quedan en data/prefiltro
+    prefiltro_lineas = True
+    prefiltro = pfl.prefiltro_lineas() if prefiltro_lineas else None
+
+    ## Diccionario de normalizacion de strings que se reusa entre corridas
+    diccionario_normalizacion_path = './data/diccionario_normalizacion.json'
+    uf.cargo_diccionario_normalizacion(diccionario_normalizacion_path)
+
+    ## Cargo parametros para logs Local
+    log_local = {'periodo_actual_en_mysql': last_period_updated}
+
+    local_log_file = open(f'./logs/log_{fecha_corrida.strftime("%Y%m%d_%H%M%S")}.json','w')
+
+    # Corro el proceso, si no hay archivos a actualizar finaliza
+    try:
+        ## Veo si hay un archivo a actualizar y lo actualizo
+        files_downloaded = uf.check_local_files_to_update(last_period_updated)
     
-    if len(files_downloaded) == 0:
+        if len(files_downloaded) == 0:
     
-        ## Como no tengo files descargados, busco en la pagina para descargarlos
-        files_downloaded = dw.download_file(url, last_period_updated)
+            ## Como no tengo files descargados, busco en la pagina y descargo todos los zips que faltan hasta el ultimo periodo publicado
+            files_downloaded = dw.download_files(url, last_period_updated, max_descargas= descargas_simultaneas)
     
-    if len(files_downloaded) == 0:
-        log_local['descargas'] = {'archivos_para_actualizar': files_downloaded, 'status': 'Sin actualizaciones'}
+        if len(files_downloaded) == 0:
+            log_local['descargas'] = {'archivos_para_actualizar': files_downloaded, 'status': 'Sin actualizaciones'}
+            log_local['ultimo_periodo_actualizado'] = last_period_updated
+            json.dump(log_local, local_log_file)
+            local_log_file.close()
+        else:
+            files_downloaded.sort(key= lambda file: file[-10:-4])
+            log_local['descargas'] = {'archivos_para_actualizar': files_downloaded, 'status': 'OK'}
+    except:
+        log_local['descargas'] = {'archivos_para_actualizar': '', 'status': 'ERROR'}
         log_local['ultimo_periodo_actualizado'] = last_period_updated
         json.dump(log_local, local_log_file)
-        local_log_file.close()
-    else:
-        files_downloaded.sort()
-        log_local['descargas'] = {'archivos_para_actualizar': files_downloaded, 'status': 'OK'}
-except:
-    log_local['descargas'] = {'archivos_para_actualizar': '', 'status': 'ERROR'}
-    log_local['ultimo_periodo_actualizado'] = last_period_updated
-    json.dump(log_local, local_log_file)
-    local_log_file.close()    
-    sys.exit()
-
-# Cargo cada uno de los archivos en la base MySql
-
-while files_downloaded:
+        local_log_file.close()    
+        sys.exit()
+
+    # Cargo cada uno de los archivos en la base MySql
+
+    rns_vigente = None # Base vigente en memoria para modo_comparacion 'completo', se actualiza con cada periodo
+
+    ## Proceso que prepara el periodo siguiente mientras se escribe el actual, con los lookups, el diccionario y el prefiltro de este
+    preparador = ProcessPoolExecutor(max_workers= 1, initializer= pf.inicio_preparacion,
+                                     initargs= (dict(pf.descargo_lookups()), dict(uf.diccionario_normalizacion), prefiltro, paso_perfilado, tipo_perfil)) if files_downloaded else None
+    preparacion = None
+
+    while files_downloaded:
     
-    log_local['archivo_procesado'] = {}
-    log_base.update_log_procesos() # Creo el primer registro de inicio de carga de las tablas
+        log_local['archivo_procesado'] = {}
+        log_base.update_log_procesos() # Creo el primer registro de inicio de carga de las tablas
     
-    file_path = './data/zip/' + files_downloaded.pop(0)
+        file_path = './data/zip/' + files_downloaded.pop(0)
     
-    file_period = int(file_path[-10:-4])
-    log_local['archivo_procesado'][file_period] = {}
+        file_period = int(file_path[-10:-4])
+        log_local['archivo_procesado'][file_period] = {}
+        log_base.inicio_periodo(file_period)
     
-    try:
+        try:
         
-        ## ---------------- LEVANTO ARCHIVO ----------------------
+            ## ------------ LEVANTO Y PREPARO ARCHIVO ----------------
         
-        log_base.log_step('Inicio: Leo archivo %s' % file_period)
+            ## Checkpoint del periodo: si una corrida anterior fallo despues de comparar sigo con las bases guardadas
+            checkpoint = ck.checkpoint_periodo(file_period) if checkpoints else None
+            reanudo = checkpoint is not None and checkpoint.hecho('comparacion')
         
-        skip, headers = uf.check_headers(file_path)
-        rns = pd.read_csv(file_path, header= None, names= headers, skiprows= skip, dtype= 'object').drop(columns= 'numero_inscripcion')
-
-        log_base.update_log_step(step_status='OK', registros_procesados=rns.shape[0])
+            ## Sin checkpoint el paso se mide en el proceso que prepara, aca solo espero la preparacion
+            log_base.log_step(('Inicio: Leo y proceso por lotes el archivo %s' if lectura_por_lotes else 'Inicio: Leo archivo %s') % file_period,
+                              medido_aparte= not reanudo)
         
-        log_local['archivo_procesado'].update({file_period: {'inicio': {'registros_iniciales': rns.shape[0], 'load_status': 'OK'}}})
-
+            if not reanudo:
+                if checkpoint is not None:
+                    checkpoint.reinicio()
+            
+                if preparacion is None:
+                    preparacion = preparador.submit(pf.preparo_periodo_en_proceso, file_path, file_period, lectura_por_lotes, memoria_maxima_mb)
+        
+                ## Mientras este periodo se escribe en MySql preparo el siguiente
+                preparacion_actual = preparacion
+                preparacion = None
+                if pipeline_periodos and files_downloaded:
+                    preparacion = preparador.submit(pf.preparo_periodo_en_proceso, './data/zip/' + files_downloaded[0], int(files_downloaded[0][-10:-4]), lectura_por_lotes, memoria_maxima_mb)
+        
+                rns_para_comprar, resumen = preparacion_actual.result()
+                pf.agrego_preparacion(resumen, file_period, prefiltro)
         
-        ## ---------------- PROCESO COLUMNAS ---------------------
+                ## Lo medido aca es la espera, lo medido en el proceso que prepara queda con el sufijo _preparacion
+                medicion_preparacion = resumen['tiempos_pasos'][0]
+                log_base.update_log_step(step_status='OK', registros_procesados=resumen['pasos'][0][1], 
+                                         metricas={(k if k == 'perfil' else k + '_preparacion'): v for k, v in medicion_preparacion.items()})
         
-        log_base.log_step('Proceso Columnas')
+                ## Dejo en el log los pasos que corrieron en la preparacion, con lo medido en el proceso que prepara
+                for (step_name, registros), medicion in zip(resumen['pasos'][1:], resumen['tiempos_pasos'][1:]):
+                    log_base.log_step(step_name, medido_aparte= True)
+                    log_base.update_log_step(step_status='OK', registros_procesados=registros, metricas={**medicion, 'en_paralelo': True})
         
-        rns_p = pf.proceso_columnas(rns, file_period)
+                log_local['archivo_procesado'].update({file_period: {'inicio': {'registros_iniciales': resumen['registros_iniciales'], 'load_status': 'OK'}}})
+                log_local['archivo_procesado'][file_period].update({'resumen': {'nulos': resumen['nulos'],
+                                                                    'p_cuits_invalidos': resumen['p_cuits_invalidos'], 
+                                                                    'load_status': 'OK'}})
+                log_local['archivo_procesado'][file_period].update({'registros_validos': resumen['registros_validos'], 'load_status': 'OK'})
+                log_local['archivo_procesado'][file_period].update({'valores_no_registrados': resumen['valores_no_registrados'], 'load_status': 'OK'})
+                if 'prefiltro' in resumen:
+                    log_local['archivo_procesado'][file_period].update({'prefiltro': resumen['prefiltro']})
         
-        log_base.update_log_step(step_status='OK', registros_procesados=rns_p.shape[0])
+                ## --- CREO LAS BASES A INSERTAR Y UPDATEAR BASE FINAL ---
         
-        log_local['archivo_procesado'][file_period].update({'resumen': {'nulos': uf.resumen_nas(rns_p).to_dict(),
-                                                            'p_cuits_invalidos': (~rns_p['cuit_valido']).mean(), 
-                                                            'load_status': 'OK'}})
+                log_base.log_step('Creo bases a insertar y updatear')
         
-        ## ----------- FILTRO REGISTROS INVALIDOS ----------------
+                pf.agrego_columna_digest()
         
-        log_base.log_step('Filtro registros invalidos')
+                try:
+                    if modo_comparacion == 'digest':
+                        rns_actual = pf.descargo_digest_mysql()
+                        rns_insert, rns_update = pf.base_final_para_actualizar_digest(rns_para_comprar, rns_actual, log_base.cd_log, file_period)
+                    elif modo_comparacion == 'sql':
+                        rns_insert, rns_update = pf.base_final_para_actualizar_sql(rns_para_comprar, log_base.cd_log, file_period)
+                    else:
+                        if rns_vigente is None:
+                            rns_vigente = sf.descargo_base_vigente()
+                        rns_insert, rns_update = pf.base_final_para_actualizar(rns_para_comprar, rns_vigente, log_base.cd_log, file_period)
+                finally:
+                    ## Con lectura por lotes la novedad quedo en disco, despues de comparar ya no hace falta
+                    if isinstance(rns_para_comprar, pf.base_por_lotes):
+                        rns_para_comprar.borro()
         
-        invalid_rows = rns_p[['cuit','razon_social','fh_contrato_social']].isnull().any(axis= 1)
-        invalid_rows = invalid_rows | ~rns_p['cuit_valido']
+                log_base.update_log_step(step_status='OK', registros_procesados=rns_insert.shape[0]+rns_update.shape[0])
+                log_local['archivo_procesado'][file_period].update({'registros_a_actualizar': rns_insert.shape[0]+rns_update.shape[0], 'load_status': 'OK'})
+            
+                if checkpoint is not None:
+                    checkpoint.guardo_bases(rns_insert, rns_update)
+            else:
+                ## Si ya estaba preparando este periodo no hace falta
+                if preparacion is not None:
+                    pf.descarto_preparacion(preparacion)
+                    preparacion = None
+                if pipeline_periodos and files_downloaded:
+                    preparacion = preparador.submit(pf.preparo_periodo_en_proceso, './data/zip/' + files_downloaded[0], int(files_downloaded[0][-10:-4]), lectura_por_lotes, memoria_maxima_mb)
+            
+                rns_insert, rns_update = checkpoint.cargo_bases()
+                log_base.update_log_step(step_status='OK', registros_procesados=rns_insert.shape[0]+rns_update.shape[0])
+                log_local['archivo_procesado'].setdefault(file_period, {}).update({'checkpoint': {'etapas': checkpoint.estado['etapas'], 'insert_commiteados': checkpoint.insert_commiteados()},
+                                                                    'registros_a_actualizar': rns_insert.shape[0]+rns_update.shape[0], 'load_status': 'OK'})
         
-        rns_p = rns_p.loc[~invalid_rows,:]
+            ## ----------------- INSERTO NUEVOS CUITS ----------------
 
-        log_base.update_log_step(step_status='OK', registros_procesados=rns_p.shape[0])
+            log_base.log_step('Inserto CUITs nuevos')
         
-        log_local['archivo_procesado'][file_period].update({'registros_validos': rns_p.shape[0], 'load_status': 'OK'})
+            stats_insert = {}
+            if checkpoint is not None and checkpoint.hecho('insert'):
+                stats_insert = {'checkpoint': 'hecho'}
+            else:
+                ## Al seguir un periodo salteo los chunks ya commiteados
+                hechos = ck.rangos_insert_hechos(checkpoint, rns_insert) if reanudo else None
+                resultado = pf.inserto_cuits(rns_insert, 'empresas', metodo= metodo_insert, stats= stats_insert, n_conexiones= conexiones_insert,
+                                             hechos= hechos, al_commitear= checkpoint.commiteado if checkpoint is not None else None)
+                if resultado == 0:
+                    raise ValueError(f'pf.insert_cuits valor {resultado}: {stats_insert.get("error", "")}')
+                if checkpoint is not None:
+                    checkpoint.marco('insert')
         
-        ## ----------- REEMPLAZO TEXTO POR CODIGOS ---------------
+            log_base.update_log_step(step_status='OK', registros_procesados=rns_insert.shape[0])
+            log_local['archivo_procesado'][file_period].update({'registros_insertados': rns_insert.shape[0], 'stats_insert': stats_insert, 'load_status': 'OK'})
 
-        log_base.log_step('Reemplazo texto por codigos en cols con provincias, tipos societarios y estados del domicilios')
+            ## ------------------ UPDATEO CUITS VIEJOS ---------------
+     
+            log_base.log_step('Updateo CUITs viejos')
         
-        rns_p, valores_no_registrados = pf.codifico_columnas(rns_p)
+            stats_update = {}
+            if checkpoint is not None and (checkpoint.hecho('update') or (reanudo and ck.update_en_base(file_period, rns_update))):
+                stats_update = {'checkpoint': 'hecho'}
+            else:
+                resultado = pf.update_cuits(rns_update, stats= stats_update)
+                if resultado == 0:
+                    raise ValueError(f'pf.update_cuits valor {resultado}')
+            if checkpoint is not None:
+                checkpoint.marco('update')
         
-        log_base.update_log_step(step_status='OK', registros_procesados=rns_p.shape[0])
-        log_local['archivo_procesado'][file_period].update({'valores_no_registrados': valores_no_registrados, 'load_status': 'OK'})
+            log_base.update_log_step(step_status='OK', registros_procesados=rns_update.shape[0])
+            log_local['archivo_procesado'][file_period].update({'registros_updateados': rns_update.shape[0], 'stats_update': stats_update, 'load_status': 'OK'})
+      
+            ## ------------------ EXPORTO CAMBIOS -----------------
         
-        ## --- CREO LAS BASES A INSERTAR Y UPDATEAR BASE FINAL ---
+            ## Cambios del periodo: rns_vigente, o el snapshot, todavia es la base anterior al periodo (si no esta al dia
+            ## no se sabe que columnas cambiaron). Del snapshot solo leo las versiones que se cerraron.
+            ## Si falla, falla el periodo: queda el checkpoint con el insert y el update hechos y la corrida siguiente
+            ## vuelve a exportarlo (sin checkpoints no se puede, la comparacion contra MySql ya no da los cambios)
+            if exporto_cdc:
+                log_base.log_step('Exporto cambios del periodo')
+                base_anterior = rns_vigente if rns_vigente is not None else sf.leo_snapshot_cuits(rns_update['nu_cuit'], file_period)
+                log_local['archivo_procesado'][file_period].update({'cdc': cdc.exporto_cdc(rns_insert, rns_update, file_period, base_anterior)})
+                del base_anterior
+                log_base.update_log_step(step_status='OK', registros_procesados=rns_insert.shape[0]+rns_update.shape[0])
         
-        log_base.log_step('Creo bases a insertar y updatear')
+            ## ------------------ FIN ACTUALIZACION ---------------
         
-        rns_para_comprar = pf.base_para_comprar(rns_p)
-        rns_actual = pf.descargo_base_mysql()
-        rns_insert, rns_update = pf.base_final_para_actualizar(rns_para_comprar, rns_actual, log_base.cd_log, file_period)
+            log_base.log_step('Fin: Actualizacion desde archivo %s' % file_period, final_step=True)        
+            log_base.update_log_step(step_status='OK')
+            log_local['archivo_procesado'][file_period].update({'fin_proceso_archivo': 'OK'})
+            log_local['archivo_procesado'][file_period].update({'instrumentacion': log_base.resumen_periodo()})
         
-        log_base.update_log_step(step_status='OK', registros_procesados=rns_insert.shape[0]+rns_update.shape[0])
-        log_local['archivo_procesado'][file_period].update({'registros_a_actualizar': rns_insert.shape[0]+rns_update.shape[0], 'load_status': 'OK'})
+            if checkpoint is not None:
+                checkpoint.borro()
         
-        ## ----------------- INSERTO NUEVOS CUITS ----------------
-
-        log_base.log_step('Inserto CUITs nuevos')
+            ## El periodo quedo en MySql: el proximo prefiltro compara contra este archivo
+            if prefiltro is not None:
+                prefiltro.confirmo(file_period)
         
-        resultado = pf.inserto_cuits(rns_insert, 'empresas')
-        if resultado == 0:
-            raise ValueError(f'pf.insert_cuits valor {resultado}')
+            ## Actualizo el snapshot local de la base vigente y el indice por CUIT, si falla se vuelve a descargar de MySql.
+            ## Solo el modo 'completo' tiene la base vigente entera en memoria: en los otros la novedad se aplica al
+            ## snapshot en disco y el indice se arma desde el snapshot de a una columna
+            if modo_comparacion == 'completo' or exporto_indice_cuit:
+                try:
+                    if modo_comparacion == 'completo':
+                        if rns_vigente is None:
+                            rns_vigente = sf.descargo_base_vigente()
+                        else:
+                            rns_vigente = sf.aplico_novedad(rns_vigente, rns_insert, rns_update)
+                            sf.guardo_snapshot_periodo(rns_vigente, rns_insert, rns_update, file_period)
+                        base_indice = rns_vigente
+                    elif sf.actualizo_snapshot(rns_insert, rns_update, file_period):
+                        base_indice = sf.snapshot_path
+                    else:
+                        base_indice = sf.descargo_base_vigente()
+                
+                    if exporto_indice_cuit:
+                        log_local['archivo_procesado'][file_period].update({'indice_cuit': ic.exporto_indice_cuit(base_indice, file_period)})
+                    del base_indice
+                except Exception as e:
+                    rns_vigente = None
+                    log_local['archivo_procesado'][file_period].update({'base_vigente': 'ERROR: %s' % e})
         
-        log_base.update_log_step(step_status='OK', registros_procesados=rns_insert.shape[0])
-        log_local['archivo_procesado'][file_period].update({'registros_insertados': rns_insert.shape[0], 'load_status': 'OK'})
-
-        ## ------------------ UPDATEO CUITS VIEJOS ---------------
-     
-        log_base.log_step('Updateo CUITs viejos')
+            if exporto_indice_nombres:
+                try:
+                    log_local['archivo_procesado'][file_period].update({'indice_nombres': inm.actualizo_indice_nombres(rns_insert, rns_update, file_period, rns_vigente)})
+                except Exception as e:
+                    log_local['archivo_procesado'][file_period].update({'indice_nombres': 'ERROR: %s' % e})
         
-        resultado = pf.update_cuits(rns_update)
-        if resultado == 0:
-            raise ValueError(f'pf.update_cuits valor {resultado}')
+            if exporto_lago:
+                try:
+                    log_local['archivo_procesado'][file_period].update({'lago': lg.exporto_periodo_lago(rns_insert, rns_update, file_period)})
+                except Exception as e:
+                    log_local['archivo_procesado'][file_period].update({'lago': 'ERROR: %s' % e})
         
-        log_base.update_log_step(step_status='OK', registros_procesados=rns_update.shape[0])
-        log_local['archivo_procesado'][file_period].update({'registros_updateados': rns_update.shape[0], 'load_status': 'OK'})
-      
-        ## ------------------ FIN ACTUALIZACION ---------------
+            try:
+                uf.guardo_diccionario_normalizacion(diccionario_normalizacion_path)
+            except Exception:
+                pass
         
-        log_base.log_step('Fin: Actualizacion desde archivo %s' % file_period, final_step=True)        
-        log_base.update_log_step(step_status='OK')
-        log_local['archivo_procesado'][file_period].update({'fin_proceso_archivo': 'OK'})
+            ## Borro el archivo cargado correctamente (si se leyo del zip no hay nada que borrar)
+            if '.zip/' not in file_path:
+                os.system(f'del data\\zip\\*{str(file_period)}.csv')
         
-        ## Borro el archivo cargado correctamente
-        os.system(f'del data\\zip\\*{str(file_period)}.csv')
+        except Exception as e:
+            log_base.update_log_step(step_status='ERROR')
+            log_local['archivo_procesado'][file_period].update({'load_status': 'ERROR', 'step_name': log_base.step_name, 'step_num': log_base.step_num, 'error': str(e)})
+            log_local['archivo_procesado'][file_period].update({'instrumentacion': log_base.resumen_periodo()})
+            log_local['ultimo_periodo_actualizado'] = file_period-1 if str(file_period)[-2:] != '01' else (int(str(file_period)[:4])-1)*100+12
+            json.dump(log_local, local_log_file)
+            local_log_file.close()
         
-    except Exception as e:
-        log_base.update_log_step(step_status='ERROR')
-        log_local['archivo_procesado'][file_period].update({'load_status': 'ERROR', 'step_name': log_base.step_name, 'step_num': log_base.step_num, 'error': str(e)})
-        log_local['ultimo_periodo_actualizado'] = file_period-1 if str(file_period)[-2:] != '01' else (int(str(file_period)[:4])-1)*100+12
-        json.dump(log_local, local_log_file)
-        local_log_file.close()
+            ## No sigo con los periodos siguientes
+            if preparacion is not None:
+                pf.descarto_preparacion(preparacion)
         
-        break
+            break
 
-## ----------------------- FIN PROCESO -------------------
+    if preparador is not None:
+        preparador.shutdown(wait= False, cancel_futures= True)
 
-if log_base.log_procesos_loaded:
-    if log_local['archivo_procesado'][file_period].get('fin_proceso_archivo', 'ERROR') == 'OK':
-        log_local['ultimo_periodo_actualizado'] = file_period
-        json.dump(log_local, local_log_file)
-        local_log_file.close()
+    ## ----------------------- FIN PROCESO -------------------
+
+    if log_base.log_procesos_loaded:
+        if log_local['archivo_procesado'][file_period].get('fin_proceso_archivo', 'ERROR') == 'OK':
+            log_local['ultimo_periodo_actualizado'] = file_period
+            json.dump(log_local, local_log_file)
+            local_log_file.close()
         
-        ## Acomodo los archivos en su carpeta correspondiente
-        os.system(f'move data\\zip\\*.zip data\\{str(file_period)[:4]}')
+            ## Acomodo los archivos en su carpeta correspondiente (cada zip en la de su año)
+            dw.acomodo_zips()
@@ -0,0 +1,39 @@
+import os
+import sys
+import argparse
+import pandas as pd
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+import backend_functions as bk
+import historia_functions as hf
+
+# Busca la version de registro_sociedades vigente en cada fecha para un archivo de pares (CUIT, fecha)
+#   python scripts/as_of.py --entrada scoring.csv --salida scoring_rns.parquet --columnas nb_razon_social cd_provincia_dom_fiscal
+
+parser = argparse.ArgumentParser(description= 'Version vigente de registro_sociedades por CUIT y fecha')
+parser.add_argument('--entrada', required= True, help= '.csv o .parquet con los pares CUIT-fecha')
+parser.add_argument('--salida', required= True, help= '.csv o .parquet con las versiones encontradas')
+parser.add_argument('--col-cuit', default= 'nu_cuit', help= 'Columna con el CUIT en la entrada')
+parser.add_argument('--col-fecha', default= 'fecha', help= 'Columna con la fecha en la entrada')
+parser.add_argument('--columnas', nargs= '+', default= None, help= 'Columnas de la version a devolver (por defecto todas)')
+parser.add_argument('--backend', choices= ['mysql', 'duckdb', 'sqlite'], default= 'mysql')
+parser.add_argument('--carpeta-embebido', default= './data/embebido', help= 'Carpeta del backend embebido')
+parser.add_argument('--historia', default= hf.historia_path, help= 'Path de la historia guardada entre corridas')
+args = parser.parse_args()
+
+bk.configuro_backend(args.backend, args.carpeta_embebido)
+
+if args.entrada.endswith('.parquet'):
+    pares = pd.read_parquet(args.entrada, columns= [args.col_cuit, args.col_fecha])
+else:
+    pares = pd.read_csv(args.entrada, usecols= [args.col_cuit, args.col_fecha], dtype= {args.col_cuit: 'object', args.col_fecha: 'object'})
+
+indice = hf.cargo_indice_historia(args.columnas, args.historia)
+posiciones = indice.posiciones(pares[args.col_cuit], pares[args.col_fecha])
+versiones = indice.busco(pares[args.col_cuit], pares[args.col_fecha], args.columnas, posiciones= posiciones)
+
+if args.salida.endswith('.parquet'):
+    versiones.to_parquet(args.salida, index= False)
+else:
+    versiones.to_csv(args.salida, index= False)
+
+print(f'{pares.shape[0]} pares, {(posiciones >= 0).sum()} con version vigente -> {args.salida}')
@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import argparse
+import datetime
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+import utils_file_functions as uf
+import backend_functions as bk
+import process_file_functions as pf
+import backfill_functions as bf
+
+# Reconstruye toda la historia de registro_sociedades desde los .csv mensuales archivados (desde la carpeta del repo)
+#   python scripts/backfill.py --desde 201909 --procesos 8
+# Deja un log en logs/ con el ultimo periodo cargado para que app.py siga desde ahi
+
+parser = argparse.ArgumentParser(description= 'Backfill de la historia SCD-2 de registro_sociedades')
+parser.add_argument('--carpeta', default= './data', help= 'Carpeta con los .csv y .zip archivados (incluye subcarpetas)')
+parser.add_argument('--desde', type= int, default= None, help= 'Primer periodo AAAAMM')
+parser.add_argument('--hasta', type= int, default= None, help= 'Ultimo periodo AAAAMM')
+parser.add_argument('--procesos', type= int, default= None, help= 'Procesos que normalizan en paralelo (por defecto la cantidad de CPUs)')
+parser.add_argument('--memoria-maxima-mb', type= int, default= 512, help= 'Memoria maxima por lote de cada proceso')
+parser.add_argument('--backend', choices= ['mysql', 'duckdb', 'sqlite'], default= 'mysql')
+parser.add_argument('--carpeta-embebido', default= './data/embebido', help= 'Carpeta del backend embebido')
+parser.add_argument('--metodo-insert', default= 'load_data')
+parser.add_argument('--conexiones-insert', type= int, default= 4)
+parser.add_argument('--truncar', action= 'store_true', help= 'Vacia empresas.registro_sociedades antes de cargar')
+parser.add_argument('--conservo-temporales', action= 'store_true', help= 'No borra las bases normalizadas de data/backfill')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    bk.configuro_backend(args.backend, args.carpeta_embebido)
+    uf.cargo_diccionario_normalizacion('./data/diccionario_normalizacion.json')
+
+    archivos = bf.busco_archivos_historicos(args.carpeta, args.desde, args.hasta)
+    if not archivos:
+        sys.exit('No hay archivos para cargar')
+    print(f'{len(archivos)} periodos: {archivos[0][0]} a {archivos[-1][0]}')
+
+    if args.truncar:
+        mysql = pf.make_mysql_connection('empresas')
+        with mysql.cursor() as cur:
+            cur.execute('truncate table registro_sociedades')
+        mysql.commit()
+        mysql.close()
+
+    fecha_corrida = datetime.datetime.now()
+    resumen = bf.corro_backfill(archivos, cd_log= int(fecha_corrida.strftime('%Y%m%d%H%M%S')), n_procesos= args.procesos,
+                                memoria_maxima_mb= args.memoria_maxima_mb, metodo_insert= args.metodo_insert,
+                                n_conexiones= args.conexiones_insert, conservo_temporales= args.conservo_temporales)
+
+    # Mismo formato que el log de app.py, uf.get_last_period_updated lee de aca el ultimo periodo
+    log_local = {'periodo_actual_en_mysql': str(resumen['ultimo_periodo']),
+                 'descargas': {'archivos_para_actualizar': [path for _, path in archivos], 'status': 'OK'},
+                 'ultimo_periodo_actualizado': resumen['ultimo_periodo'],
+                 'backfill': resumen}
+
+    with open(f'./logs/log_{fecha_corrida.strftime("%Y%m%d_%H%M%S")}.json', 'w') as f:
+        json.dump(log_local, f, default= str)
+
+    print(f'{resumen["versiones"]} versiones de {resumen["cuits"]} CUITs, segundos: {resumen["segundos"]}')
@@ -0,0 +1,39 @@
+import os
+import sys
+import argparse
+import datetime
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+import benchmark_functions as bf
+
+# Corre el benchmark de las etapas del proceso sobre archivos sinteticos (desde la carpeta del repo, usa data/headers.csv)
+#   python scripts/benchmark.py --registros 500000 --periodos 3
+#   python scripts/benchmark.py --comparar logs/benchmark_anterior.json logs/benchmark_actual.json
+
+parser = argparse.ArgumentParser(description= 'Benchmark del proceso del RNS con archivos sinteticos')
+parser.add_argument('--registros', type= float, default= 100e3, help= 'Registros del primer periodo')
+parser.add_argument('--periodos', type= int, default= 2, help= 'Cantidad de periodos')
+parser.add_argument('--cambios', type= float, default= 0.02, help= 'Proporcion de registros que cambian por mes')
+parser.add_argument('--altas', type= float, default= 0.01, help= 'Proporcion de CUITs nuevos por mes')
+parser.add_argument('--bajas', type= float, default= 0.005, help= 'Proporcion de CUITs que salen por mes')
+parser.add_argument('--sucios', type= float, default= 0.01, help= 'Proporcion de registros con cada tipo de problema')
+parser.add_argument('--semilla', type= int, default= 0)
+parser.add_argument('--carpeta', default= None, help= 'Carpeta para dejar los archivos generados (por defecto temporal)')
+parser.add_argument('--backend', choices= ['mysql', 'duckdb', 'sqlite'], default= None, 
+                    help= 'Mide tambien inserto_cuits y update_cuits contra MySql (solo una base de prueba) o un backend embebido')
+parser.add_argument('--metodo-insert', default= 'executemany')
+parser.add_argument('--sin-memoria', action= 'store_true', help= 'No mide el pico de memoria (tracemalloc agrega tiempo)')
+parser.add_argument('--salida', default= f'./logs/benchmark_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.json')
+parser.add_argument('--comparar', nargs= 2, metavar= ('ANTERIOR', 'ACTUAL'), help= 'Compara dos resultados en vez de correr')
+args = parser.parse_args()
+
+if args.comparar:
+    print(bf.comparo_benchmarks(*args.comparar).to_string())
+else:
+    resultado = bf.corro_benchmark(n_registros= args.registros, n_periodos= args.periodos, p_cambios= args.cambios,
+                                   p_altas= args.altas, p_bajas= args.bajas, p_sucios= args.sucios, semilla= args.semilla,
+                                   carpeta= args.carpeta, backend= args.backend, metodo_insert= args.metodo_insert,
+                                   medir_memoria= not args.sin_memoria, salida= args.salida)
+    
+    for medicion in resultado['mediciones']:
+        print(medicion)
+    print(f'Resultados en {args.salida}')
@@ -0,0 +1,24 @@
+import os
+import sys
+import argparse
+import pandas as pd
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+import indice_nombres_functions as inm
+
+# Busca empresas por nombre aproximado en el indice de trigramas de nb_razon_social (lo actualiza app.py)
+#   python scripts/busco_nombre.py --texto "constructora del sur" --k 20
+
+parser = argparse.ArgumentParser(description= 'Busqueda aproximada por razon social')
+parser.add_argument('--texto', required= True, nargs= '+', help= 'Nombre a buscar')
+parser.add_argument('--k', type= int, default= 10, help= 'Cantidad maxima de resultados')
+parser.add_argument('--minimo', type= float, default= 0.3, help= 'Similitud minima (0 a 1)')
+parser.add_argument('--carpeta', default= inm.indice_nombres_path, help= 'Carpeta del indice')
+args = parser.parse_args()
+
+indice = inm.indice_nombres(args.carpeta)
+resultados = indice.busco(' '.join(args.texto), k= args.k, similitud_minima= args.minimo)
+
+with pd.option_context('display.max_colwidth', None, 'display.width', 200):
+    print(resultados.to_string(index= False) if resultados.shape[0] else 'Sin resultados')
+
+print(f'{len(indice)} nombres indexados, periodo {indice.periodo}')
@@ -0,0 +1,306 @@
+import os
+import re
+import sqlite3
+import datetime
+
+try:
+    from artifacts.connections import make_mysql_connection as conexion_mysql
+except ImportError:
+    conexion_mysql = None
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Backend donde se guardan las tablas: 'mysql' (artifacts) o embebido en archivos locales, 'duckdb' (columnar) o 'sqlite'.
+# Se cambia con configuro_backend antes de correr el proceso
+backend = {'nombre': 'mysql', 'carpeta': './data/embebido'}
+
+# Tablas del backend embebido, con las mismas columnas y en el mismo orden que en MySql
+columnas_registro_sociedades = '''
+    nu_cuit bigint, nb_razon_social varchar, cd_tipo_societario integer, fh_contrato_social date, fh_actualizacion date,
+    cd_provincia_dom_fiscal integer, nb_localidad_dom_fiscal varchar, cd_postal_dom_fiscal bigint, nb_calle_dom_fiscal varchar,
+    nu_calle_dom_fiscal bigint, tx_piso_dom_fiscal varchar, tx_depto_dom_fiscal varchar, cd_estado_dom_fiscal integer,
+    cd_provincia_dom_legal integer, nb_localidad_dom_legal varchar, cd_postal_dom_legal bigint, nb_calle_dom_legal varchar,
+    nu_calle_dom_legal bigint, tx_piso_dom_legal varchar, tx_depto_dom_legal varchar, cd_estado_dom_legal integer,
+    fh_inicio_registro date, fh_fin_registro date, cd_log_proceso bigint, cd_periodo_proceso integer, nu_digest bigint
+'''
+
+tablas_lookup = {'look_provincia': ('cd_provincia', 'nb_provincia', 'provincia'),
+                 'look_tipo_societario': ('cd_tipo_societario', 'nb_tipo_societario', 'tipo_societario'),
+                 'look_estado_domicilio': ('cd_estado_domicilio', 'nb_estado_domicilio', 'estado_domicilio')}
+
+
+def configuro_backend(nombre= 'mysql', carpeta= './data/embebido'):
+
+    '''
+        Elijo el backend de las tablas. Con un backend embebido creo las tablas si no existen.
+
+        input:
+            nombre: (str) 'mysql', 'duckdb' o 'sqlite'
+            carpeta: (str) Carpeta de los archivos del backend embebido
+        output:
+    '''
+
+    if nombre not in ('mysql', 'duckdb', 'sqlite'):
+        raise ValueError(f'Backend {nombre} desconocido')
+    if nombre == 'duckdb' and duckdb is None:
+        raise ImportError('Para el backend duckdb hay que instalar duckdb (pip install duckdb)')
+
+    backend.update({'nombre': nombre, 'carpeta': carpeta})
+
+    if es_embebido():
+        creo_tablas_embebidas()
+
+
+def es_embebido():
+
+    '''
+        True si el backend configurado es embebido (duckdb o sqlite)
+    '''
+
+    return backend['nombre'] != 'mysql'
+
+
+def make_connection(database):
+
+    '''
+        Abro una conexion al backend configurado. Para MySql es la de artifacts; para los embebidos es una
+        conexion_embebida con la misma interfaz (cursor, commit, rollback, close, open)
+
+        input:
+            database: (str) 'empresas' o 'step'
+        output:
+            conexion: Conexion al backend
+    '''
+
+    if not es_embebido():
+        if conexion_mysql is None:
+            raise ImportError('No esta instalado artifacts para conectarse a MySql')
+        return conexion_mysql(database)
+
+    return conexion_embebida(database, backend['nombre'], backend['carpeta'])
+
+
+class cursor_embebido:
+
+    '''
+        Cursor de conexion_embebida: traduce el SQL de MySql que usa el proceso antes de ejecutarlo
+    '''
+
+    def __init__(self, conexion):
+        self._conexion = conexion
+        self._cursor = conexion._con if conexion.motor == 'duckdb' else conexion._con.cursor()
+        self.rowcount = -1
+
+    def execute(self, sql, params= None):
+        self._cursor.execute(self._conexion.traduzco(sql), list(params or []))
+
+        # duckdb devuelve los registros modificados por insert/update/delete como resultado de la consulta
+        if self._conexion.motor == 'duckdb' and sql.strip()[:6].lower() in ('insert', 'update', 'delete'):
+            self.rowcount = self._cursor.fetchone()[0]
+        else:
+            self.rowcount = getattr(self._cursor, 'rowcount', -1)
+        return self.rowcount
+
+    def executemany(self, sql, params):
+        params = [list(fila) for fila in params]
+        self._cursor.executemany(self._conexion.traduzco(sql), params)
+        self.rowcount = len(params)
+        return self.rowcount
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def close(self):
+        if self._conexion.motor == 'sqlite':
+            self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class conexion_embebida:
+
+    '''
+        Conexion a las tablas embebidas con la interfaz de pymysql que usa el proceso. Igual que en MySql, lo que
+        no se commitea se pierde al cerrar la conexion. Las bases 'empresas' y 'step' son schemas del archivo
+        rns.duckdb (duckdb) o archivos empresas.sqlite y step.sqlite adjuntados a la conexion (sqlite). Los nombres
+        de tablas sin base se buscan primero en database, como en MySql.
+    '''
+
+    def __init__(self, database, motor, carpeta):
+        self.motor = motor
+        self.open = True
+        os.makedirs(carpeta, exist_ok= True)
+
+        if motor == 'duckdb':
+            self._con = duckdb.connect(os.path.join(carpeta, 'rns.duckdb'))
+            for schema in ['empresas', 'step']:
+                self._con.execute(f'create schema if not exists {schema}')
+            self._con.execute(f"set schema = '{database}'")
+            self._con.execute('begin transaction')
+        else:
+            self._con = sqlite3.connect(':memory:')
+            for schema in [database] + [schema for schema in ['empresas', 'step'] if schema != database]:
+                self._con.execute('attach database ? as %s' % schema, [os.path.join(carpeta, f'{schema}.sqlite')])
+
+    def traduzco(self, sql):
+
+        '''
+            Paso el SQL de MySql que usa el proceso al dialecto del motor embebido
+        '''
+
+        # En sqlite "is" es la igualdad que toma NULL = NULL como verdadero, en duckdb "is not distinct from"
+        sql = sql.replace('%s', '?').replace('<=>', ' is ' if self.motor == 'sqlite' else ' is not distinct from ').replace('`', '"')
+        sql = re.sub(r'truncate\s+table', 'delete from', sql, flags= re.I)
+        sql = re.sub(r'create\s+table\s+if\s+not\s+exists\s+(\S+)\s+like\s+(\S+)', r'create table if not exists \1 as select * from \2 where 1 = 0', sql, flags= re.I)
+
+        if self.motor == 'sqlite':
+            sql = re.sub(r'date_sub\(([^,]+),\s*interval\s+1\s+day\)', r"date(\1, '-1 day')", sql, flags= re.I)
+        else:
+            sql = re.sub(r'date_sub\(([^,]+),\s*interval\s+1\s+day\)', r'cast(\1 - interval 1 day as date)', sql, flags= re.I)
+
+        return sql
+
+    def cursor(self):
+        return cursor_embebido(self)
+
+    def commit(self):
+        self._con.commit()
+        if self.motor == 'duckdb':
+            self._con.execute('begin transaction')
+
+    def rollback(self):
+        self._con.rollback()
+        if self.motor == 'duckdb':
+            self._con.execute('begin transaction')
+
+    def close(self):
+        if self.open:
+            self._con.rollback()
+            self._con.close()
+            self.open = False
+
+
+def creo_tablas_embebidas():
+
+    '''
+        Creo en el backend embebido las tablas que usa el proceso si no existen: registro_sociedades en empresas
+        y en step (con nu_digest desde el principio) y las tablas de lookup
+
+        input:
+        output:
+    '''
+
+    conexion = make_connection('empresas')
+
+    with conexion.cursor() as cur:
+        for schema in ['empresas', 'step']:
+            cur.execute(f'create table if not exists {schema}.registro_sociedades ({columnas_registro_sociedades})')
+
+        # En sqlite un indice por CUIT y fecha de fin evita recorrer la tabla en cada join, duckdb no lo necesita
+        if conexion.motor == 'sqlite':
+            cur.execute('create index if not exists empresas.ix_registro_sociedades_vigente on registro_sociedades (nu_cuit, fh_fin_registro)')
+
+        for tabla, (codigo, nombre, _) in tablas_lookup.items():
+            cur.execute(f'create table if not exists empresas.{tabla} ({codigo} integer, {nombre} varchar)')
+
+    conexion.commit()
+    conexion.close()
+
+
+def cargo_lookups_embebido(lookups):
+
+    '''
+        Cargo las tablas de lookup del backend embebido (reemplazo lo que tengan)
+
+        input:
+            lookups: (dict) Diccionarios {valor: codigo} para 'provincia', 'tipo_societario' y 'estado_domicilio'
+                     (mismo formato que process_file_functions.descargo_lookups)
+        output:
+    '''
+
+    conexion = make_connection('empresas')
+
+    with conexion.cursor() as cur:
+        for tabla, (codigo, nombre, lookup) in tablas_lookup.items():
+            cur.execute(f'delete from {tabla}')
+            if lookups.get(lookup):
+                cur.executemany(f'insert into {tabla} ({codigo}, {nombre}) values (%s, %s)', [[cod, valor] for valor, cod in lookups[lookup].items()])
+
+    conexion.commit()
+    conexion.close()
+
+
+def inserto_dataframe(data, database, tabla, valores):
+
+    '''
+        Inserto una base en una tabla del backend embebido en una sola transaccion. En duckdb la base se lee
+        directamente como tabla (sin pasar por objetos de Python), en sqlite uso executemany.
+
+        input:
+            data: (pandas.DataFrame) Base a insertar
+            database: (str) 'empresas' o 'step'
+            tabla: (str) Tabla donde inserto
+            valores: (function) Funcion que pasa la base a lista de listas para executemany (process_file_functions.valores_para_mysql)
+        output:
+            registros: (int) Registros insertados
+    '''
+
+    conexion = make_connection(database)
+    cols = ','.join(f'"{col}"' for col in data.columns)
+
+    try:
+        if conexion.motor == 'duckdb':
+            conexion._con.register('novedad_a_insertar', data)
+            conexion._con.execute(f'insert into {database}.{tabla} ({cols}) select {cols} from novedad_a_insertar')
+            conexion._con.unregister('novedad_a_insertar')
+        else:
+            with conexion.cursor() as cur:
+                cur.executemany(f'insert into {database}.{tabla} ({cols}) values ({",".join(["?"]*data.shape[1])})', valores(data))
+        conexion.commit()
+    finally:
+        conexion.close()
+
+    return data.shape[0]
+
+
+class log_sin_mysql:
+
+    '''
+        Log del proceso con la misma interfaz que artifacts.logs_func.log_mysql para correr sin MySql (backends
+        embebidos): guarda los pasos en memoria y cd_log sale de la fecha y hora de inicio
+    '''
+
+    def __init__(self, nb_proceso, database):
+        self.nb_proceso = nb_proceso
+        self.database = database
+        self.cd_log = None
+        self.step_name = None
+        self.step_num = 0
+        self.log_procesos_loaded = False
+        self.pasos = []
+
+    def update_log_procesos(self):
+        self.cd_log = int(datetime.datetime.now().strftime('%Y%m%d%H%M%S'))
+        self.step_num = 0
+        self.log_procesos_loaded = True
+
+    def log_step(self, step_name, final_step= False):
+        self.step_name = step_name
+        self.step_num += 1
+        self.pasos.append({'cd_log': self.cd_log, 'step_num': self.step_num, 'step_name': step_name, 'final_step': final_step,
+                           'inicio': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+
+    def update_log_step(self, step_status, registros_procesados= None):
+        if self.pasos:
+            self.pasos[-1].update({'step_status': step_status, 'registros_procesados': registros_procesados,
+                                   'fin': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
@@ -0,0 +1,248 @@
+import os
+import re
+import time
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile
+import numpy as np
+import pandas as pd
+import utils_file_functions as uf
+import process_file_functions as pf
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+backfill_path = './data/backfill'
+
+
+def busco_archivos_historicos(carpeta= './data', desde= None, hasta= None):
+
+    '''
+        Busco los .csv mensuales archivados en carpeta y sus subcarpetas (data/AAAA, data/zip), sueltos o dentro
+        de un .zip. Si un periodo esta suelto y dentro de un .zip uso el suelto (igual que uf.check_local_files_to_update)
+
+        input:
+            carpeta: (str) Carpeta donde busco
+            desde: (int) Primer periodo AAAAMM a usar. Si es None desde el primero que haya
+            hasta: (int) Ultimo periodo AAAAMM a usar. Si es None hasta el ultimo que haya
+        output:
+            archivos: (list) (periodo, path) ordenados por periodo. Los que estan dentro de un .zip van como
+                      'archivo.zip/archivo.csv' (ver uf.abro_archivo)
+    '''
+
+    archivos = {}
+
+    for raiz, carpetas, files in os.walk(carpeta):
+        if os.path.abspath(raiz).startswith(os.path.abspath(backfill_path)):
+            continue
+
+        for file in sorted(files, key= lambda file: file[-3:] != 'csv'):
+            path = os.path.join(raiz, file).replace('\\', '/')
+
+            if file[-3:] == 'csv':
+                miembros = [path]
+            elif file[-3:] == 'zip':
+                with ZipFile(path, 'r') as zipf:
+                    miembros = [f'{path}/{member}' for member in zipf.namelist() if member[-3:] == 'csv']
+            else:
+                continue
+
+            for miembro in miembros:
+                periodo = re.findall(r'(\d{6})\.csv$', miembro)
+                if not periodo:
+                    continue
+                periodo = int(periodo[0])
+                if (desde is None or periodo >= desde) and (hasta is None or periodo <= hasta):
+                    archivos.setdefault(periodo, miembro)
+
+    return sorted(archivos.items())
+
+
+def _inicio_proceso(lookups, diccionario):
+
+    '''
+        Inicializo cada proceso de normalizo_periodo con los lookups y el diccionario de normalizacion del
+        proceso principal, asi ningun proceso se conecta a MySql
+    '''
+
+    pf._cache_lookups.clear()
+    pf._cache_lookups.update(lookups)
+    uf.diccionario_normalizacion.update(diccionario)
+
+
+def normalizo_periodo(file_path, file_period, carpeta, memoria_maxima_mb= 512):
+
+    '''
+        Normalizo un periodo (pf.preparo_periodo), me quedo con un registro por CUIT (el ultimo del archivo),
+        calculo el digest y guardo la base en carpeta/AAAAMM.parquet. Corre en un proceso aparte.
+
+        input:
+            file_path: (str) Path del .csv a procesar
+            file_period: (int) Periodo AAAAMM del archivo
+            carpeta: (str) Carpeta donde guardo la base normalizada
+            memoria_maxima_mb: (int) Memoria maxima aproximada a usar por lote en MB
+        output:
+            resumen: (dict) periodo, path de la base, registros_iniciales, registros_validos y segundos
+    '''
+
+    inicio = time.perf_counter()
+
+    lotes, resumen = pf.preparo_periodo(file_path, file_period, True, memoria_maxima_mb)
+
+    try:
+        posiciones = pf.posiciones_unicas(lotes.estado['nu_cuit'].to_numpy())
+        base = lotes.leo_filas(posiciones)
+        base['nu_digest'] = lotes.estado['nu_digest'].to_numpy()[posiciones]
+    finally:
+        lotes.borro()
+
+    path = os.path.join(carpeta, f'{file_period}.parquet')
+    base.to_parquet(path, index= False)
+
+    return {'periodo': file_period, 'path': path, 'registros_iniciales': resumen['registros_iniciales'],
+            'registros_validos': base.shape[0], 'segundos': round(time.perf_counter() - inicio, 4)}
+
+
+def calculo_intervalos(inicios):
+
+    '''
+        Calculo las fechas de cada version a partir de los periodos en que empieza: la primera version de cada
+        CUIT va desde 1900-01-01 (como los CUITs nuevos del proceso mensual) y las siguientes desde el primer dia
+        del periodo. Cada version se cierra un dia antes de que empiece la siguiente del mismo CUIT y la ultima
+        queda vigente (2100-12-31).
+
+        input:
+            inicios: (pandas.DataFrame) nu_cuit y cd_periodo_proceso de cada version
+        output:
+            intervalos: (pandas.DataFrame) nu_cuit, cd_periodo_proceso, fh_inicio_registro y fh_fin_registro,
+                        ordenados por CUIT y periodo
+    '''
+
+    intervalos = inicios.sort_values(['nu_cuit', 'cd_periodo_proceso'], kind= 'stable').reset_index(drop= True)
+
+    cuits = intervalos['nu_cuit'].to_numpy()
+    primera = np.ones(cuits.shape[0], dtype= bool)
+    primera[1:] = cuits[1:] != cuits[:-1]
+    ultima = np.ones(cuits.shape[0], dtype= bool)
+    ultima[:-1] = primera[1:]
+
+    fecha_periodo = pd.to_datetime(intervalos['cd_periodo_proceso'].astype('int64')*100 + 1, format= '%Y%m%d')
+
+    intervalos['fh_inicio_registro'] = fecha_periodo.where(~primera, pd.Timestamp('1900-01-01'))
+    intervalos['fh_fin_registro'] = (fecha_periodo.shift(-1) - pd.Timedelta(days= 1)).where(~ultima, pd.Timestamp('2100-12-31'))
+
+    return intervalos
+
+
+def corro_backfill(archivos, cd_log, n_procesos= None, carpeta= backfill_path, memoria_maxima_mb= 512,
+                   metodo_insert= 'load_data', n_conexiones= 4, conservo_temporales= False):
+
+    '''
+        Reconstruyo la historia SCD-2 de registro_sociedades desde los archivos mensuales sin pasar mes a mes por MySql:
+            1. Normalizo todos los periodos en paralelo en n_procesos procesos (normalizo_periodo)
+            2. A medida que terminan, en orden de periodo, comparo el digest de cada CUIT contra su ultima version:
+               los CUITs nuevos y los que cambiaron empiezan una version en ese periodo
+            3. Calculo el intervalo de cada version (calculo_intervalos)
+            4. Cargo las versiones en empresas.registro_sociedades en una sola pasada por los periodos, con pf.inserto_cuits
+        La tabla tiene que estar vacia. El resultado es el mismo que correr app.py con cada periodo en orden.
+
+        input:
+            archivos: (list) (periodo, path) ordenados por periodo (ver busco_archivos_historicos)
+            cd_log: (int) Codigo log que queda en cd_log_proceso
+            n_procesos: (int) Procesos que normalizan en paralelo. Si es None uso os.cpu_count()
+            carpeta: (str) Carpeta para las bases normalizadas de cada periodo
+            memoria_maxima_mb: (int) Memoria maxima aproximada por lote de cada proceso en MB
+            metodo_insert: (str) Metodo de pf.inserto_cuits
+            n_conexiones: (int) Conexiones de pf.inserto_cuits con metodo 'paralelo'
+            conservo_temporales: (bool) Si es True no borro las bases normalizadas al terminar
+        output:
+            resumen: (dict) Resumen por periodo (registros, versiones nuevas y cambiadas) y totales con los segundos de cada etapa
+    '''
+
+    if pq is None:
+        raise ImportError('Para el backfill hay que instalar pyarrow (pip install pyarrow)')
+
+    mysql = pf.make_mysql_connection('empresas')
+    with mysql.cursor() as cur:
+        cur.execute('select count(*) from registro_sociedades')
+        registros_actuales = cur.fetchone()[0]
+    mysql.close()
+
+    if registros_actuales > 0:
+        raise ValueError(f'empresas.registro_sociedades tiene {registros_actuales} registros, el backfill se corre con la tabla vacia')
+
+    pf.agrego_columna_digest()
+
+    shutil.rmtree(carpeta, ignore_errors= True)
+    os.makedirs(carpeta)
+
+    resumen = {'periodos': {}, 'segundos': {}}
+    inicio = time.perf_counter()
+
+    # Digest de la ultima version de cada CUIT e inicios de versiones (CUIT, periodo)
+    digest_vigente = pd.Series([], dtype= 'int64')
+    inicios = []
+
+    with ProcessPoolExecutor(max_workers= n_procesos, initializer= _inicio_proceso,
+                             initargs= (dict(pf.descargo_lookups()), dict(uf.diccionario_normalizacion))) as procesos:
+
+        normalizaciones = [procesos.submit(normalizo_periodo, path, periodo, carpeta, memoria_maxima_mb) for periodo, path in archivos]
+
+        # Los periodos se comparan en orden mientras los siguientes se siguen normalizando
+        for normalizacion in normalizaciones:
+            try:
+                resultado = normalizacion.result()
+            except Exception:
+                procesos.shutdown(wait= True, cancel_futures= True)
+                raise
+            periodo = resultado['periodo']
+
+            base = pd.read_parquet(resultado['path'], columns= ['nu_cuit', 'nu_digest'])
+            cuits = base['nu_cuit'].to_numpy(dtype= 'int64')
+            digests = base['nu_digest'].to_numpy(dtype= 'int64')
+
+            digest_anterior = digest_vigente.reindex(cuits)
+            cuit_nuevo = digest_anterior.isnull().to_numpy()
+            registro_cambiado = ~cuit_nuevo & (digest_anterior.to_numpy() != digests)
+            empieza = cuit_nuevo | registro_cambiado
+
+            digest_vigente = pd.concat([digest_vigente.drop(cuits[registro_cambiado]),
+                                        pd.Series(digests[empieza], index= cuits[empieza])])
+            inicios.append(pd.DataFrame({'nu_cuit': cuits[empieza], 'cd_periodo_proceso': periodo}))
+
+            resumen['periodos'][periodo] = {**resultado, 'cuits_nuevos': int(cuit_nuevo.sum()), 'registros_cambiados': int(registro_cambiado.sum())}
+
+    resumen['segundos']['normalizacion'] = round(time.perf_counter() - inicio, 4)
+
+    inicio = time.perf_counter()
+    intervalos = calculo_intervalos(pd.concat(inicios, ignore_index= True))
+    del inicios, digest_vigente
+    resumen['segundos']['intervalos'] = round(time.perf_counter() - inicio, 4)
+
+    # Cargo las versiones de cada periodo con su intervalo ya cerrado
+    inicio = time.perf_counter()
+    columnas = pf.variables_finales + ['fh_inicio_registro', 'fh_fin_registro', 'cd_log_proceso', 'cd_periodo_proceso', 'nu_digest']
+
+    for periodo, intervalos_periodo in intervalos.groupby('cd_periodo_proceso', sort= True):
+        base = pf.aplico_esquema(pd.read_parquet(resumen['periodos'][periodo]['path']))
+        versiones = base.merge(intervalos_periodo, on= 'nu_cuit', how= 'inner')
+        versiones['cd_log_proceso'] = cd_log
+
+        resultado = pf.inserto_cuits(pf.aplico_esquema(versiones[columnas]), 'empresas', metodo= metodo_insert, n_conexiones= n_conexiones)
+        if resultado == 0:
+            raise ValueError(f'pf.inserto_cuits no pudo cargar las versiones del periodo {periodo}')
+
+        resumen['periodos'][periodo]['versiones_cargadas'] = versiones.shape[0]
+        del base, versiones
+
+    resumen['segundos']['carga'] = round(time.perf_counter() - inicio, 4)
+    resumen['versiones'] = intervalos.shape[0]
+    resumen['cuits'] = int(intervalos['nu_cuit'].nunique())
+    resumen['ultimo_periodo'] = archivos[-1][0] if archivos else None
+
+    if not conservo_temporales:
+        shutil.rmtree(carpeta, ignore_errors= True)
+
+    return resumen
@@ -0,0 +1,430 @@
+import os
+import json
+import shutil
+import time
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import datetime
+import numpy as np
+import pandas as pd
+import utils_file_functions as uf
+import process_file_functions as pf
+import snapshot_functions as sf
+import backend_functions as bk
+
+# Headers de los archivos del RNS: los mismos de data/headers.csv, que es lo que espera uf.check_headers
+headers_path = './data/headers.csv'
+
+# Valores con los que armo los archivos sinteticos
+provincias = ['CIUDAD AUTONOMA BUENOS AIRES', 'BUENOS AIRES', 'CATAMARCA', 'CHACO', 'CHUBUT', 'CORDOBA', 'CORRIENTES',
+              'ENTRE RIOS', 'FORMOSA', 'JUJUY', 'LA PAMPA', 'LA RIOJA', 'MENDOZA', 'MISIONES', 'NEUQUEN', 'RIO NEGRO',
+              'SALTA', 'SAN JUAN', 'SAN LUIS', 'SANTA CRUZ', 'SANTA FE', 'SANTIAGO DEL ESTERO', 'TIERRA DEL FUEGO', 'TUCUMAN']
+tipos_societarios = ['SOCIEDAD ANONIMA', 'SOCIEDAD DE RESPONSABILIDAD LIMITADA', 'SOCIEDAD POR ACCIONES SIMPLIFICADA',
+                     'ASOCIACION CIVIL', 'FUNDACION', 'SOCIEDAD COLECTIVA', 'SOCIEDAD EN COMANDITA SIMPLE']
+estados_domicilio = ['REAL', 'LEGAL/FISCAL', 'CONSTITUIDO', 'NO CONFIRMADO']
+palabras_razon_social = ['AGRO', 'SERVICIOS', 'CONSTRUCTORA', 'DEL SUR', 'ARGENTINA', 'INVERSIONES', 'TRANSPORTE', 'LOGISTICA',
+                         'NORTE', 'ALIMENTOS', 'TEXTIL', 'SOLUCIONES', 'DESARROLLOS', 'GANADERA', 'PAMPA', 'ANDINA']
+pisos = ['', '', '', 'PB', '1', '2', '3', '4', '5', '10']
+deptos = ['', '', '', 'A', 'B', 'C', 'D', '1', '2']
+
+
+def lookups_sinteticos():
+
+    '''
+        Armo los lookups de provincias, tipos societarios y estados del domicilio de los archivos sinteticos,
+        con el mismo formato que pf.descargo_lookups (los valores ya normalizados)
+
+        input:
+        output:
+            lookups: (dict) Diccionarios {valor: codigo} para 'provincia', 'tipo_societario' y 'estado_domicilio'
+    '''
+
+    return {'provincia': {uf.normalizo_string(valor): cod for cod, valor in enumerate(provincias, 1)},
+            'tipo_societario': {uf.normalizo_string(valor): cod for cod, valor in enumerate(tipos_societarios, 1)},
+            'estado_domicilio': {uf.normalizo_string(valor): cod for cod, valor in enumerate(estados_domicilio, 1)}}
+
+
+def leo_headers(path= headers_path):
+
+    '''
+        Leo los headers de los archivos del RNS (mismo formato que lee uf.check_headers)
+
+        input:
+            path: (str) Path del .csv con los headers en la primera linea
+        output:
+            headers: (list) Headers en el orden de las columnas
+    '''
+
+    with open(path, 'r', encoding= 'utf-8-sig') as f:
+        return f.readline().strip().split(',')
+
+
+def genero_registros(n_registros, rng, periodo, cuit_desde= 0, headers= None):
+
+    '''
+        Genero registros limpios con la forma de los del RNS
+
+        input:
+            n_registros: (int) Cantidad de registros
+            rng: (numpy.random.Generator) Generador de numeros aleatorios
+            periodo: (int) Periodo AAAAMM del archivo, las fechas quedan antes de ese mes
+            cuit_desde: (int) Primer numero de CUIT (sin prefijo), para que las altas no repitan CUITs
+            headers: (list) Headers de los archivos. Si es None los leo de data/headers.csv (ver leo_headers)
+        output:
+            data: (pandas.DataFrame) Registros con las columnas de headers, todo como string
+    '''
+
+    n = int(n_registros)
+    fecha_periodo = pd.to_datetime(str(periodo*100+1))
+
+    prefijos = rng.choice(np.array([30, 33, 34], dtype= 'int64'), n)
+    cuits = prefijos * 10**9 + (cuit_desde + np.arange(n, dtype= 'int64'))
+
+    palabras = np.array(palabras_razon_social, dtype= 'object')
+    tipos = rng.integers(0, len(tipos_societarios), n)
+    sufijos = np.array(['SA', 'SRL', 'SAS', 'ASOC CIVIL', 'FUNDACION', 'SC', 'SCS'], dtype= 'object')
+    razon_social = (palabras[rng.integers(0, len(palabras), n)] + ' ' + palabras[rng.integers(0, len(palabras), n)] + ' '
+                    + (cuit_desde + np.arange(n)).astype('str').astype('object') + ' ' + sufijos[tipos])
+
+    dias_contrato = rng.integers(1, 365 * 60, n)
+    fecha_contrato = (fecha_periodo - pd.to_timedelta(dias_contrato, unit= 'D')).strftime('%Y-%m-%d 00:00:00')
+    dias_actualizacion = np.minimum(rng.integers(1, 365 * 5, n), dias_contrato)
+    fecha_actualizacion = (fecha_periodo - pd.to_timedelta(dias_actualizacion, unit= 'D')).strftime('%Y-%m-%d')
+
+    data = pd.DataFrame({'cuit': cuits.astype('str'),
+                         'razon_social': razon_social,
+                         'fecha_contrato_social': np.asarray(fecha_contrato, dtype= 'object'),
+                         'tipo_societario': np.array(tipos_societarios, dtype= 'object')[tipos],
+                         'fecha_actualizacion': np.asarray(fecha_actualizacion, dtype= 'object'),
+                         'numero_inscripcion': (cuit_desde + np.arange(n)).astype('str')})
+
+    for dom in ['dom_fiscal', 'dom_legal']:
+        data[f'{dom}_provincia'] = np.array(provincias, dtype= 'object')[rng.integers(0, len(provincias), n)]
+        data[f'{dom}_localidad'] = 'LOCALIDAD ' + pd.Series(rng.integers(0, 2000, n)).astype('str')
+        data[f'{dom}_calle'] = 'CALLE ' + pd.Series(rng.integers(0, 20000, n)).astype('str')
+        data[f'{dom}_numero'] = pd.Series(rng.integers(1, 10000, n)).astype('str')
+        data[f'{dom}_piso'] = np.array(pisos, dtype= 'object')[rng.integers(0, len(pisos), n)]
+        data[f'{dom}_departamento'] = np.array(deptos, dtype= 'object')[rng.integers(0, len(deptos), n)]
+        data[f'{dom}_cp'] = pd.Series(rng.integers(1000, 9500, n)).astype('str')
+        data[f'{dom}_estado_domicilio'] = np.array(estados_domicilio, dtype= 'object')[rng.integers(0, len(estados_domicilio), n)]
+
+    return data[headers if headers is not None else leo_headers()]
+
+
+def ensucio_registros(data, rng, p_sucios):
+
+    '''
+        Agrego a los registros los problemas que se ven en los archivos del RNS. Cada problema se aplica a una
+        proporcion p_sucios de los registros, elegidos de forma independiente:
+            CUITs invalidos, razon social o fecha de contrato vacias, fechas de contrato posteriores al archivo,
+            mayusculas/espacios/acentos distintos, pisos largos, codigos postales CPA y numeros de calle no numericos
+
+        input:
+            data: (pandas.DataFrame) Registros limpios (genero_registros)
+            rng: (numpy.random.Generator) Generador de numeros aleatorios
+            p_sucios: (float) Proporcion de registros con cada problema
+        output:
+            data: (pandas.DataFrame) Registros con problemas
+    '''
+
+    n = data.shape[0]
+
+    def muestra():
+        return rng.random(n) < p_sucios
+
+    data.loc[muestra(), 'cuit'] = data['cuit'].str[1:]
+    data.loc[muestra(), 'razon_social'] = ''
+    data.loc[muestra(), 'fecha_contrato_social'] = ''
+    data.loc[muestra(), 'fecha_contrato_social'] = '2999-01-01 00:00:00'
+    data.loc[muestra(), 'razon_social'] = '  ' + data['razon_social'].str.lower() + '   '
+    data.loc[muestra(), 'dom_fiscal_provincia'] = data['dom_fiscal_provincia'].str.title() + ' '
+    data.loc[muestra(), 'dom_legal_provincia'] = data['dom_legal_provincia'].str.replace('O', 'Ó', regex= False)
+    data.loc[muestra(), 'tipo_societario'] = data['tipo_societario'].str.replace(' ', '  ', regex= False)
+    data.loc[muestra(), 'dom_fiscal_piso'] = 'PISO ' + data['dom_fiscal_piso'] + ' OFICINA INTERNA SECTOR B'
+    data.loc[muestra(), 'dom_fiscal_cp'] = 'C' + data['dom_fiscal_cp'] + 'ABC'
+    data.loc[muestra(), 'dom_legal_numero'] = 'S/N'
+
+    return data
+
+
+def genero_periodos_rns(n_registros, n_periodos= 2, periodo_inicial= 202101, p_cambios= 0.02, p_altas= 0.01,
+                        p_bajas= 0.005, p_sucios= 0.01, semilla= 0, headers= None):
+
+    '''
+        Genero archivos mensuales sinteticos del RNS. Entre un mes y el siguiente una proporcion p_cambios de los
+        registros cambia de razon social o domicilio, se dan de alta p_altas CUITs nuevos y se dan de baja p_bajas.
+        Los problemas de ensucio_registros quedan fijos en cada registro, asi no generan cambios entre meses.
+
+        input:
+            n_registros: (int) Cantidad de registros del primer periodo
+            n_periodos: (int) Cantidad de periodos a generar
+            periodo_inicial: (int) Primer periodo AAAAMM
+            p_cambios: (float) Proporcion de registros que cambian de un mes al siguiente
+            p_altas: (float) Proporcion de CUITs nuevos por mes
+            p_bajas: (float) Proporcion de CUITs que dejan de estar por mes
+            p_sucios: (float) Proporcion de registros con cada problema (ver ensucio_registros)
+            semilla: (int) Semilla, con la misma semilla los archivos son los mismos
+            headers: (list) Headers de los archivos. Si es None los leo de data/headers.csv (ver leo_headers)
+        output:
+            -> Generador de (periodo, data) con data (pandas.DataFrame) con las columnas de headers
+    '''
+
+    rng = np.random.default_rng(semilla)
+    if headers is None:
+        headers = leo_headers()
+    periodo = periodo_inicial
+
+    data = ensucio_registros(genero_registros(n_registros, rng, periodo, headers= headers), rng, p_sucios)
+    cuit_desde = int(n_registros)
+
+    for i in range(n_periodos):
+        if i > 0:
+            periodo = periodo + 1 if periodo % 100 != 12 else (periodo // 100 + 1) * 100 + 1
+            n = data.shape[0]
+
+            # Cambios: razon social, domicilio fiscal o numero de calle
+            nuevos = genero_registros(n, rng, periodo, cuit_desde, headers)
+            cambio = rng.random(n) < p_cambios
+            campo = rng.choice(np.array(['razon_social', 'dom_fiscal_calle', 'dom_legal_numero']), n)
+            for col in ['razon_social', 'dom_fiscal_calle', 'dom_legal_numero']:
+                filas = cambio & (campo == col)
+                data.loc[filas, col] = nuevos.loc[filas, col].to_numpy()
+                data.loc[filas, 'fecha_actualizacion'] = nuevos.loc[filas, 'fecha_actualizacion'].to_numpy()
+
+            # Bajas y altas
+            data = data.loc[rng.random(n) >= p_bajas, :]
+            n_altas = int(n * p_altas)
+            altas = ensucio_registros(genero_registros(n_altas, rng, periodo, cuit_desde, headers), rng, p_sucios)
+            cuit_desde += n_altas
+            data = pd.concat([data, altas], ignore_index= True)
+
+        yield periodo, data.copy()
+
+
+def genero_archivos_rns(carpeta, n_registros, n_periodos= 2, **kwargs):
+
+    '''
+        Escribo los archivos sinteticos de genero_periodos_rns como registro-nacional-sociedades-AAAAMM.csv
+
+        input:
+            carpeta: (str) Carpeta donde dejo los archivos
+            n_registros: (int) Cantidad de registros del primer periodo
+            n_periodos: (int) Cantidad de periodos a generar
+            kwargs: Parametros de genero_periodos_rns
+        output:
+            archivos: (list) Lista de (periodo, path) de los archivos generados
+    '''
+
+    os.makedirs(carpeta, exist_ok= True)
+
+    archivos = []
+    for periodo, data in genero_periodos_rns(n_registros, n_periodos, **kwargs):
+        path = os.path.join(carpeta, f'registro-nacional-sociedades-{periodo}.csv')
+        data.to_csv(path, index= False, encoding= 'utf-8')
+        archivos.append((periodo, path))
+
+    return archivos
+
+
+def mido_etapa(resultados, etapa, periodo, funcion, *args, registros= None, medir_memoria= True, **kwargs):
+
+    '''
+        Corro una etapa del proceso midiendo tiempo, tiempo de CPU y pico de memoria (tracemalloc, incluye lo que
+        reserva numpy/pandas) y agrego la medicion a resultados
+
+        input:
+            resultados: (list) Lista de mediciones a completar
+            etapa: (str) Nombre de la etapa
+            periodo: (int) Periodo que se esta procesando
+            funcion: (function) Funcion a correr, con args y kwargs
+            registros: (int) Registros procesados por la etapa. Si es None uso el largo del primer argumento o del resultado
+            medir_memoria: (bool) Si es False no uso tracemalloc. tracemalloc hace bastante mas lentas las etapas de pandas,
+                           los tiempos solo son comparables entre corridas con el mismo medir_memoria
+        output:
+            -> Lo que devuelve funcion
+    '''
+
+    if registros is None:
+        registros = len(args[0]) if args and hasattr(args[0], '__len__') and not isinstance(args[0], str) else None
+
+    if medir_memoria:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    inicio, inicio_cpu = time.perf_counter(), time.process_time()
+    valor = funcion(*args, **kwargs)
+    segundos, segundos_cpu = time.perf_counter() - inicio, time.process_time() - inicio_cpu
+
+    if registros is None and hasattr(valor, 'shape'):
+        registros = valor.shape[0]
+
+    memoria_pico = None
+    if medir_memoria:
+        memoria_pico = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    resultados.append({'etapa': etapa,
+                       'periodo': periodo,
+                       'registros': registros,
+                       'segundos': round(segundos, 4),
+                       'segundos_cpu': round(segundos_cpu, 4),
+                       'memoria_pico_mb': None if memoria_pico is None else round(memoria_pico, 2),
+                       'registros_por_segundo': None if not registros or segundos == 0 else round(registros / segundos)})
+
+    return valor
+
+
+def version_codigo():
+
+    '''
+        Commit de git del codigo que se esta midiendo, para comparar resultados entre versiones
+
+        input:
+        output:
+            version: (str) Hash corto del commit (con -dirty si hay cambios sin commitear) o None si no hay git
+    '''
+
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output= True, text= True, check= True).stdout.strip()
+    except Exception:
+        return None
+
+
+def corro_benchmark(n_registros= 100e3, n_periodos= 2, p_cambios= 0.02, p_altas= 0.01, p_bajas= 0.005, p_sucios= 0.01,
+                    semilla= 0, carpeta= None, backend= None, metodo_insert= 'executemany', medir_memoria= True, salida= None):
+
+    '''
+        Mido cada etapa del proceso sobre archivos sinteticos: lectura, proceso_columnas, filtro_registros_invalidos,
+        codifico_columnas, base_para_comprar, calculo_digest, base_final_para_actualizar (completo y digest) y, si
+        hay backend, inserto_cuits y update_cuits. La base vigente se mantiene en memoria entre periodos.
+
+        Con backend 'mysql' se escribe en empresas.registro_sociedades de la conexion configurada en artifacts,
+        usar solo contra una base local de prueba. Con 'duckdb' o 'sqlite' se usa un backend embebido nuevo en
+        carpeta/embebido (ver backend_functions). Salvo con 'mysql' los lookups son los de lookups_sinteticos.
+        Los archivos se generan y se leen con los headers de data/headers.csv, como en el proceso.
+
+        input:
+            n_registros: (int) Cantidad de registros del primer periodo
+            n_periodos: (int) Cantidad de periodos
+            p_cambios, p_altas, p_bajas, p_sucios: (float) Parametros de genero_periodos_rns
+            semilla: (int) Semilla de los archivos
+            carpeta: (str) Carpeta para los archivos. Si es None uso una carpeta temporal que se borra al final
+            backend: (str) None (sin etapas de base de datos), 'mysql', 'duckdb' o 'sqlite'
+            metodo_insert: (str) Metodo de pf.inserto_cuits
+            medir_memoria: (bool) Si es False no mido el pico de memoria
+            salida: (str) Path del .json con los resultados. Si es None no se guardan
+        output:
+            resultado: (dict) Parametros, version del codigo y mediciones por etapa y periodo
+    '''
+
+    parametros = {'n_registros': int(n_registros), 'n_periodos': n_periodos, 'p_cambios': p_cambios, 'p_altas': p_altas,
+                  'p_bajas': p_bajas, 'p_sucios': p_sucios, 'semilla': semilla, 'backend': backend,
+                  'metodo_insert': metodo_insert, 'medir_memoria': medir_memoria}
+
+    carpeta_temporal = None
+    if carpeta is None:
+        carpeta_temporal = tempfile.TemporaryDirectory()
+        carpeta = carpeta_temporal.name
+
+    if backend == 'mysql':
+        lookups = pf.descargo_lookups(forzar= True)
+    else:
+        lookups = lookups_sinteticos()
+    
+    if backend in ('duckdb', 'sqlite'):
+        shutil.rmtree(os.path.join(carpeta, 'embebido'), ignore_errors= True)
+        bk.configuro_backend(backend, os.path.join(carpeta, 'embebido'))
+        bk.cargo_lookups_embebido(lookups)
+    elif backend == 'mysql':
+        bk.configuro_backend('mysql')
+
+    mediciones = []
+    base_vigente = None
+
+    try:
+        archivos = genero_archivos_rns(carpeta, n_registros, n_periodos, p_cambios= p_cambios, p_altas= p_altas,
+                                       p_bajas= p_bajas, p_sucios= p_sucios, semilla= semilla)
+
+        for periodo, path in archivos:
+
+            skip, headers = uf.check_headers(path)
+            rns = mido_etapa(mediciones, 'lectura', periodo, pd.read_csv, path, header= None, names= headers, skiprows= skip,
+                             dtype= pf.tipos_lectura(headers), encoding= 'utf-8-sig', medir_memoria= medir_memoria)
+            rns = rns.drop(columns= 'numero_inscripcion')
+
+            rns = mido_etapa(mediciones, 'proceso_columnas', periodo, pf.proceso_columnas, rns, periodo, medir_memoria= medir_memoria)
+            rns = mido_etapa(mediciones, 'filtro_registros_invalidos', periodo, pf.filtro_registros_invalidos, rns, medir_memoria= medir_memoria)
+            rns, _ = mido_etapa(mediciones, 'codifico_columnas', periodo, pf.codifico_columnas, rns, lookups, medir_memoria= medir_memoria)
+            base = mido_etapa(mediciones, 'base_para_comprar', periodo, pf.base_para_comprar, rns, medir_memoria= medir_memoria)
+            del rns
+
+            digest = mido_etapa(mediciones, 'calculo_digest', periodo, pf.calculo_digest, base, medir_memoria= medir_memoria)
+
+            if base_vigente is None:
+                base_vigente = base.iloc[0:0].assign(fh_inicio_registro= pd.Timestamp('1900-01-01'), fh_fin_registro= pd.Timestamp('2100-12-31'))
+
+            base_insert, base_update = mido_etapa(mediciones, 'base_final_para_actualizar', periodo, pf.base_final_para_actualizar,
+                                                  base, base_vigente, 0, periodo, medir_memoria= medir_memoria)
+
+            digest_vigente = pd.DataFrame({'nu_cuit': base_vigente['nu_cuit'].to_numpy(), 'nu_digest': pf.calculo_digest(base_vigente).to_numpy()})
+            mido_etapa(mediciones, 'base_final_para_actualizar_digest', periodo, pf.base_final_para_actualizar_digest,
+                       base, digest_vigente, 0, periodo, medir_memoria= medir_memoria)
+
+            if backend is not None:
+                mido_etapa(mediciones, 'inserto_cuits', periodo, pf.inserto_cuits, base_insert, 'empresas', metodo= metodo_insert,
+                           medir_memoria= medir_memoria)
+                mido_etapa(mediciones, 'update_cuits', periodo, pf.update_cuits, base_update,
+                           medir_memoria= medir_memoria)
+
+            base_vigente = mido_etapa(mediciones, 'aplico_novedad', periodo, sf.aplico_novedad, base_vigente, base_insert, base_update,
+                                      registros= base_insert.shape[0] + base_update.shape[0], medir_memoria= medir_memoria)
+
+            mediciones.append({'etapa': 'novedad', 'periodo': periodo, 'registros': base.shape[0], 'insertados': base_insert.shape[0],
+                               'updateados': base_update.shape[0], 'digest_registros': int(digest.shape[0])})
+    finally:
+        if carpeta_temporal is not None:
+            carpeta_temporal.cleanup()
+
+    resultado = {'fecha': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                 'version': version_codigo(),
+                 'python': platform.python_version(),
+                 'pandas': pd.__version__,
+                 'numpy': np.__version__,
+                 'parametros': parametros,
+                 'mediciones': mediciones}
+
+    if salida is not None:
+        os.makedirs(os.path.dirname(salida) or '.', exist_ok= True)
+        with open(salida, 'w') as f:
+            json.dump(resultado, f, indent= 2)
+
+    return resultado
+
+
+def comparo_benchmarks(path_anterior, path_actual):
+
+    '''
+        Comparo dos resultados de corro_benchmark etapa por etapa (sumando los periodos). Tienen que estar corridos
+        con los mismos parametros (registros, semilla, medir_memoria) para que la comparacion tenga sentido
+
+        input:
+            path_anterior: (str) Path del .json de referencia
+            path_actual: (str) Path del .json a comparar
+        output:
+            comparacion: (pandas.DataFrame) Segundos y memoria pico de cada etapa en los dos resultados y el cociente actual/anterior
+    '''
+
+    bases = []
+    for path, sufijo in [(path_anterior, 'anterior'), (path_actual, 'actual')]:
+        with open(path, 'r') as f:
+            mediciones = pd.DataFrame([m for m in json.load(f)['mediciones'] if 'segundos' in m])
+        bases.append(mediciones.groupby('etapa', sort= False).agg(segundos= ('segundos', 'sum'), memoria_pico_mb= ('memoria_pico_mb', 'max'))
+                                .add_suffix('_' + sufijo))
+
+    comparacion = bases[0].join(bases[1], how= 'outer')
+    comparacion['ratio_segundos'] = (comparacion['segundos_actual'] / comparacion['segundos_anterior']).round(2)
+    comparacion['ratio_memoria'] = (comparacion['memoria_pico_mb_actual'] / comparacion['memoria_pico_mb_anterior']).round(2)
+
+    return comparacion
@@ -0,0 +1,281 @@
+import os
+import re
+import json
+import numpy as np
+import pandas as pd
+import process_file_functions as pf
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+cdc_path = './data/cdc'
+
+# Bit de cada columna en nu_columnas_cambiadas: la columna i de columnas_cdc es el bit 2**i
+columnas_cdc = [col for col in pf.variables_finales if col != 'nu_cuit']
+mascara_todas = 2 ** len(columnas_cdc) - 1
+mascara_desconocida = -1
+
+operaciones = ['insert', 'update']
+
+
+def mascara_columnas(columnas):
+
+    '''
+        Mascara de bits de una lista de columnas (ver columnas_cdc)
+
+        input:
+            columnas: (list) Columnas de columnas_cdc
+        output:
+            mascara: (int) Suma de los bits de las columnas
+    '''
+
+    return sum(2 ** columnas_cdc.index(col) for col in columnas)
+
+
+def columnas_de_mascara(mascara):
+
+    '''
+        Columnas de una mascara de bits (ver columnas_cdc)
+
+        input:
+            mascara: (int) nu_columnas_cambiadas de un registro
+        output:
+            columnas: (list) Columnas que cambiaron. None si la mascara es mascara_desconocida
+    '''
+
+    if mascara == mascara_desconocida:
+        return None
+
+    return [col for i, col in enumerate(columnas_cdc) if int(mascara) >> i & 1]
+
+
+def calculo_columnas_cambiadas(base_update, base_anterior):
+
+    '''
+        Calculo que columnas cambiaron en cada CUIT updateado contra su version anterior
+
+        input:
+            base_update: (pandas.DataFrame) CUITs updateados con las variables_finales
+            base_anterior: (pandas.DataFrame) Base vigente antes del periodo (un registro por CUIT)
+        output:
+            mascaras: (numpy.array) Mascara int64 de cada CUIT, mascara_desconocida si no esta en base_anterior
+    '''
+
+    cuits = base_update['nu_cuit'].to_numpy(dtype= 'int64')
+    anterior = base_anterior.drop_duplicates('nu_cuit', keep= 'last').set_index('nu_cuit')
+    encontrado = np.isin(cuits, anterior.index.to_numpy())
+    anterior = anterior.reindex(cuits)
+
+    mascaras = np.zeros(cuits.shape[0], dtype= 'int64')
+    for i, col in enumerate(columnas_cdc):
+        iguales = pf.registros_iguales(base_update[[col]], anterior[[col]])
+        mascaras |= (~iguales).astype('int64') << i
+
+    mascaras[~encontrado] = mascara_desconocida
+
+    return mascaras
+
+
+def armo_cdc(base_insert, base_update, base_anterior= None):
+
+    '''
+        Armo los registros de cambios de un periodo: un insert por cada CUIT nuevo y un update por cada CUIT que
+        cambio, con el inicio de la version nueva, el cierre de la version anterior y las columnas que cambiaron
+
+        input:
+            base_insert: (pandas.DataFrame) CUITs insertados (pf.base_final_para_actualizar)
+            base_update: (pandas.DataFrame) CUITs updateados (pf.base_final_para_actualizar)
+            base_anterior: (pandas.DataFrame) Base vigente antes del periodo para saber que columnas cambiaron.
+                           Si es None los updates quedan con mascara_desconocida
+        output:
+            cdc: (pandas.DataFrame) nu_cuit, tx_operacion, fh_inicio_registro, fh_fin_registro_anterior,
+                 nu_columnas_cambiadas, nu_digest y cd_log_proceso, ordenados por CUIT
+    '''
+
+    if base_anterior is not None:
+        mascaras = calculo_columnas_cambiadas(base_update, base_anterior)
+    else:
+        mascaras = np.full(base_update.shape[0], mascara_desconocida, dtype= 'int64')
+
+    inserts = pd.DataFrame({'nu_cuit': base_insert['nu_cuit'].to_numpy(dtype= 'int64'),
+                            'tx_operacion': 'insert',
+                            'fh_inicio_registro': pd.to_datetime(base_insert['fh_inicio_registro']).to_numpy(),
+                            'fh_fin_registro_anterior': pd.NaT,
+                            'nu_columnas_cambiadas': mascara_todas,
+                            'nu_digest': pf.a_entero(base_insert['nu_digest']).array if 'nu_digest' in base_insert else pd.NA,
+                            'cd_log_proceso': pf.a_entero(base_insert['cd_log_proceso']).array})
+
+    inicio_update = pd.to_datetime(base_update['fh_inicio_registro'])
+    updates = pd.DataFrame({'nu_cuit': base_update['nu_cuit'].to_numpy(dtype= 'int64'),
+                            'tx_operacion': 'update',
+                            'fh_inicio_registro': inicio_update.to_numpy(),
+                            'fh_fin_registro_anterior': (inicio_update - pd.Timedelta(days= 1)).to_numpy(),
+                            'nu_columnas_cambiadas': mascaras,
+                            'nu_digest': pf.a_entero(base_update['nu_digest']).array if 'nu_digest' in base_update else pd.NA,
+                            'cd_log_proceso': pf.a_entero(base_update['cd_log_proceso']).array})
+
+    cdc = pd.concat([inserts, updates], ignore_index= True).sort_values('nu_cuit', kind= 'stable').reset_index(drop= True)
+
+    cdc['tx_operacion'] = pd.Categorical(cdc['tx_operacion'], categories= operaciones)
+    cdc['fh_fin_registro_anterior'] = pd.to_datetime(cdc['fh_fin_registro_anterior'])
+    cdc['nu_columnas_cambiadas'] = cdc['nu_columnas_cambiadas'].astype('int64')
+    cdc['nu_digest'] = pf.a_entero(cdc['nu_digest'])
+    cdc['cd_log_proceso'] = pf.a_entero(cdc['cd_log_proceso'])
+
+    return cdc
+
+
+def esquema_cdc():
+
+    '''
+        Esquema Arrow de los archivos de cambios, el mismo en todos los periodos
+    '''
+
+    return pa.schema([pa.field('nu_cuit', pa.int64()),
+                      pa.field('tx_operacion', pa.dictionary(pa.int8(), pa.string())),
+                      pa.field('fh_inicio_registro', pa.timestamp('ns')),
+                      pa.field('fh_fin_registro_anterior', pa.timestamp('ns')),
+                      pa.field('nu_columnas_cambiadas', pa.int64()),
+                      pa.field('nu_digest', pa.int64()),
+                      pa.field('cd_log_proceso', pa.int64())])
+
+
+def exporto_cdc(base_insert, base_update, periodo, base_anterior= None, carpeta= cdc_path):
+
+    '''
+        Exporto los cambios de un periodo que ya quedo en MySql a carpeta/cdc_AAAAMM.parquet. Se escribe a un archivo
+        temporal y se renombra, asi un consumidor nunca ve un periodo a medio escribir; volver a exportar el mismo
+        periodo lo reemplaza. La lista de columnas de la mascara queda en la metadata del archivo.
+
+        input:
+            base_insert: (pandas.DataFrame) CUITs insertados en el periodo
+            base_update: (pandas.DataFrame) CUITs updateados en el periodo
+            periodo: (int) Periodo AAAAMM cargado
+            base_anterior: (pandas.DataFrame) Base vigente antes del periodo (ver armo_cdc)
+            carpeta: (str) Carpeta de los archivos de cambios
+        output:
+            resumen: (dict) Inserts, updates, updates con columnas conocidas y bytes. None si no esta instalado pyarrow
+    '''
+
+    if pa is None:
+        return None
+
+    cdc = armo_cdc(base_insert, base_update, base_anterior)
+
+    tabla = pa.Table.from_pandas(cdc, schema= esquema_cdc(), preserve_index= False)
+    tabla = tabla.replace_schema_metadata({b'cd_periodo_proceso': str(periodo).encode(),
+                                           b'columnas_cdc': json.dumps(columnas_cdc).encode()})
+
+    os.makedirs(carpeta, exist_ok= True)
+    path = os.path.join(carpeta, f'cdc_{periodo}.parquet')
+    pq.write_table(tabla, path + '.tmp', compression= 'zstd')
+    os.replace(path + '.tmp', path)
+
+    updates = cdc['tx_operacion'] == 'update'
+
+    return {'inserts': int((~updates).sum()), 'updates': int(updates.sum()),
+            'updates_con_columnas': int((updates & (cdc['nu_columnas_cambiadas'] != mascara_desconocida)).sum()),
+            'bytes': os.path.getsize(path)}
+
+
+def periodos_cdc(carpeta= cdc_path):
+
+    '''
+        Periodos con archivo de cambios
+
+        input:
+            carpeta: (str) Carpeta de los archivos de cambios
+        output:
+            periodos: (list) Periodos AAAAMM ordenados
+    '''
+
+    if not os.path.exists(carpeta):
+        return []
+
+    return sorted(int(periodo) for archivo in os.listdir(carpeta) for periodo in re.findall(r'^cdc_(\d{6})\.parquet$', archivo))
+
+
+def leo_cdc(periodo, carpeta= cdc_path):
+
+    '''
+        Leo los cambios de un periodo
+
+        input:
+            periodo: (int) Periodo AAAAMM
+            carpeta: (str) Carpeta de los archivos de cambios
+        output:
+            cdc: (pandas.DataFrame) Cambios del periodo con la columna cd_periodo_proceso
+    '''
+
+    if pq is None:
+        raise ImportError('Para leer los cambios hay que instalar pyarrow (pip install pyarrow)')
+
+    enteros = {pa.int64(): pd.Int64Dtype()}
+    cdc = pq.read_table(os.path.join(carpeta, f'cdc_{periodo}.parquet')).to_pandas(types_mapper= enteros.get)
+    cdc['nu_cuit'] = cdc['nu_cuit'].astype('int64')
+    cdc['nu_columnas_cambiadas'] = cdc['nu_columnas_cambiadas'].astype('int64')
+    cdc['cd_periodo_proceso'] = periodo
+
+    return cdc
+
+
+def sigo_cdc(ultimo_periodo_leido= None, carpeta= cdc_path):
+
+    '''
+        Recorro en orden los periodos posteriores a ultimo_periodo_leido, para que un consumidor lea solo lo nuevo
+
+        input:
+            ultimo_periodo_leido: (int) Ultimo periodo AAAAMM que ya leyo el consumidor. Si es None desde el primero
+            carpeta: (str) Carpeta de los archivos de cambios
+        output:
+            cambios: (generator) (periodo, cdc) de cada periodo nuevo
+    '''
+
+    for periodo in periodos_cdc(carpeta):
+        if ultimo_periodo_leido is None or periodo > ultimo_periodo_leido:
+            yield periodo, leo_cdc(periodo, carpeta)
+
+
+class consumidor_cdc:
+
+    '''
+        Consumidor de los cambios con su posicion guardada en carpeta/consumidores/nombre.json. pendientes recorre
+        los periodos nuevos y confirmo avanza la posicion cuando el consumidor termino de procesar un periodo, asi
+        si se corta vuelve a leer desde el primero sin confirmar.
+    '''
+
+    def __init__(self, nombre, carpeta= cdc_path):
+
+        '''
+            input:
+                nombre: (str) Nombre del consumidor
+                carpeta: (str) Carpeta de los archivos de cambios
+        '''
+
+        self.carpeta = carpeta
+        self.path = os.path.join(carpeta, 'consumidores', f'{nombre}.json')
+        self.ultimo_periodo = None
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.ultimo_periodo = json.load(f)['ultimo_periodo']
+
+    def pendientes(self):
+        return sigo_cdc(self.ultimo_periodo, self.carpeta)
+
+    def confirmo(self, periodo):
+
+        '''
+            Guardo periodo como el ultimo procesado por el consumidor (archivo temporal y rename)
+        '''
+
+        os.makedirs(os.path.dirname(self.path), exist_ok= True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'ultimo_periodo': periodo}, f)
+        os.replace(self.path + '.tmp', self.path)
+
+        self.ultimo_periodo = periodo
@@ -0,0 +1,226 @@
+import os
+import json
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+import utils_file_functions as uf
+import process_file_functions as pf
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+checkpoint_path = './data/checkpoints'
+
+
+class checkpoint_periodo:
+
+    '''
+        Checkpoint de la carga de un periodo en carpeta/AAAAMM, para que si falla la corrida siguiente siga desde
+        donde quedo en lugar de volver a procesar el archivo:
+            - estado.json: etapas terminadas y rangos de rns_insert ya commiteados en MySql
+            - insert.parquet y update.parquet: las bases a insertar y updatear que salieron de la comparacion. Los
+              rangos commiteados son posiciones en estas bases, por eso al seguir se usan las guardadas y no se
+              vuelve a comparar (contra MySql con parte del periodo ya cargado daria otras bases)
+        El update de los CUITs que cambiaron es una sola transaccion (pf.update_cuits), asi que se guarda como etapa
+        entera. Cuando el periodo termina bien se borra el checkpoint.
+    '''
+
+    def __init__(self, periodo, carpeta= checkpoint_path):
+
+        '''
+            input:
+                periodo: (int) Periodo AAAAMM
+                carpeta: (str) Carpeta de los checkpoints
+        '''
+
+        self.periodo = periodo
+        self.path = os.path.join(carpeta, str(periodo))
+        self._lock = threading.Lock()
+
+        self.estado = {'periodo': periodo, 'etapas': [], 'insert_commiteados': []}
+        if os.path.exists(os.path.join(self.path, 'estado.json')):
+            with open(os.path.join(self.path, 'estado.json')) as f:
+                self.estado = json.load(f)
+
+    def _guardo_estado(self):
+        os.makedirs(self.path, exist_ok= True)
+        path = os.path.join(self.path, 'estado.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.estado, f)
+        os.replace(path + '.tmp', path)
+
+    def hecho(self, etapa):
+        return etapa in self.estado['etapas']
+
+    def marco(self, etapa):
+
+        '''
+            Marco una etapa como terminada
+        '''
+
+        with self._lock:
+            if etapa not in self.estado['etapas']:
+                self.estado['etapas'].append(etapa)
+            self._guardo_estado()
+
+    def guardo_bases(self, base_insert, base_update):
+
+        '''
+            Guardo las bases a insertar y updatear y marco la comparacion como terminada. Sin pyarrow no se guarda
+            nada y una corrida siguiente vuelve a comparar.
+
+            input:
+                base_insert: (pandas.DataFrame) CUITs a insertar
+                base_update: (pandas.DataFrame) CUITs a updatear
+            output:
+        '''
+
+        if pa is None:
+            return
+
+        os.makedirs(self.path, exist_ok= True)
+        for nombre, base in [('insert', base_insert), ('update', base_update)]:
+            path = os.path.join(self.path, f'{nombre}.parquet')
+            pq.write_table(pa.Table.from_pandas(pf.aplico_esquema(base), preserve_index= False), path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+        self.estado.update({'etapas': [], 'insert_commiteados': []})
+        self.marco('comparacion')
+
+    def cargo_bases(self):
+
+        '''
+            Cargo las bases guardadas con guardo_bases
+
+            output:
+                base_insert: (pandas.DataFrame) CUITs a insertar
+                base_update: (pandas.DataFrame) CUITs a updatear
+        '''
+
+        enteros = {pa.int16(): pd.Int16Dtype(), pa.int64(): pd.Int64Dtype()}
+        bases = [pq.read_table(os.path.join(self.path, f'{nombre}.parquet')).to_pandas(types_mapper= enteros.get)
+                 for nombre in ['insert', 'update']]
+
+        return tuple(pf.aplico_esquema(base) for base in bases)
+
+    def commiteado(self, desde, hasta):
+
+        '''
+            Guardo un rango de rns_insert commiteado (se usa como al_commitear de pf.inserto_cuits, puede llamarse
+            desde varios threads)
+        '''
+
+        with self._lock:
+            self.estado['insert_commiteados'] = uf.uno_rangos(self.estado['insert_commiteados'] + [[desde, hasta]])
+            self._guardo_estado()
+
+    def insert_commiteados(self):
+        return [tuple(rango) for rango in self.estado['insert_commiteados']]
+
+    def reinicio(self):
+
+        '''
+            Descarto lo que haya de una corrida anterior (se vuelve a comparar, los rangos guardados ya no sirven)
+        '''
+
+        self.borro()
+        self.estado = {'periodo': self.periodo, 'etapas': [], 'insert_commiteados': []}
+
+    def borro(self):
+
+        '''
+            Borro el checkpoint cuando el periodo termino bien
+        '''
+
+        shutil.rmtree(self.path, ignore_errors= True)
+
+
+def cuits_cargados_periodo(periodo, cuits):
+
+    '''
+        Busco cuales de los CUITs ya tienen una version del periodo en empresas.registro_sociedades. Cubre los chunks
+        que quedaron commiteados sin que se llegara a guardar el checkpoint (si la corrida se corto entre el commit
+        y el guardado)
+
+        input:
+            periodo: (int) Periodo AAAAMM
+            cuits: (numpy.array) CUITs a buscar
+        output:
+            cargados: (numpy.array) True en los CUITs que ya tienen una version con cd_periodo_proceso = periodo
+    '''
+
+    cargados = np.zeros(cuits.shape[0], dtype= bool)
+    if cuits.shape[0] == 0:
+        return cargados
+
+    mysql = pf.make_mysql_connection('empresas')
+    encontrados = []
+
+    with mysql.cursor() as cur:
+        i = 0
+        for chunk in uf.get_chunks(cuits.shape[0]):
+            lote = [int(cuit) for cuit in cuits[i:chunk]]
+            cur.execute('select nu_cuit from registro_sociedades where cd_periodo_proceso = %s and nu_cuit in (%s)'
+                        % (int(periodo), ','.join(['%s'] * len(lote))), lote)
+            encontrados += [fila[0] for fila in cur.fetchall()]
+            i = chunk
+
+    mysql.close()
+
+    return np.isin(cuits, np.array(encontrados, dtype= 'int64'))
+
+
+def rangos_insert_hechos(checkpoint, base_insert):
+
+    '''
+        Rangos de base_insert que no hay que volver a insertar al seguir un periodo: los commiteados segun el
+        checkpoint y los CUITs pendientes que ya estan en MySql con el periodo
+
+        input:
+            checkpoint: (checkpoint_periodo) Checkpoint del periodo
+            base_insert: (pandas.DataFrame) CUITs a insertar (checkpoint.cargo_bases)
+        output:
+            hechos: (list) Rangos (desde, hasta) ya cargados
+    '''
+
+    hechos = checkpoint.insert_commiteados()
+
+    pendientes = np.ones(base_insert.shape[0], dtype= bool)
+    for desde, hasta in hechos:
+        pendientes[desde:hasta] = False
+
+    cuits = base_insert['nu_cuit'].to_numpy(dtype= 'int64')
+    cargados = np.zeros(base_insert.shape[0], dtype= bool)
+    cargados[pendientes] = cuits_cargados_periodo(checkpoint.periodo, cuits[pendientes])
+
+    return uf.uno_rangos(hechos + uf.rangos_de_mascara(cargados))
+
+
+def update_en_base(periodo, base_update):
+
+    '''
+        Me fijo si el update del periodo ya quedo commiteado (pf.update_cuits es una sola transaccion: estan todas las
+        versiones nuevas del periodo o ninguna). Cubre una corrida que se corto entre el commit y el checkpoint.
+        Busco todos los CUITs: si estan solo algunos la base no es la que dejo update_cuits y no sigo.
+
+        input:
+            periodo: (int) Periodo AAAAMM
+            base_update: (pandas.DataFrame) CUITs a updatear (checkpoint.cargo_bases)
+        output:
+            hecho: (bool) True si las versiones nuevas ya estan en MySql
+    '''
+
+    if base_update.shape[0] == 0:
+        return True
+
+    cargados = cuits_cargados_periodo(periodo, base_update['nu_cuit'].to_numpy(dtype= 'int64'))
+
+    if cargados.all() or not cargados.any():
+        return bool(cargados.all())
+
+    raise ValueError(f'El update del periodo {periodo} quedo a medias: {cargados.sum()} de {cargados.shape[0]} CUITs ya tienen la version del periodo')
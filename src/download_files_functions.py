@@ -1,9 +1,19 @@
+import os
 import re
+import json
+import time
+import threading
 import urllib.request, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from bs4 import BeautifulSoup
-from zipfile import ZipFile
-    
+from zipfile import ZipFile, BadZipFile
+
+cache_descargas_path = 'data/zip/descargas.json'
+
+# La cache de descargas se comparte entre las descargas simultaneas (ver descargo_archivos)
+_lock_cache = threading.Lock()
+
 def download_file(url, last_period_updated):
     '''
         Se fija que archivos estan disponibles en la pagina y actualiza el mes siguiente a last_period_updated
@@ -12,7 +22,7 @@ def download_file(url, last_period_updated):
             url: Web de donde se descargan los datos
             last_period_updated: string, AAAAMM fecha de la ultima actualizacion
         output:
-            files_downloaded: list, Archivos descargados
+            files_downloaded: list, Archivos a actualizar como 'archivo.zip/archivo.csv'
     '''
 
     html = urllib.request.urlopen(url).read()
@@ -24,22 +34,55 @@ def download_file(url, last_period_updated):
     
     files_downloaded = []
     if last_zip_url != None:
-        r = requests.get(last_zip_url, stream= True)
         zip_file = 'data/zip/' + re.findall('registro.*', last_zip_url)[0]
+        local_zip_file, _ = descargo_archivo(last_zip_url, zip_file)
+        
+        # Si ya lo tenia en la carpeta del año lo vuelvo a data/zip
+        if local_zip_file != zip_file:
+            os.replace(local_zip_file, zip_file)
 
-        with open(zip_file, 'wb') as zipf:
-            for chunk in r.iter_content(chunk_size= 1024 * 1024 * 10):
-                zipf.write(chunk)
-
-        # Exraigo unicamente los archivos que voy a usar
+        # No extraigo nada: los archivos que voy a usar se leen directo del zip (ver uf.abro_archivo)
         with ZipFile(zip_file, 'r') as zipf:
             for file in zipf.namelist():
                 if re.findall('\d{6}', file)[0] >= next_period_to_update:
-                    zipf.extract(file, 'data/zip')
-                    files_downloaded.append(file)
+                    files_downloaded.append(os.path.basename(zip_file) + '/' + file)
             
     return files_downloaded
 
+def download_files(url, last_period_updated, max_descargas= 3):
+    '''
+        Igual que download_file pero cierra todo el atraso en una corrida: planeo todos los zips desde el mes
+        siguiente a last_period_updated hasta el ultimo publicado (planeo_descargas), los descargo en paralelo
+        (descargo_archivos) y devuelvo los .csv de todos los periodos que faltan, uno por periodo
+        
+        input:
+            url: Web de donde se descargan los datos
+            last_period_updated: string, AAAAMM fecha de la ultima actualizacion
+            max_descargas: int, Descargas simultaneas
+        output:
+            files_downloaded: list, Archivos a actualizar como 'archivo.zip/archivo.csv', ordenados por periodo
+    '''
+
+    html = urllib.request.urlopen(url).read()
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    zips = [tag['href'] for tag in soup.find_all('a') if re.match('.*registro-nacional-sociedades-\d{4}.*\.zip', tag['href']) is not None]
+    
+    url_zips, next_period_to_update = planeo_descargas(zips, last_period_updated)
+    zip_files = descargo_archivos(url_zips, max_descargas)
+    
+    # No extraigo nada: uso los miembros de cada periodo directo del zip (ver uf.abro_archivo). Si un periodo
+    # esta en mas de un zip uso el del ultimo zip del plan
+    files_downloaded = {}
+    for zip_file in zip_files:
+        with ZipFile(zip_file, 'r') as zipf:
+            for file in zipf.namelist():
+                periodo = re.findall('(\d{6})\.csv$', file)
+                if periodo and periodo[0] >= next_period_to_update:
+                    files_downloaded[periodo[0]] = os.path.basename(zip_file) + '/' + file
+    
+    return [files_downloaded[periodo] for periodo in sorted(files_downloaded)]
+
 def get_file_path_to_update(zips, last_period_updated):
 
     '''
@@ -71,4 +114,250 @@ def get_file_path_to_update(zips, last_period_updated):
     else:
         raise ValueError('Hay mas archivos de los que corresponden.')
         
-    return url_zip,next_period_to_update
\ No newline at end of file
+    return url_zip,next_period_to_update
+
+def planeo_descargas(zips, last_period_updated):
+
+    '''
+        Planeo todos los zips que hacen falta para actualizar desde el mes siguiente a last_period_updated hasta
+        el ultimo periodo publicado: todos los zips de cada año desde el del proximo periodo. En el año del proximo
+        periodo, si hay zips por semestre, salteo el del primer semestre cuando el proximo periodo es posterior a junio.
+        input:
+            zips: Lista de los paths de los archivos en la pagina
+            last_period_updated: AAAAMM del ultimo archivo actualizado
+        output:
+            url_zips: list, urls de los zips a descargar ordenadas por año (y semestre)
+            next_period_to_update: string, AAAAMM del proximo periodo a actualizar
+    '''
+    
+    if last_period_updated[-2:] < '12':
+        next_period_to_update = str(int(last_period_updated)+1)
+    else:
+        next_period_to_update = str((int(last_period_updated[:4])+1)*100+1)
+    
+    anios = sorted({re.findall('registro-nacional-sociedades-(\d{4})', url_zip)[0] for url_zip in zips})
+    
+    url_zips = []
+    for anio in [anio for anio in anios if anio >= next_period_to_update[:4]]:
+        url_zips_anio = sorted({url_zip for url_zip in zips if re.match(f'.*registro-nacional-sociedades-{anio}.*', url_zip) is not None})
+        
+        if anio == next_period_to_update[:4] and next_period_to_update[-2:] > '06':
+            url_zips_anio = [url_zip for url_zip in url_zips_anio if re.match('.*semestre.1.*', url_zip) is None]
+        
+        url_zips += url_zips_anio
+    
+    return url_zips, next_period_to_update
+
+def cargo_cache_descargas(path= cache_descargas_path):
+
+    '''
+        Cargo la cache de descargas: por cada url de archivo guardo etag, last_modified, size y path local
+        input:
+            path: Path del .json de la cache
+        output:
+            cache: dict, {url: {'etag', 'last_modified', 'size', 'archivo', 'completo'}}
+    '''
+    
+    if not os.path.exists(path):
+        return {}
+    
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def guardo_cache_descargas(cache, path= cache_descargas_path):
+
+    '''
+        Guardo la cache de descargas
+        input:
+            cache: dict, Cache de descargas (ver cargo_cache_descargas)
+            path: Path del .json de la cache
+        output:
+    '''
+    
+    with open(path + '.tmp', 'w') as f:
+        json.dump(cache, f, indent= 2)
+    os.replace(path + '.tmp', path)
+
+def actualizo_cache_descargas(url, valores, path= cache_descargas_path):
+
+    '''
+        Actualizo los datos de un archivo en la cache de descargas. Leo, actualizo y guardo con un lock para
+        no pisar lo que guardan las otras descargas simultaneas
+        input:
+            url: string, url del archivo
+            valores: dict, Datos a actualizar (ver cargo_cache_descargas)
+            path: Path del .json de la cache
+        output:
+    '''
+    
+    with _lock_cache:
+        cache = cargo_cache_descargas(path)
+        cache[url] = {**cache.get(url, {}), **valores}
+        guardo_cache_descargas(cache, path)
+
+def busco_archivo_local(zip_file):
+
+    '''
+        Busco un zip ya descargado: en data/zip o en la carpeta del año a donde lo mueve app.py
+        input:
+            zip_file: string, path del zip en data/zip
+        output:
+            path: string, path del zip local o None si no esta
+    '''
+    
+    nombre = os.path.basename(zip_file)
+    candidatos = [zip_file] + [os.path.join('data', anio, nombre) for anio in re.findall('\d{4}', nombre)[:1]]
+    
+    for candidato in candidatos:
+        if os.path.exists(candidato):
+            return candidato
+    return None
+
+def verifico_zip(zip_file):
+
+    '''
+        Verifico que el zip este completo y sin errores de CRC antes de extraerlo
+        input:
+            zip_file: string, path del zip
+        output:
+            True si el zip esta bien
+    '''
+    
+    try:
+        with ZipFile(zip_file, 'r') as zipf:
+            return zipf.testzip() is None
+    except (BadZipFile, OSError):
+        return False
+
+def descargo_archivo(url, zip_file, reintentos= 3, chunk_size= 1024 * 1024 * 10):
+
+    '''
+        Descargo un archivo con cache condicional y reanudable:
+            1) Si ya lo tengo completo mando If-None-Match/If-Modified-Since y con un 304 no lo descargo
+            2) Si quedo una descarga cortada (.part) la continuo con Range (If-Range con el etag). Si el servidor
+               responde 416 el .part ya tenia todo: lo verifico y lo dejo en su lugar, o lo borro y empiezo de cero
+            3) Verifico el zip antes de dejarlo en su lugar
+        input:
+            url: string, url del archivo
+            zip_file: string, path donde dejo el archivo
+            reintentos: int, reintentos si se corta la descarga
+            chunk_size: int, bytes por chunk que escribo
+        output:
+            (path, descargado) (tuple)
+                -> path: string, path del archivo local (puede estar en data/AAAA si ya lo tenia)
+                -> descargado: bool, False si no hizo falta descargarlo
+    '''
+    
+    parcial = zip_file + '.part'
+    
+    for intento in range(reintentos + 1):
+        
+        with _lock_cache:
+            info = cargo_cache_descargas().get(url, {})
+        local = busco_archivo_local(zip_file)
+        headers = {}
+        
+        if local is not None and info.get('completo') and os.path.getsize(local) == info.get('size'):
+            if info.get('etag'):
+                headers['If-None-Match'] = info['etag']
+            if info.get('last_modified'):
+                headers['If-Modified-Since'] = info['last_modified']
+        elif os.path.exists(parcial) and (info.get('etag') or info.get('last_modified')):
+            headers['Range'] = 'bytes=%s-' % os.path.getsize(parcial)
+            headers['If-Range'] = info.get('etag') or info['last_modified']
+        
+        try:
+            with requests.get(url, stream= True, headers= headers, timeout= 60) as r:
+                
+                if r.status_code == 304:
+                    return local, False
+                
+                # El .part ya estaba completo (se corto antes de verificarlo): no hay nada que bajar, lo verifico abajo
+                # y si no esta bien lo borro y lo descargo de cero
+                if r.status_code == 416 and 'Range' in headers:
+                    size = re.findall('/(\d+)$', r.headers.get('Content-Range', ''))
+                    size = int(size[0]) if size else os.path.getsize(parcial)
+                    rango_invalido = True
+                else:
+                    r.raise_for_status()
+                    rango_invalido = False
+                    
+                    # Guardo los validadores antes de bajar, para poder reanudar si se corta
+                    actualizo_cache_descargas(url, {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified'),
+                                                    'size': None, 'archivo': zip_file, 'completo': False})
+                    
+                    if r.status_code == 206:
+                        size = int(r.headers['Content-Range'].split('/')[-1])
+                        modo = 'ab'
+                    else:
+                        size = int(r.headers['Content-Length']) if 'Content-Length' in r.headers else None
+                        modo = 'wb'
+                    
+                    with open(parcial, modo) as zipf:
+                        for chunk in r.iter_content(chunk_size= chunk_size):
+                            zipf.write(chunk)
+        
+        except requests.exceptions.RequestException:
+            if intento == reintentos:
+                raise
+            time.sleep(2 ** intento)
+            continue
+        
+        # Si la descarga quedo corta la reanudo en el proximo intento
+        if size is not None and os.path.getsize(parcial) < size and not rango_invalido:
+            if intento == reintentos:
+                raise ValueError(f'El archivo {url} no se descargo completo.')
+            continue
+        
+        if (size is not None and os.path.getsize(parcial) != size) or not verifico_zip(parcial):
+            os.remove(parcial)
+            if intento == reintentos:
+                raise ValueError(f'El archivo {url} no se descargo correctamente.')
+            continue
+        
+        os.replace(parcial, zip_file)
+        actualizo_cache_descargas(url, {'size': os.path.getsize(zip_file), 'completo': True})
+        
+        return zip_file, True
+
+def descargo_archivos(url_zips, max_descargas= 3):
+
+    '''
+        Descargo varios zips en paralelo con descargo_archivo, con hasta max_descargas descargas simultaneas. Los
+        que ya estaban en la carpeta del año vuelven a data/zip, como en download_file
+        input:
+            url_zips: list, urls de los zips
+            max_descargas: int, Descargas simultaneas
+        output:
+            zip_files: list, Paths de los zips en data/zip en el orden de url_zips
+    '''
+    
+    zip_files = ['data/zip/' + re.findall('registro.*', url_zip)[0] for url_zip in url_zips]
+    
+    if not zip_files:
+        return []
+    
+    with ThreadPoolExecutor(max_workers= max(1, min(max_descargas, len(zip_files)))) as descargas:
+        locales = list(descargas.map(lambda descarga: descargo_archivo(*descarga)[0], zip(url_zips, zip_files)))
+    
+    for local_zip_file, zip_file in zip(locales, zip_files):
+        if local_zip_file != zip_file:
+            os.replace(local_zip_file, zip_file)
+    
+    return zip_files
+
+def acomodo_zips(carpeta= 'data/zip'):
+
+    '''
+        Muevo los zips ya cargados de data/zip a la carpeta de su año (data/AAAA)
+        input:
+            carpeta: string, Carpeta de las descargas
+        output:
+    '''
+    
+    for zip_file in [file for file in os.listdir(carpeta) if file[-3:] == 'zip']:
+        anio = re.findall('\d{4}', zip_file)
+        if not anio:
+            continue
+        os.makedirs(os.path.join('data', anio[0]), exist_ok= True)
+        os.replace(os.path.join(carpeta, zip_file), os.path.join('data', anio[0], zip_file))
@@ -0,0 +1,212 @@
+import os
+import numpy as np
+import pandas as pd
+import process_file_functions as pf
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+historia_path = './data/historia/registro_sociedades_historia.parquet'
+
+# Origen de los dias de la clave compuesta CUIT-fecha. Los dias hasta 2100-12-31 entran en 17 bits
+fecha_origen = np.datetime64('1900-01-01', 'D')
+bits_dias = 17
+
+
+def dias_desde_origen(fechas):
+
+    '''
+        Paso fechas a dias desde fecha_origen
+
+        input:
+            fechas: (pandas.Series o array) Fechas (datetime64 o strings AAAA-MM-DD)
+        output:
+            dias: (numpy.array) Dias int64, los nulos quedan en -1
+    '''
+
+    fechas = pd.to_datetime(pd.Series(fechas), errors= 'coerce')
+    nulos = fechas.isnull().to_numpy()
+
+    dias = (fechas.to_numpy().astype('datetime64[D]') - fecha_origen).astype('int64')
+    dias[nulos] = -1
+
+    return dias
+
+
+def descargo_historia(columnas= None):
+
+    '''
+        Descargo todas las versiones de registro_sociedades (vigentes y cerradas)
+
+        input:
+            columnas: (list) Columnas a traer ademas de nu_cuit, fh_inicio_registro y fh_fin_registro. Si es None traigo las variables_finales
+        output:
+            historia: (pandas.DataFrame) Versiones con los tipos de pf.esquema_registro
+    '''
+
+    columnas = ['nu_cuit', 'fh_inicio_registro', 'fh_fin_registro'] + [col for col in (columnas or pf.variables_finales)
+                                                                      if col not in ('nu_cuit', 'fh_inicio_registro', 'fh_fin_registro')]
+
+    mysql = pf.make_mysql_connection('empresas')
+
+    with mysql.cursor() as cur:
+        cur.execute('select %s from registro_sociedades' % ','.join(columnas))
+        historia = pd.DataFrame(cur.fetchall(), columns= columnas)
+
+    mysql.close()
+
+    return pf.aplico_esquema(historia)
+
+
+class indice_historia:
+
+    '''
+        Indice de intervalos sobre la historia SCD-2 de registro_sociedades para buscar, para muchos pares
+        (CUIT, fecha) a la vez, la version vigente en cada fecha.
+
+        Las versiones se ordenan una sola vez por la clave compuesta nu_cuit * 2**17 + dias de fh_inicio_registro.
+        Cada consulta arma la misma clave con la fecha pedida y con np.searchsorted encuentra la ultima version del
+        CUIT que empezo antes o en esa fecha; es la vigente si ademas fh_fin_registro >= fecha.
+    '''
+
+    def __init__(self, historia):
+
+        '''
+            input:
+                historia: (pandas.DataFrame) Versiones con nu_cuit, fh_inicio_registro, fh_fin_registro y las columnas a devolver
+        '''
+
+        cuits = pd.to_numeric(historia['nu_cuit']).to_numpy(dtype= 'int64')
+        inicio = np.maximum(dias_desde_origen(historia['fh_inicio_registro']), 0)
+        fin = dias_desde_origen(historia['fh_fin_registro'])
+        fin[fin < 0] = np.iinfo('int64').max
+
+        claves = (cuits << bits_dias) + inicio
+        orden = np.argsort(claves, kind= 'stable')
+
+        self.claves = claves[orden]
+        self.cuits = cuits[orden]
+        self.fin = fin[orden]
+
+        # Agrego al final una fila vacia para devolver en las consultas sin version vigente
+        tabla = historia.drop(columns= 'nu_cuit').iloc[orden].reset_index(drop= True)
+        self.tabla = pf.concateno_bases([tabla, pf.aplico_esquema(tabla.iloc[:0].reindex([0]))])
+
+    def __len__(self):
+        return self.claves.shape[0]
+
+    def posiciones(self, cuits, fechas):
+
+        '''
+            Busco la version vigente de cada par (CUIT, fecha)
+
+            input:
+                cuits: (array) CUITs a buscar
+                fechas: (array) Fecha de cada CUIT
+            output:
+                posiciones: (numpy.array) Posicion de la version en el indice, -1 si no hay version vigente en esa fecha
+        '''
+
+        cuits = pd.to_numeric(pd.Series(cuits), errors= 'coerce')
+        cuits_validos = cuits.notnull().to_numpy()
+        cuits = cuits.fillna(0).to_numpy(dtype= 'int64')
+        dias = dias_desde_origen(fechas)
+
+        claves = (cuits << bits_dias) + np.maximum(dias, 0)
+        posiciones = np.searchsorted(self.claves, claves, side= 'right') - 1
+
+        encontrado = posiciones >= 0
+        candidatas = np.where(encontrado, posiciones, 0)
+        encontrado &= cuits_validos & (dias >= 0)
+        encontrado &= self.cuits[candidatas] == cuits
+        encontrado &= self.fin[candidatas] >= dias
+
+        return np.where(encontrado, posiciones, -1)
+
+    def busco(self, cuits, fechas, columnas= None, posiciones= None):
+
+        '''
+            Devuelvo la version vigente de cada par (CUIT, fecha), en el mismo orden que los pares
+
+            input:
+                cuits: (array) CUITs a buscar
+                fechas: (array) Fecha de cada CUIT
+                columnas: (list) Columnas de la version a devolver. Si es None devuelvo todas
+                posiciones: (numpy.array) Posiciones de los pares ya buscadas con posiciones. Si es None las busco
+            output:
+                versiones: (pandas.DataFrame) nu_cuit, fecha y las columnas de la version (nulas si no habia version vigente)
+        '''
+
+        if posiciones is None:
+            posiciones = self.posiciones(cuits, fechas)
+        posiciones = np.where(posiciones < 0, len(self), posiciones)
+
+        tabla = self.tabla if columnas is None else self.tabla[columnas]
+        versiones = tabla.iloc[posiciones].reset_index(drop= True)
+
+        versiones.insert(0, 'fecha', pd.to_datetime(pd.Series(fechas), errors= 'coerce').to_numpy())
+        versiones.insert(0, 'nu_cuit', pd.to_numeric(pd.Series(cuits), errors= 'coerce').astype('Int64').array)
+
+        return versiones
+
+
+def guardo_historia(historia, periodo, path= historia_path):
+
+    '''
+        Guardo la historia como Parquet marcada con el ultimo periodo, para no volver a descargarla de MySql
+
+        input:
+            historia: (pandas.DataFrame) Versiones (descargo_historia)
+            periodo: (int) Ultimo cd_periodo_proceso incluido en la historia
+            path: (str) Path del archivo
+        output:
+    '''
+
+    if pa is None:
+        return
+
+    tabla = pa.Table.from_pandas(pf.aplico_esquema(historia), preserve_index= False)
+    tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}), b'cd_periodo_proceso': str(periodo).encode()})
+
+    os.makedirs(os.path.dirname(path), exist_ok= True)
+    pq.write_table(tabla, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def cargo_indice_historia(columnas= None, path= historia_path):
+
+    '''
+        Armo el indice_historia con la historia guardada en path si esta al dia con MySql (mismo ultimo
+        cd_periodo_proceso). Si no, descargo la historia de MySql y la vuelvo a guardar.
+
+        input:
+            columnas: (list) Columnas de las versiones (ver descargo_historia)
+            path: (str) Path de la historia guardada
+        output:
+            indice: (indice_historia) Indice para buscar versiones
+    '''
+
+    periodo_mysql = pf.descargo_ultimo_periodo_mysql()
+    historia = None
+
+    if pq is not None and os.path.exists(path):
+        tabla = pq.read_table(path, memory_map= True)
+        periodo = int(tabla.schema.metadata[b'cd_periodo_proceso'])
+        faltantes = [col for col in (columnas or pf.variables_finales) if col not in tabla.column_names]
+
+        if periodo == periodo_mysql and not faltantes:
+            historia = pf.aplico_esquema(tabla.to_pandas())
+            if columnas is not None:
+                historia = historia[['nu_cuit', 'fh_inicio_registro', 'fh_fin_registro'] + [col for col in columnas 
+                                     if col not in ('nu_cuit', 'fh_inicio_registro', 'fh_fin_registro')]]
+
+    if historia is None:
+        historia = descargo_historia(columnas)
+        if periodo_mysql is not None and columnas is None:
+            guardo_historia(historia, periodo_mysql, path)
+
+    return indice_historia(historia)
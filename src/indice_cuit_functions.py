@@ -0,0 +1,218 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+indice_cuit_path = './data/indice_cuit'
+
+
+def exporto_indice_cuit(base_vigente, periodo, carpeta= indice_cuit_path, versiones_a_mantener= 3):
+
+    '''
+        Exporto la base vigente como indice binario ordenado por CUIT para buscar con indice_cuit desde otros procesos.
+        Cada columna es un .npy que se abre con memory map:
+            cuits.npy: claves int64 ordenadas
+            enteros (cd_*, nu_*): int16/int32/int64 con el minimo del tipo en los nulos (-1 es un codigo valido)
+            fechas (fh_*): datetime64[D] con NaT en los nulos
+            textos: codigos int32 (-1 en los nulos) a un diccionario de valores distintos guardado como heap de bytes
+                    utf-8 (col.heap.npy) y offsets int64 (col.offsets.npy)
+        Cada exportacion queda en su carpeta AAAAMM_n y el archivo ACTUAL apunta a la ultima, asi los procesos que
+        estan leyendo una version no ven archivos a medio escribir.
+
+        input:
+            base_vigente: (pandas.DataFrame o str) Base vigente (un registro por CUIT, ver snapshot_functions) o path
+                          del snapshot Parquet, que se lee de a una columna sin cargar la base entera
+            periodo: (int) Periodo AAAAMM de la base
+            carpeta: (str) Carpeta del indice
+            versiones_a_mantener: (int) Cantidad de versiones viejas que dejo para los procesos que todavia las usan
+        output:
+            path: (str) Carpeta de la version exportada
+    '''
+
+    os.makedirs(carpeta, exist_ok= True)
+
+    n_version = len([v for v in os.listdir(carpeta) if v.startswith(f'{periodo}_')])
+    version = f'{periodo}_{n_version}'
+    path_tmp = os.path.join(carpeta, version + '.tmp')
+    shutil.rmtree(path_tmp, ignore_errors= True)
+    os.makedirs(path_tmp)
+
+    if isinstance(base_vigente, str):
+        nombres = pq.read_schema(base_vigente).names
+        leo_columna = lambda col: pq.read_table(base_vigente, columns= [col], memory_map= True).column(0).to_pandas()
+    else:
+        nombres = base_vigente.columns.tolist()
+        leo_columna = lambda col: base_vigente[col].reset_index(drop= True)
+
+    # Un registro por CUIT (el ultimo), ordenados por CUIT
+    cuits = pd.to_numeric(leo_columna('nu_cuit')).to_numpy(dtype= 'int64')
+    filas = np.flatnonzero(~pd.Series(cuits).duplicated(keep= 'last').to_numpy())
+    filas = filas[np.argsort(cuits[filas], kind= 'stable')]
+    cuits = cuits[filas]
+    np.save(os.path.join(path_tmp, 'cuits.npy'), cuits)
+
+    columnas = {}
+    for col in nombres:
+        if col == 'nu_cuit':
+            continue
+
+        valores = leo_columna(col).iloc[filas]
+
+        if col[:3] == 'fh_':
+            fechas = pd.to_datetime(valores, errors= 'coerce').to_numpy().astype('datetime64[D]')
+            np.save(os.path.join(path_tmp, f'{col}.npy'), fechas)
+            columnas[col] = {'tipo': 'fecha'}
+
+        elif col[:3] in ('cd_', 'nu_'):
+            enteros = pd.to_numeric(valores, errors= 'coerce').astype('Int64')
+            minimo, maximo = enteros.min(), enteros.max()
+            dtype = 'int64'
+            for candidato in ['int16', 'int32']:
+                if pd.isna(minimo) or (minimo > np.iinfo(candidato).min and maximo <= np.iinfo(candidato).max):
+                    dtype = candidato
+                    break
+            nulo = int(np.iinfo(dtype).min)
+            np.save(os.path.join(path_tmp, f'{col}.npy'), enteros.fillna(nulo).to_numpy(dtype= dtype))
+            columnas[col] = {'tipo': 'entero', 'dtype': dtype, 'nulo': nulo}
+
+        else:
+            codigos, distintos = pd.factorize(valores.astype('object'))
+            datos = [str(valor).encode('utf-8') for valor in distintos]
+            offsets = np.zeros(len(datos) + 1, dtype= 'int64')
+            offsets[1:] = np.cumsum([len(dato) for dato in datos])
+            np.save(os.path.join(path_tmp, f'{col}.npy'), codigos.astype('int32'))
+            np.save(os.path.join(path_tmp, f'{col}.heap.npy'), np.frombuffer(b''.join(datos), dtype= 'uint8'))
+            np.save(os.path.join(path_tmp, f'{col}.offsets.npy'), offsets)
+            columnas[col] = {'tipo': 'texto', 'valores_distintos': len(datos)}
+
+    with open(os.path.join(path_tmp, 'metadata.json'), 'w') as f:
+        json.dump({'version': version, 'periodo': periodo, 'registros': int(cuits.shape[0]), 'columnas': columnas}, f, indent= 2)
+
+    path = os.path.join(carpeta, version)
+    os.replace(path_tmp, path)
+
+    with open(os.path.join(carpeta, 'ACTUAL.tmp'), 'w') as f:
+        f.write(version)
+    os.replace(os.path.join(carpeta, 'ACTUAL.tmp'), os.path.join(carpeta, 'ACTUAL'))
+
+    # Borro las versiones viejas (las carpetas AAAAMM_n se ordenan por periodo y numero de exportacion)
+    versiones = sorted([v for v in os.listdir(carpeta) if os.path.isdir(os.path.join(carpeta, v)) and not v.endswith('.tmp')],
+                       key= lambda v: tuple(int(x) for x in v.split('_')))
+    for vieja in versiones[:-(versiones_a_mantener + 1)]:
+        shutil.rmtree(os.path.join(carpeta, vieja), ignore_errors= True)
+
+    return path
+
+
+class indice_cuit:
+
+    '''
+        Busqueda de atributos de la base vigente por CUIT sobre el indice de exporto_indice_cuit. Los archivos se
+        abren con memory map: abrir el indice no lee los datos y varios procesos que lo usan comparten las mismas
+        paginas en memoria. Las columnas se abren recien la primera vez que se piden.
+    '''
+
+    def __init__(self, carpeta= indice_cuit_path, version= None):
+
+        '''
+            input:
+                carpeta: (str) Carpeta del indice
+                version: (str) Version AAAAMM_n a abrir. Si es None abro la de ACTUAL
+        '''
+
+        if version is None:
+            with open(os.path.join(carpeta, 'ACTUAL')) as f:
+                version = f.read().strip()
+
+        self.path = os.path.join(carpeta, version)
+
+        with open(os.path.join(self.path, 'metadata.json')) as f:
+            self.metadata = json.load(f)
+
+        self.cuits = np.load(os.path.join(self.path, 'cuits.npy'), mmap_mode= 'r')
+        self._columnas = {}
+
+    def __len__(self):
+        return self.cuits.shape[0]
+
+    def _columna(self, col):
+        if col not in self._columnas:
+            archivos = [col] + (['%s.heap' % col, '%s.offsets' % col] if self.metadata['columnas'][col]['tipo'] == 'texto' else [])
+            self._columnas[col] = [np.load(os.path.join(self.path, f'{archivo}.npy'), mmap_mode= 'r') for archivo in archivos]
+        return self._columnas[col]
+
+    def posiciones(self, cuits):
+
+        '''
+            Busqueda binaria vectorizada de los CUITs
+
+            input:
+                cuits: (array) CUITs a buscar
+            output:
+                posiciones: (numpy.array) Posicion de cada CUIT en el indice, -1 si no esta
+        '''
+
+        cuits = pd.to_numeric(pd.Series(cuits), errors= 'coerce')
+        validos = cuits.notnull().to_numpy()
+        cuits = cuits.fillna(-1).to_numpy(dtype= 'int64')
+
+        if len(self) == 0:
+            return np.full(cuits.shape[0], -1, dtype= 'int64')
+
+        posiciones = np.searchsorted(self.cuits, cuits)
+        candidatas = np.minimum(posiciones, len(self) - 1)
+        encontrado = validos & (posiciones < len(self)) & (self.cuits[candidatas] == cuits)
+
+        return np.where(encontrado, posiciones, -1)
+
+    def busco(self, cuits, columnas= None):
+
+        '''
+            Busco los atributos vigentes de un array de CUITs
+
+            input:
+                cuits: (array) CUITs a buscar
+                columnas: (list) Columnas a devolver. Si es None devuelvo todas
+            output:
+                atributos: (pandas.DataFrame) nu_cuit y las columnas pedidas, en el orden de cuits (nulos si el CUIT no esta)
+        '''
+
+        posiciones = self.posiciones(cuits)
+        encontrado = posiciones >= 0
+        filas = posiciones[encontrado]
+
+        atributos = pd.DataFrame({'nu_cuit': pd.to_numeric(pd.Series(cuits), errors= 'coerce').astype('Int64').array})
+
+        for col in (columnas or list(self.metadata['columnas'])):
+            tipo = self.metadata['columnas'][col]['tipo']
+            archivos = self._columna(col)
+
+            if tipo == 'fecha':
+                valores = np.full(len(posiciones), np.datetime64('NaT'), dtype= 'datetime64[D]')
+                valores[encontrado] = archivos[0][filas]
+                atributos[col] = pd.to_datetime(valores)
+
+            elif tipo == 'entero':
+                nulo = self.metadata['columnas'][col]['nulo']
+                valores = np.full(len(posiciones), nulo, dtype= 'int64')
+                valores[encontrado] = archivos[0][filas]
+                atributos[col] = pd.arrays.IntegerArray(valores, valores == nulo)
+
+            else:
+                codigos = np.full(len(posiciones), -1, dtype= 'int32')
+                codigos[encontrado] = archivos[0][filas]
+
+                # Solo decodifico los valores distintos que aparecen en la consulta
+                distintos, codigos_consulta = np.unique(codigos, return_inverse= True)
+                heap, offsets = archivos[1], archivos[2]
+                textos = np.array([None if codigo < 0 else bytes(heap[offsets[codigo]:offsets[codigo+1]]).decode('utf-8')
+                                   for codigo in distintos], dtype= 'object')
+                atributos[col] = textos[codigos_consulta.reshape(-1)]
+
+        return atributos
@@ -0,0 +1,400 @@
+import os
+import json
+import zlib
+import shutil
+import numpy as np
+import pandas as pd
+import utils_file_functions as uf
+import snapshot_functions as sf
+
+indice_nombres_path = './data/indice_nombres'
+
+# Archivos de cada segmento del indice (todos .npy que se abren con memory map)
+archivos_segmento = ['cuits', 'nombres.heap', 'nombres.offsets', 'n_trigramas', 'terminos', 'offsets', 'postings']
+
+
+def trigramas(nombre):
+
+    '''
+        Trigramas de un nombre normalizado (ver uf.normalizo_string) como hashes crc32. Cada palabra se completa
+        con dos espacios adelante y uno atras, asi los trigramas del principio de las palabras pesan mas.
+
+        input:
+            nombre: (str) Nombre normalizado
+        output:
+            trigramas: (set) Hashes uint32 de los trigramas distintos
+    '''
+
+    hashes = set()
+
+    for palabra in nombre.split(' '):
+        palabra = f'  {palabra} '
+        for i in range(len(palabra) - 2):
+            hashes.add(zlib.crc32(palabra[i:i+3].encode('utf-8')))
+
+    return hashes
+
+
+def armo_segmento(cuits, nombres):
+
+    '''
+        Armo un segmento del indice invertido: para cada trigrama (terminos, ordenados) la lista de documentos que lo
+        tienen (postings, en formato CSR con offsets). Los documentos son los nombres en el orden de cuits.
+
+        input:
+            cuits: (numpy.array) CUITs int64 ordenados y sin repetir
+            nombres: (list) Nombre normalizado de cada CUIT
+        output:
+            segmento: (dict) Arrays del segmento (ver archivos_segmento)
+    '''
+
+    n_trigramas = np.zeros(len(nombres), dtype= 'int16')
+    terminos = []
+    docs = []
+
+    for doc, nombre in enumerate(nombres):
+        hashes = trigramas(nombre)
+        n_trigramas[doc] = len(hashes)
+        terminos.extend(hashes)
+        docs.extend([doc] * len(hashes))
+
+    terminos = np.array(terminos, dtype= 'uint32')
+    docs = np.array(docs, dtype= 'int32')
+
+    orden = np.lexsort((docs, terminos))
+    terminos, docs = terminos[orden], docs[orden]
+    terminos, inicios = np.unique(terminos, return_index= True)
+
+    datos = [nombre.encode('utf-8') for nombre in nombres]
+    offsets_nombres = np.zeros(len(datos) + 1, dtype= 'int64')
+    offsets_nombres[1:] = np.cumsum([len(dato) for dato in datos])
+
+    return {'cuits': np.asarray(cuits, dtype= 'int64'),
+            'nombres.heap': np.frombuffer(b''.join(datos), dtype= 'uint8'),
+            'nombres.offsets': offsets_nombres,
+            'n_trigramas': n_trigramas,
+            'terminos': terminos,
+            'offsets': np.append(inicios, docs.shape[0]).astype('int64'),
+            'postings': docs}
+
+
+def guardo_segmento(segmento, path):
+
+    '''
+        Guardo un segmento en la carpeta path (se escribe en path.tmp y se renombra)
+    '''
+
+    shutil.rmtree(path + '.tmp', ignore_errors= True)
+    os.makedirs(path + '.tmp')
+
+    for archivo in archivos_segmento:
+        np.save(os.path.join(path + '.tmp', f'{archivo}.npy'), segmento[archivo])
+
+    os.replace(path + '.tmp', path)
+
+
+def abro_segmento(path):
+
+    '''
+        Abro un segmento guardado con memory map
+    '''
+
+    return {archivo: np.load(os.path.join(path, f'{archivo}.npy'), mmap_mode= 'r') for archivo in archivos_segmento}
+
+
+def nombres_segmento(segmento, docs):
+
+    '''
+        Decodifico los nombres de los documentos docs de un segmento
+    '''
+
+    heap, offsets = segmento['nombres.heap'], segmento['nombres.offsets']
+
+    return [bytes(heap[offsets[doc]:offsets[doc+1]]).decode('utf-8') for doc in docs]
+
+
+def _nombres_validos(base):
+
+    '''
+        CUIT y nombre de la base, un registro por CUIT (el ultimo), sin nombres nulos, ordenados por CUIT
+    '''
+
+    base = base[['nu_cuit', 'nb_razon_social']].drop_duplicates('nu_cuit', keep= 'last')
+    base = base.loc[base['nb_razon_social'].notnull()].sort_values('nu_cuit')
+
+    return base['nu_cuit'].to_numpy(dtype= 'int64'), base['nb_razon_social'].astype('object').tolist()
+
+
+def _guardo_version(carpeta, actual, principal= None, delta= None, borrados= None, periodo= None):
+
+    '''
+        Guardo una version nueva del indice: los segmentos que cambiaron, los borrados del principal y ACTUAL.json
+        apuntando a la version nueva. Borro los archivos de versiones anteriores.
+    '''
+
+    os.makedirs(carpeta, exist_ok= True)
+    version = (actual or {}).get('version', -1) + 1
+
+    nuevo = {'version': version, 'periodo': periodo}
+
+    if principal is not None:
+        nuevo['principal'] = f'principal_{version}'
+        guardo_segmento(principal, os.path.join(carpeta, nuevo['principal']))
+    else:
+        nuevo['principal'] = actual['principal']
+
+    nuevo['delta'] = f'delta_{version}'
+    guardo_segmento(delta, os.path.join(carpeta, nuevo['delta']))
+
+    nuevo['borrados'] = f'borrados_{version}.npy'
+    np.save(os.path.join(carpeta, nuevo['borrados']), np.asarray(borrados, dtype= 'int32'))
+
+    with open(os.path.join(carpeta, 'ACTUAL.json.tmp'), 'w') as f:
+        json.dump(nuevo, f)
+    os.replace(os.path.join(carpeta, 'ACTUAL.json.tmp'), os.path.join(carpeta, 'ACTUAL.json'))
+
+    # Los procesos que tienen abierta una version vieja la siguen leyendo (en Windows no se puede borrar y queda)
+    for archivo in os.listdir(carpeta):
+        if archivo not in (nuevo['principal'], nuevo['delta'], nuevo['borrados'], 'ACTUAL.json'):
+            path = os.path.join(carpeta, archivo)
+            try:
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+            except OSError:
+                pass
+
+    return nuevo
+
+
+def construyo_indice_nombres(base_vigente, periodo, carpeta= indice_nombres_path):
+
+    '''
+        Armo el indice de nombres desde cero con la base vigente: todo queda en el segmento principal y el delta vacio
+
+        input:
+            base_vigente: (pandas.DataFrame) Base vigente con nu_cuit y nb_razon_social (ver snapshot_functions)
+            periodo: (int) Periodo AAAAMM de la base
+            carpeta: (str) Carpeta del indice
+        output:
+            actual: (dict) Version guardada (ver ACTUAL.json)
+    '''
+
+    cuits, nombres = _nombres_validos(base_vigente)
+
+    actual = None
+    if os.path.exists(os.path.join(carpeta, 'ACTUAL.json')):
+        with open(os.path.join(carpeta, 'ACTUAL.json')) as f:
+            actual = json.load(f)
+
+    return _guardo_version(carpeta, actual, principal= armo_segmento(cuits, nombres), delta= armo_segmento([], []),
+                           borrados= [], periodo= periodo)
+
+
+class indice_nombres:
+
+    '''
+        Indice invertido de trigramas sobre nb_razon_social para buscar empresas por nombre aproximado.
+
+        Tiene dos segmentos con el mismo formato: el principal (grande, se arma con construyo_indice_nombres o al
+        compactar) y el delta (los CUITs nuevos o con nombre nuevo desde la ultima compactacion). Los documentos del
+        principal reemplazados en el delta quedan marcados como borrados. Los archivos se abren con memory map y cada
+        actualizacion escribe una version nueva que se activa con ACTUAL.json, asi los procesos que estan buscando
+        no ven archivos a medio escribir.
+
+        La similitud es el coeficiente de Dice entre los trigramas de la busqueda y los del nombre:
+        2 * trigramas en comun / (trigramas de la busqueda + trigramas del nombre)
+    '''
+
+    def __init__(self, carpeta= indice_nombres_path):
+
+        '''
+            input:
+                carpeta: (str) Carpeta del indice
+        '''
+
+        self.carpeta = carpeta
+
+        with open(os.path.join(carpeta, 'ACTUAL.json')) as f:
+            self.actual = json.load(f)
+
+        self.principal = abro_segmento(os.path.join(carpeta, self.actual['principal']))
+        self.delta = abro_segmento(os.path.join(carpeta, self.actual['delta']))
+        self.borrados = np.load(os.path.join(carpeta, self.actual['borrados']))
+        self.periodo = self.actual['periodo']
+
+    def __len__(self):
+        return self.principal['cuits'].shape[0] - self.borrados.shape[0] + self.delta['cuits'].shape[0]
+
+    def _similitudes(self, segmento, consulta, borrados= None):
+        terminos = segmento['terminos']
+        n_docs = segmento['cuits'].shape[0]
+
+        if n_docs == 0 or terminos.shape[0] == 0:
+            return np.array([], dtype= 'int64'), np.array([], dtype= 'float64')
+
+        posiciones = np.minimum(np.searchsorted(terminos, consulta), terminos.shape[0] - 1)
+        posiciones = posiciones[terminos[posiciones] == consulta]
+
+        offsets, postings = segmento['offsets'], segmento['postings']
+        if posiciones.shape[0] == 0:
+            return np.array([], dtype= 'int64'), np.array([], dtype= 'float64')
+
+        # Trigramas en comun de cada documento
+        comunes = np.bincount(np.concatenate([postings[offsets[p]:offsets[p+1]] for p in posiciones]), minlength= n_docs)
+        if borrados is not None and borrados.shape[0]:
+            comunes[borrados] = 0
+
+        docs = np.flatnonzero(comunes)
+        similitud = 2 * comunes[docs] / (consulta.shape[0] + segmento['n_trigramas'][docs])
+
+        return docs, similitud
+
+    def busco(self, texto, k= 10, similitud_minima= 0.3):
+
+        '''
+            Busco los nombres mas parecidos a texto
+
+            input:
+                texto: (str) Nombre a buscar (se normaliza como nb_razon_social)
+                k: (int) Cantidad maxima de resultados
+                similitud_minima: (float) Similitud minima de los resultados (0 a 1)
+            output:
+                resultados: (pandas.DataFrame) nu_cuit, nb_razon_social y similitud, de mayor a menor similitud
+        '''
+
+        resultados = pd.DataFrame({'nu_cuit': pd.Series([], dtype= 'int64'), 'nb_razon_social': pd.Series([], dtype= 'object'),
+                                   'similitud': pd.Series([], dtype= 'float64')})
+
+        texto = uf.normalizo_string(texto)
+        if not isinstance(texto, str) or not texto:
+            return resultados
+
+        consulta = np.array(sorted(trigramas(texto)), dtype= 'uint32')
+
+        partes = []
+        for segmento, borrados in [(self.principal, self.borrados), (self.delta, None)]:
+            docs, similitud = self._similitudes(segmento, consulta, borrados)
+
+            elegidos = np.flatnonzero(similitud >= similitud_minima)
+            if elegidos.shape[0] > k:
+                elegidos = elegidos[np.argpartition(-similitud[elegidos], k - 1)[:k]]
+            docs, similitud = docs[elegidos], similitud[elegidos]
+
+            partes.append(pd.DataFrame({'nu_cuit': segmento['cuits'][docs], 'nb_razon_social': nombres_segmento(segmento, docs),
+                                        'similitud': similitud}))
+
+        resultados = pd.concat([resultados] + partes, ignore_index= True)
+
+        return resultados.sort_values(['similitud', 'nu_cuit'], ascending= [False, True], kind= 'stable').head(k).reset_index(drop= True)
+
+    def nombres_actuales(self, cuits):
+
+        '''
+            Nombre indexado de cada CUIT (None si no esta)
+
+            input:
+                cuits: (numpy.array) CUITs int64
+            output:
+                nombres: (list) Nombres en el orden de cuits
+        '''
+
+        nombres = [None] * cuits.shape[0]
+        borrados = np.zeros(self.principal['cuits'].shape[0], dtype= bool)
+        borrados[self.borrados] = True
+
+        for segmento, borrados_segmento in [(self.principal, borrados), (self.delta, None)]:
+            indexados = segmento['cuits']
+            if indexados.shape[0] == 0:
+                continue
+
+            posiciones = np.minimum(np.searchsorted(indexados, cuits), indexados.shape[0] - 1)
+            encontrado = indexados[posiciones] == cuits
+            if borrados_segmento is not None:
+                encontrado &= ~borrados_segmento[posiciones]
+
+            for i, nombre in zip(np.flatnonzero(encontrado), nombres_segmento(segmento, posiciones[encontrado])):
+                nombres[i] = nombre
+
+        return nombres
+
+    def actualizo(self, base, periodo, fraccion_compactacion= 0.1):
+
+        '''
+            Actualizo el indice con los CUITs nuevos y actualizados de un periodo: los que tienen un nombre nuevo se
+            agregan al delta y su documento anterior del principal queda borrado. Si el delta supera fraccion_compactacion
+            del principal, compacto: armo un principal nuevo con todo y el delta queda vacio.
+
+            input:
+                base: (pandas.DataFrame) Registros nuevos y actualizados del periodo con nu_cuit y nb_razon_social
+                periodo: (int) Periodo AAAAMM de la novedad
+                fraccion_compactacion: (float) Tamaño del delta respecto del principal a partir del cual compacto
+            output:
+                resumen: (dict) nombres_nuevos, registros del delta, compactado (bool) y version
+        '''
+
+        cuits, nombres = _nombres_validos(base)
+
+        # Solo me interesan los CUITs con un nombre distinto al indexado
+        cambiados = [i for i, (nombre, actual) in enumerate(zip(nombres, self.nombres_actuales(cuits))) if nombre != actual]
+        cuits, nombres = cuits[cambiados], [nombres[i] for i in cambiados]
+
+        # Borro del principal los documentos de los CUITs que cambiaron
+        indexados = self.principal['cuits']
+        borrados = self.borrados
+        if indexados.shape[0] and cuits.shape[0]:
+            posiciones = np.minimum(np.searchsorted(indexados, cuits), indexados.shape[0] - 1)
+            borrados = np.union1d(borrados, posiciones[indexados[posiciones] == cuits]).astype('int32')
+
+        # Delta nuevo: el anterior sin los CUITs que cambiaron, mas los nombres nuevos
+        delta_cuits = np.asarray(self.delta['cuits'])
+        quedan = np.flatnonzero(~np.isin(delta_cuits, cuits))
+        delta = pd.DataFrame({'nu_cuit': np.concatenate([delta_cuits[quedan], cuits]),
+                              'nb_razon_social': nombres_segmento(self.delta, quedan) + nombres})
+
+        compacto = delta.shape[0] > fraccion_compactacion * max(indexados.shape[0] - borrados.shape[0], 1)
+
+        if compacto:
+            vivos = np.setdiff1d(np.arange(indexados.shape[0]), borrados)
+            base_principal = pd.concat([pd.DataFrame({'nu_cuit': indexados[vivos], 'nb_razon_social': nombres_segmento(self.principal, vivos)}),
+                                        delta], ignore_index= True)
+            self.actual = _guardo_version(self.carpeta, self.actual, principal= armo_segmento(*_nombres_validos(base_principal)),
+                                          delta= armo_segmento([], []), borrados= [], periodo= periodo)
+        else:
+            self.actual = _guardo_version(self.carpeta, self.actual, delta= armo_segmento(*_nombres_validos(delta)),
+                                          borrados= borrados, periodo= periodo)
+
+        self.__init__(self.carpeta)
+
+        return {'nombres_nuevos': len(nombres), 'registros_delta': int(self.delta['cuits'].shape[0]),
+                'compactado': bool(compacto), 'version': self.actual['version']}
+
+
+def actualizo_indice_nombres(base_insert, base_update, periodo, base_vigente= None, carpeta= indice_nombres_path):
+
+    '''
+        Actualizo el indice de nombres despues de cargar un periodo. Si no existe o no esta en el periodo anterior
+        (por ejemplo si se salteo una actualizacion) lo vuelvo a armar con la base vigente.
+
+        input:
+            base_insert: (pandas.DataFrame) CUITs nuevos del periodo
+            base_update: (pandas.DataFrame) CUITs actualizados del periodo
+            periodo: (int) Periodo AAAAMM cargado
+            base_vigente: (pandas.DataFrame) Base vigente ya actualizada con el periodo, para armar el indice desde cero.
+                          Si es None y hace falta, la descargo (snapshot_functions.descargo_base_vigente)
+            carpeta: (str) Carpeta del indice
+        output:
+            resumen: (dict) Resumen de la actualizacion
+    '''
+
+    indice = None
+    if os.path.exists(os.path.join(carpeta, 'ACTUAL.json')):
+        indice = indice_nombres(carpeta)
+
+    if indice is None or indice.periodo != uf.periodo_anterior(periodo):
+        if base_vigente is None:
+            base_vigente = sf.descargo_base_vigente()
+        actual = construyo_indice_nombres(base_vigente, periodo, carpeta)
+        return {'construido': True, 'version': actual['version']}
+
+    columnas = ['nu_cuit', 'nb_razon_social']
+
+    return indice.actualizo(pd.concat([base_insert[columnas], base_update[columnas]], ignore_index= True), periodo)
@@ -0,0 +1,468 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+from collections import Counter
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class contador_llamadas:
+
+    '''
+        Contador de llamadas a MySql (conexiones, execute, executemany, commit y rollback), compartido entre hilos.
+        Cada proceso tiene el suyo: las llamadas del proceso que prepara los periodos se miden en ese proceso (ver pasos_medidos)
+    '''
+
+    def __init__(self):
+        self.llamadas = 0
+        self._lock = threading.Lock()
+
+    def sumo(self, n= 1):
+        with self._lock:
+            self.llamadas += n
+
+
+contador_bd = contador_llamadas()
+
+
+class cursor_contado:
+
+    '''
+        Cursor que cuenta cada execute/executemany en contador_bd y delega el resto en el cursor original
+    '''
+
+    def __init__(self, cursor, contador):
+        self._cursor = cursor
+        self._contador = contador
+
+    def execute(self, *args, **kwargs):
+        self._contador.sumo()
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._contador.sumo()
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._cursor.__exit__(*args)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+
+class conexion_contada:
+
+    '''
+        Conexion que devuelve cursores contados y cuenta commit/rollback, el resto lo delega en la conexion original
+    '''
+
+    def __init__(self, conexion, contador):
+        self._conexion = conexion
+        self._contador = contador
+
+    def cursor(self, *args, **kwargs):
+        return cursor_contado(self._conexion.cursor(*args, **kwargs), self._contador)
+
+    def commit(self):
+        self._contador.sumo()
+        return self._conexion.commit()
+
+    def rollback(self):
+        self._contador.sumo()
+        return self._conexion.rollback()
+
+    def __enter__(self):
+        self._conexion.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._conexion.__exit__(*args)
+
+    def __getattr__(self, nombre):
+        return getattr(self._conexion, nombre)
+
+
+def instrumento_conexiones(modulo, contador= contador_bd):
+
+    '''
+        Reemplazo make_mysql_connection del modulo por una version que devuelve conexiones contadas, asi cada
+        llamada a MySql que hace el modulo suma en el contador. Si ya esta instrumentado no hago nada.
+
+        input:
+            modulo: (module) Modulo que usa make_mysql_connection (por ejemplo process_file_functions)
+            contador: (contador_llamadas) Contador donde se suman las llamadas
+        output:
+    '''
+
+    conectar = modulo.make_mysql_connection
+    if getattr(conectar, 'instrumentado', False):
+        return
+
+    def make_mysql_connection(*args, **kwargs):
+        contador.sumo()
+        return conexion_contada(conectar(*args, **kwargs), contador)
+
+    make_mysql_connection.instrumentado = True
+    modulo.make_mysql_connection = make_mysql_connection
+
+
+def rss_mb():
+
+    '''
+        Memoria residente actual del proceso en MB (None si no esta psutil)
+    '''
+
+    if psutil is None:
+        return None
+
+    return psutil.Process().memory_info().rss / 2**20
+
+
+def rss_pico_proceso_mb():
+
+    '''
+        Pico de memoria residente del proceso desde que arranco en MB, con resource (None si no esta disponible, por ejemplo en Windows)
+    '''
+
+    if resource is None:
+        return None
+
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # En Linux ru_maxrss esta en KB y en macOS en bytes
+    return pico / 2**20 if sys.platform == 'darwin' else pico / 2**10
+
+
+class muestreo_rss:
+
+    '''
+        Hilo que mide la memoria residente cada intervalo segundos y se queda con el maximo (solo con psutil)
+    '''
+
+    def __init__(self, intervalo= 0.05):
+        self.intervalo = intervalo
+        self.inicio = rss_mb()
+        self.pico = self.inicio
+        self._fin = threading.Event()
+        self._hilo = None
+
+        if self.inicio is not None:
+            self._hilo = threading.Thread(target= self._mido, daemon= True)
+            self._hilo.start()
+
+    def _mido(self):
+        while not self._fin.wait(self.intervalo):
+            self.pico = max(self.pico, rss_mb())
+
+    def termino(self):
+        self._fin.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self.pico = max(self.pico, rss_mb())
+
+
+class perfil_muestreo:
+
+    '''
+        Profiler por muestreo: cada intervalo segundos guardo el stack de todos los hilos (sys._current_frames),
+        asi tambien se ven los hilos que insertan en paralelo. Se guarda en formato "stacks colapsados"
+        (una linea por stack con la cantidad de muestras) que se puede abrir con flamegraph.pl o speedscope.
+    '''
+
+    def __init__(self, intervalo= 0.01):
+        self.intervalo = intervalo
+        self.muestras = Counter()
+        self._fin = threading.Event()
+        self._hilo = threading.Thread(target= self._muestreo, daemon= True)
+
+    def enable(self):
+        self._hilo.start()
+
+    def disable(self):
+        self._fin.set()
+        self._hilo.join()
+
+    def _muestreo(self):
+        propio = threading.get_ident()
+        nombres = {}
+
+        while not self._fin.wait(self.intervalo):
+            for hilo, frame in sys._current_frames().items():
+                if hilo == propio:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    codigo = frame.f_code
+                    stack.append(f'{os.path.basename(codigo.co_filename)}:{codigo.co_name}:{frame.f_lineno}')
+                    frame = frame.f_back
+
+                if hilo not in nombres:
+                    nombres = {t.ident: t.name for t in threading.enumerate()}
+                self.muestras[';'.join([nombres.get(hilo, str(hilo))] + stack[::-1])] += 1
+
+    def dump_stats(self, path):
+        with open(path, 'w') as f:
+            for stack, n in self.muestras.most_common():
+                f.write(f'{stack} {n}\n')
+
+
+def nuevo_perfil(tipo_perfil):
+
+    '''
+        Profiler para un paso: 'cprofile' (cProfile.Profile, solo el hilo que lo prende) o 'muestreo' (perfil_muestreo, todos los hilos)
+    '''
+
+    return perfil_muestreo() if tipo_perfil == 'muestreo' else cProfile.Profile()
+
+
+def guardo_perfil(perfil, path):
+
+    '''
+        Guardo el perfil de un paso: con cProfile en path.prof y el resumen por tiempo acumulado en path.txt,
+        con muestreo los stacks colapsados en path.txt
+
+        input:
+            perfil: (cProfile.Profile o perfil_muestreo) Perfil ya apagado
+            path: (str) Path del perfil sin extension
+        output:
+            path: (str) Path del perfil guardado
+    '''
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok= True)
+
+    if isinstance(perfil, cProfile.Profile):
+        perfil.dump_stats(path + '.prof')
+        with open(path + '.txt', 'w') as f:
+            pstats.Stats(perfil, stream= f).sort_stats('cumulative').print_stats(40)
+        return path + '.prof'
+
+    perfil.dump_stats(path + '.txt')
+    return path + '.txt'
+
+
+class medicion_paso:
+
+    '''
+        Mido un paso desde que se crea hasta termino: tiempo de reloj, tiempo de CPU del proceso, delta del pico de
+        memoria residente y llamadas a MySql del contador. Todo es del proceso donde corre el paso.
+        Si perfil no es None lo prendo y lo apago en termino.
+    '''
+
+    def __init__(self, contador= contador_bd, perfil= None):
+        self.contador = contador
+        self.perfil = perfil
+        self.inicio = (time.perf_counter(), time.process_time(), contador.llamadas, rss_pico_proceso_mb())
+        self.rss = muestreo_rss()
+
+        if perfil is not None:
+            perfil.enable()
+
+    def termino(self):
+
+        '''
+            Termino la medicion
+
+            input:
+            output:
+                medicion: (dict) {'segundos', 'segundos_cpu', 'rss_pico_delta_mb', 'llamadas_bd'}
+        '''
+
+        inicio, inicio_cpu, llamadas, pico_proceso = self.inicio
+        segundos = time.perf_counter() - inicio
+
+        if self.perfil is not None:
+            self.perfil.disable()
+
+        self.rss.termino()
+        if self.rss.inicio is not None:
+            rss_delta = self.rss.pico - self.rss.inicio
+        elif pico_proceso is not None:
+            # Sin psutil solo tengo el pico de todo el proceso: cuanto lo subio este paso
+            rss_delta = rss_pico_proceso_mb() - pico_proceso
+        else:
+            rss_delta = None
+
+        return {'segundos': round(segundos, 4),
+                'segundos_cpu': round(time.process_time() - inicio_cpu, 4),
+                'rss_pico_delta_mb': None if rss_delta is None else round(rss_delta, 1),
+                'llamadas_bd': self.contador.llamadas - llamadas}
+
+
+class pasos_medidos:
+
+    '''
+        Mediciones de los pasos que corren fuera de log_instrumentado, en el proceso que prepara los periodos
+        (ver pf.preparo_periodo): cada paso se mide con medicion_paso en ese proceso y, como en log_instrumentado, se
+        perfila el primero que tenga paso_perfilado en el nombre. El perfil queda en carpeta_perfiles como
+        perfil_AAAAMM_preparacion_N. Las mediciones vuelven al proceso principal en el resumen de la preparacion
+        y se pasan al log con update_log_step(metricas= ...).
+    '''
+
+    def __init__(self, periodo, paso_perfilado= None, tipo_perfil= 'cprofile', carpeta_perfiles= './logs', contador= contador_bd):
+        self.periodo = periodo
+        self.paso_perfilado = paso_perfilado
+        self.tipo_perfil = tipo_perfil
+        self.carpeta_perfiles = carpeta_perfiles
+        self.contador = contador
+        self.mediciones = []
+        self._perfilado = False
+
+    @contextlib.contextmanager
+    def mido(self, step_name):
+
+        '''
+            Mido el paso que corre dentro del with. La medicion se agrega a mediciones al salir (si el paso falla no queda)
+
+            input:
+                step_name: (str) Nombre del paso, el mismo que se pasa a log_step en el proceso principal
+            output:
+        '''
+
+        perfil = None
+        if self.paso_perfilado is not None and not self._perfilado and self.paso_perfilado in step_name:
+            perfil = nuevo_perfil(self.tipo_perfil)
+            self._perfilado = True
+
+        paso = medicion_paso(self.contador, perfil)
+        try:
+            yield
+        finally:
+            medicion = paso.termino()
+
+        if perfil is not None:
+            medicion['perfil'] = guardo_perfil(perfil, os.path.join(self.carpeta_perfiles, f'perfil_{self.periodo}_preparacion_{len(self.mediciones)+1}'))
+
+        self.mediciones.append(medicion)
+
+
+class log_instrumentado:
+
+    '''
+        Envuelvo el log de MySql (artifacts.logs_func.log_mysql) para medir cada paso entre log_step y update_log_step
+        con medicion_paso: tiempo de reloj, tiempo de CPU del proceso, delta del pico de memoria residente, registros
+        por segundo y llamadas a MySql (ver instrumento_conexiones). Las mediciones de cada periodo quedan en pasos y se
+        pasan al log local con resumen_periodo. Todo lo demas se delega en el log original.
+
+        Si paso_perfilado no es None, el primer paso de cada periodo que tenga ese texto en el nombre se perfila
+        y el perfil queda en carpeta_perfiles: con 'cprofile' (.prof, solo el hilo principal) o con 'muestreo'
+        (.txt con stacks colapsados de todos los hilos de este proceso). Los pasos de la preparacion del periodo corren
+        en otro proceso: se miden y se perfilan alla (ver pasos_medidos) y aca se loguean con medido_aparte= True y
+        sus mediciones en metricas.
+    '''
+
+    def __init__(self, log_base, paso_perfilado= None, tipo_perfil= 'cprofile', carpeta_perfiles= './logs', contador= contador_bd):
+        self.log_base = log_base
+        self.paso_perfilado = paso_perfilado
+        self.tipo_perfil = tipo_perfil
+        self.carpeta_perfiles = carpeta_perfiles
+        self.contador = contador
+        self.periodo = None
+        self.pasos = []
+        self._paso = None
+        self._perfilado = False
+
+    def __getattr__(self, nombre):
+        return getattr(self.log_base, nombre)
+
+    def inicio_periodo(self, periodo):
+
+        '''
+            Empiezo las mediciones de un periodo nuevo
+
+            input:
+                periodo: (int) Periodo AAAAMM que se va a procesar
+            output:
+        '''
+
+        self.periodo = periodo
+        self.pasos = []
+        self._perfilado = False
+
+    def log_step(self, step_name, *args, medido_aparte= False, **kwargs):
+
+        '''
+            Igual que log_mysql.log_step. Con medido_aparte= True el paso corrio (o corre) en otro proceso: no lo perfilo
+            aca, sus mediciones llegan en update_log_step(metricas= ...)
+        '''
+
+        self._cierro_paso()
+
+        resultado = self.log_base.log_step(step_name, *args, **kwargs)
+
+        perfil = None
+        if self.paso_perfilado is not None and not self._perfilado and not medido_aparte and self.paso_perfilado in step_name:
+            perfil = nuevo_perfil(self.tipo_perfil)
+            self._perfilado = True
+
+        self._paso = {'paso': step_name, 'medicion': medicion_paso(self.contador, perfil)}
+
+        return resultado
+
+    def update_log_step(self, *args, metricas= None, **kwargs):
+
+        '''
+            Igual que log_mysql.update_log_step. metricas (dict) se agrega a la medicion del paso y pisa lo medido,
+            por ejemplo para los pasos que corrieron en el proceso que prepara el periodo
+        '''
+
+        resultado = self.log_base.update_log_step(*args, **kwargs)
+
+        registros = kwargs.get('registros_procesados')
+        self._cierro_paso(kwargs.get('step_status', args[0] if args else None), registros, metricas)
+
+        return resultado
+
+    def _cierro_paso(self, status= None, registros= None, metricas= None):
+        if self._paso is None:
+            return
+
+        paso, self._paso = self._paso, None
+
+        medicion = {'paso': paso['paso'], 'status': status, 'registros': registros}
+        medicion.update(paso['medicion'].termino())
+        medicion.update(metricas or {})
+        medicion['registros_por_segundo'] = round(registros / medicion['segundos']) if registros and medicion['segundos'] else None
+
+        if paso['medicion'].perfil is not None:
+            medicion['perfil'] = guardo_perfil(paso['medicion'].perfil, os.path.join(self.carpeta_perfiles, f'perfil_{self.periodo}_{len(self.pasos)+1}'))
+
+        self.pasos.append(medicion)
+
+    def resumen_periodo(self):
+
+        '''
+            Mediciones del periodo para el log local: los pasos y el total
+
+            input:
+            output:
+                resumen: (dict) {'pasos': lista de mediciones por paso, 'total': suma de segundos, CPU y llamadas a MySql}
+        '''
+
+        self._cierro_paso()
+
+        # Los pasos que corrieron en paralelo con otros (la preparacion del periodo) no suman al tiempo de reloj
+        total = {'segundos': round(sum(p['segundos'] for p in self.pasos if not p.get('en_paralelo')), 4),
+                 'segundos_cpu': round(sum(p['segundos_cpu'] for p in self.pasos), 4),
+                 'llamadas_bd': sum(p['llamadas_bd'] for p in self.pasos)}
+
+        return {'pasos': self.pasos, 'total': total}
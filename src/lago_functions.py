@@ -0,0 +1,253 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import process_file_functions as pf
+import utils_file_functions as uf
+import historia_functions as hf
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    ds = None
+    pq = None
+
+lago_path = './data/lago/registro_sociedades'
+
+# Dentro de cada particion las filas van ordenadas por estas columnas, asi las estadisticas (min/max) de cada row
+# group son angostas y los lectores que filtran por tipo societario o provincia saltean los grupos que no corresponden
+orden_particion = ['cd_tipo_societario', 'cd_provincia_dom_fiscal', 'nu_cuit']
+filas_por_grupo = 20000
+
+# Tipo de novedad de cada fila: version de un CUIT nuevo, version nueva de un CUIT que cambio o cierre de la version anterior
+novedades = ['alta', 'cambio', 'cierre']
+
+
+def esquema_lago():
+
+    '''
+        Esquema Arrow de las filas del lago, con los tipos de pf.esquema_registro. Es el mismo en todas las particiones
+        aunque una columna venga toda nula en un periodo. cd_periodo_proceso no va en los archivos, es la particion.
+
+        output:
+            esquema: (pyarrow.Schema) Esquema de las filas
+    '''
+
+    tipos = {'object': pa.string(), 'int64': pa.int64(), 'Int64': pa.int64(), 'Int16': pa.int16(),
+             'datetime64[ns]': pa.timestamp('ns'), 'category': pa.dictionary(pa.int32(), pa.string())}
+
+    campos = [pa.field(col, tipos[tipo]) for col, tipo in pf.esquema_registro.items() if col != 'cd_periodo_proceso']
+
+    return pa.schema(campos + [pa.field('tx_novedad', pa.dictionary(pa.int8(), pa.string()))])
+
+
+def armo_novedad_periodo(base_insert, base_update):
+
+    '''
+        Armo las filas del lago de un periodo: las versiones nuevas (altas y cambios, tal como se insertaron en MySql)
+        y un cierre por cada CUIT que cambio, con el nu_cuit, la fh_fin_registro que quedo en la version anterior
+        (un dia antes del inicio de la nueva) y el resto de las columnas nulas. La version cerrada esta en la
+        particion del periodo en que se abrio.
+
+        input:
+            base_insert: (pandas.DataFrame) CUITs insertados (pf.base_final_para_actualizar)
+            base_update: (pandas.DataFrame) CUITs updateados (pf.base_final_para_actualizar)
+        output:
+            novedad: (pandas.DataFrame) Filas del periodo con la columna tx_novedad
+    '''
+
+    columnas = [col for col in pf.esquema_registro if col != 'cd_periodo_proceso']
+
+    altas = base_insert.reindex(columns= columnas)
+    altas['tx_novedad'] = 'alta'
+
+    cambios = base_update.reindex(columns= columnas)
+    cambios['tx_novedad'] = 'cambio'
+
+    cierres = pd.DataFrame({'nu_cuit': base_update['nu_cuit'].to_numpy(),
+                            'fh_fin_registro': pd.to_datetime(base_update['fh_inicio_registro']) - pd.Timedelta(days= 1),
+                            'cd_log_proceso': base_update['cd_log_proceso'].to_numpy()}).reindex(columns= columnas)
+    cierres['tx_novedad'] = 'cierre'
+
+    novedad = pf.aplico_esquema(pd.concat([pf.aplico_esquema(base) for base in [altas, cambios, cierres]], ignore_index= True))
+    novedad['tx_novedad'] = pd.Categorical(novedad['tx_novedad'], categories= novedades)
+
+    return novedad
+
+
+def guardo_particion(novedad, periodo, carpeta= lago_path):
+
+    '''
+        Guardo las filas de un periodo en carpeta/cd_periodo_proceso=AAAAMM/part-0.parquet, ordenadas por
+        orden_particion y en row groups de filas_por_grupo filas con estadisticas por columna. Se escribe en una
+        carpeta temporal que reemplaza a la particion, asi volver a exportar un periodo no duplica filas.
+
+        input:
+            novedad: (pandas.DataFrame) Filas del periodo (armo_novedad_periodo)
+            periodo: (int) Periodo AAAAMM
+            carpeta: (str) Carpeta del lago
+        output:
+            resumen: (dict) Filas por tipo de novedad, row groups y bytes de la particion
+    '''
+
+    novedad = novedad.sort_values(orden_particion, kind= 'stable', na_position= 'last')
+    tabla = pa.Table.from_pandas(novedad, schema= esquema_lago(), preserve_index= False)
+
+    path = os.path.join(carpeta, f'cd_periodo_proceso={periodo}')
+    shutil.rmtree(path + '.tmp', ignore_errors= True)
+    os.makedirs(path + '.tmp')
+
+    pq.write_table(tabla, os.path.join(path + '.tmp', 'part-0.parquet'), row_group_size= filas_por_grupo,
+                   compression= 'zstd', write_statistics= True)
+
+    # os.replace no pisa una carpeta con archivos: muevo la particion anterior, activo la nueva y borro la anterior
+    if os.path.exists(path):
+        shutil.rmtree(path + '.old', ignore_errors= True)
+        os.replace(path, path + '.old')
+    os.replace(path + '.tmp', path)
+    shutil.rmtree(path + '.old', ignore_errors= True)
+
+    conteo = novedad['tx_novedad'].value_counts()
+
+    return {**{tipo: int(conteo.get(tipo, 0)) for tipo in novedades},
+            'row_groups': pq.ParquetFile(os.path.join(path, 'part-0.parquet')).num_row_groups,
+            'bytes': os.path.getsize(os.path.join(path, 'part-0.parquet'))}
+
+
+def periodos_lago(carpeta= lago_path):
+
+    '''
+        Periodos exportados al lago
+
+        input:
+            carpeta: (str) Carpeta del lago
+        output:
+            periodos: (list) Periodos AAAAMM ordenados
+    '''
+
+    if not os.path.exists(carpeta):
+        return []
+
+    return sorted(int(particion.split('=')[1]) for particion in os.listdir(carpeta)
+                  if particion.startswith('cd_periodo_proceso=') and particion[-4:] not in ('.tmp', '.old'))
+
+
+def construyo_lago(historia, carpeta= lago_path):
+
+    '''
+        Armo el lago entero desde la historia SCD-2 (historia_functions.descargo_historia con todas las columnas de
+        pf.esquema_registro): cada version va a la particion de su cd_periodo_proceso como alta (la primera version
+        del CUIT) o cambio, y cada version cerrada da un cierre en la particion de la version que la reemplazo.
+
+        input:
+            historia: (pandas.DataFrame) Todas las versiones de registro_sociedades
+            carpeta: (str) Carpeta del lago
+        output:
+            resumen: (dict) Resumen de cada particion
+    '''
+
+    historia = pf.aplico_esquema(historia).sort_values(['nu_cuit', 'fh_inicio_registro'], kind= 'stable').reset_index(drop= True)
+
+    cuits = historia['nu_cuit'].to_numpy()
+    primera = np.ones(cuits.shape[0], dtype= bool)
+    primera[1:] = cuits[1:] != cuits[:-1]
+
+    # Cada version que no es la primera cierra a la anterior del mismo CUIT
+    siguientes = historia.loc[~primera, :]
+    anteriores = historia.loc[np.flatnonzero(~primera) - 1, :]
+
+    cierres = pd.DataFrame({'nu_cuit': siguientes['nu_cuit'].to_numpy(),
+                            'fh_fin_registro': anteriores['fh_fin_registro'].to_numpy(),
+                            'cd_log_proceso': siguientes['cd_log_proceso'].to_numpy(),
+                            'cd_periodo_proceso': siguientes['cd_periodo_proceso'].to_numpy()})
+
+    # Las versiones quedan como se insertaron, vigentes: el fin de cada una esta en su cierre
+    historia['fh_fin_registro'] = pd.Timestamp('2100-12-31')
+    historia['tx_novedad'] = np.where(primera, 'alta', 'cambio')
+    cierres['tx_novedad'] = 'cierre'
+
+    filas = pf.aplico_esquema(pd.concat([historia, pf.aplico_esquema(cierres.reindex(columns= historia.columns))], ignore_index= True))
+    filas['tx_novedad'] = pd.Categorical(filas['tx_novedad'], categories= novedades)
+
+    shutil.rmtree(carpeta, ignore_errors= True)
+    os.makedirs(carpeta)
+
+    resumen = {}
+    for periodo, novedad in filas.groupby('cd_periodo_proceso', sort= True):
+        resumen[int(periodo)] = guardo_particion(novedad.drop(columns= 'cd_periodo_proceso'), int(periodo), carpeta)
+
+    return resumen
+
+
+def exporto_periodo_lago(base_insert, base_update, periodo, carpeta= lago_path):
+
+    '''
+        Exporto al lago las novedades de un periodo que ya quedo en MySql. Si el lago no existe o no tiene el periodo
+        anterior (por ejemplo si se salteo una exportacion) lo vuelvo a armar desde la historia en MySql, que ya
+        incluye el periodo.
+
+        input:
+            base_insert: (pandas.DataFrame) CUITs insertados en el periodo
+            base_update: (pandas.DataFrame) CUITs updateados en el periodo
+            periodo: (int) Periodo AAAAMM cargado
+            carpeta: (str) Carpeta del lago
+        output:
+            resumen: (dict) Resumen de la particion (o de la reconstruccion). None si no esta instalado pyarrow
+    '''
+
+    if pa is None:
+        return None
+
+    periodos = periodos_lago(carpeta)
+
+    if not periodos or (uf.periodo_anterior(periodo) not in periodos and periodo not in periodos):
+        columnas = [col for col in pf.esquema_registro if col not in ('nu_cuit', 'fh_inicio_registro', 'fh_fin_registro')]
+        resumen = construyo_lago(hf.descargo_historia(columnas), carpeta)
+        return {'construido': True, 'particiones': len(resumen)}
+
+    return guardo_particion(armo_novedad_periodo(base_insert, base_update), periodo, carpeta)
+
+
+def leo_lago(columnas= None, desde= None, hasta= None, filtros= None, novedad= None, carpeta= lago_path):
+
+    '''
+        Leo filas del lago leyendo solo las particiones, row groups y columnas que hacen falta
+
+        input:
+            columnas: (list) Columnas a leer. Si es None todas. cd_periodo_proceso (la particion) viene siempre
+            desde: (int) Primer periodo AAAAMM. Si es None desde el primero
+            hasta: (int) Ultimo periodo AAAAMM. Si es None hasta el ultimo
+            filtros: (list) Filtros extra como tuplas (columna, operador, valor) de pyarrow, por ejemplo
+                     [('cd_provincia_dom_fiscal', '=', 1), ('cd_tipo_societario', 'in', [10, 11])]
+            novedad: (list) Tipos de novedad a leer ('alta', 'cambio', 'cierre'). Si es None todos
+            carpeta: (str) Carpeta del lago
+        output:
+            filas: (pandas.DataFrame) Filas con los tipos de pf.esquema_registro
+    '''
+
+    if pq is None:
+        raise ImportError('Para leer el lago hay que instalar pyarrow (pip install pyarrow)')
+
+    condiciones = list(filtros or [])
+    if desde is not None:
+        condiciones.append(('cd_periodo_proceso', '>=', desde))
+    if hasta is not None:
+        condiciones.append(('cd_periodo_proceso', '<=', hasta))
+    if novedad is not None:
+        condiciones.append(('tx_novedad', 'in', list(novedad)))
+
+    esquema = esquema_lago().append(pa.field('cd_periodo_proceso', pa.int32()))
+    particiones = ds.partitioning(pa.schema([pa.field('cd_periodo_proceso', pa.int32())]), flavor= 'hive')
+
+    if columnas is not None and 'cd_periodo_proceso' not in columnas:
+        columnas = list(columnas) + ['cd_periodo_proceso']
+
+    tabla = pq.read_table(carpeta, columns= columnas, filters= condiciones or None, schema= esquema, partitioning= particiones)
+
+    # Los enteros con nulos pasan directo a enteros nullable: como float64 se pierde precision en nu_digest
+    enteros = {pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int64Dtype(), pa.int64(): pd.Int64Dtype()}
+
+    return pf.aplico_esquema(tabla.to_pandas(types_mapper= enteros.get))
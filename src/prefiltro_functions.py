@@ -0,0 +1,357 @@
+import os
+import json
+import zlib
+import codecs
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import utils_file_functions as uf
+
+prefiltro_path = './data/prefiltro'
+
+# Hash de los CUITs que se procesan siempre (duplicados en el archivo o con fechas que dependen del periodo)
+hash_siempre = np.uint64(0)
+
+
+def huella_lookups(lookups):
+
+    '''
+        Huella de las tablas de lookup. Si cambian los lookups una misma linea puede codificarse distinto, asi que
+        el estado del prefiltro solo sirve con la misma huella
+
+        input:
+            lookups: (dict) Lookups de process_file_functions.descargo_lookups
+        output:
+            huella: (str) crc32 de los lookups
+    '''
+
+    return str(zlib.crc32(json.dumps(lookups, sort_keys= True, default= str).encode('utf-8')))
+
+
+def leo_registros(archivo, bytes_por_lote= 64 * 2**20):
+
+    '''
+        Leo el archivo en crudo por lotes de registros (bytes, con el fin de linea). Un registro con comillas
+        abiertas sigue en las lineas siguientes hasta que se cierran, como lo lee pandas.
+
+        input:
+            archivo: (io.BufferedReader) Archivo abierto, posicionado en el primer registro
+            bytes_por_lote: (int) Bytes aproximados de cada lote
+        output:
+            registros: (generator) Listas de registros
+    '''
+
+    pendiente = b''
+
+    while True:
+        lineas = archivo.readlines(bytes_por_lote)
+        if not lineas:
+            break
+
+        # readlines solo corta una linea sin fin de linea al final del archivo
+        if not lineas[-1].endswith(b'\n'):
+            lineas[-1] += b'\n'
+
+        if pendiente:
+            lineas[0] = pendiente + lineas[0]
+            pendiente = b''
+
+        impares = [linea.count(b'"') % 2 for linea in lineas]
+
+        if any(impares):
+            registros = []
+            actual = []
+            abierto = False
+            for linea, impar in zip(lineas, impares):
+                actual.append(linea)
+                abierto ^= bool(impar)
+                if not abierto:
+                    registros.append(b''.join(actual))
+                    actual = []
+            pendiente = b''.join(actual)
+            lineas = registros
+
+        if lineas:
+            yield lineas
+
+    if pendiente:
+        yield [pendiente]
+
+
+def claves_registros(registros):
+
+    '''
+        CUIT (primer campo) y hash de 64 bits de cada registro crudo. El hash no tiene en cuenta el fin de linea.
+
+        input:
+            registros: (list) Registros en bytes (ver leo_registros)
+        output:
+            cuits: (numpy.array) CUITs int64, -1 si el primer campo no es un CUIT de 11 digitos
+            hashes: (numpy.array) Hashes uint64
+    '''
+
+    if not registros:
+        return np.array([], dtype= 'int64'), np.array([], dtype= 'uint64')
+
+    cuits = np.array([registro[:registro.find(b',')].strip(b'"') for registro in registros])
+    validos = np.char.isdigit(cuits) & (np.char.str_len(cuits) == 11)
+    cuits[~validos] = b'-1'
+
+    hashes = pd.util.hash_array(np.array([registro.rstrip(b'\r\n') for registro in registros], dtype= 'object'))
+
+    return cuits.astype('int64'), hashes
+
+
+def abro_registros(file_path):
+
+    '''
+        Abro el archivo para leer los registros en crudo: salteo el BOM y la fila de headers si la tiene
+
+        input:
+            file_path: (str) Path del .csv (puede ser 'archivo.zip/archivo.csv', ver uf.abro_archivo)
+        output:
+            archivo: (io.BufferedReader) Archivo posicionado en el primer registro
+            headers: (list) Headers del archivo (ver uf.check_headers)
+    '''
+
+    archivo = uf.abro_archivo(file_path)
+    skip, headers = uf.check_headers(archivo)
+
+    if archivo.peek(3)[:3] == codecs.BOM_UTF8:
+        archivo.read(3)
+    if skip:
+        archivo.readline()
+
+    return archivo, headers
+
+
+class prefiltro_lineas:
+
+    '''
+        Prefiltro de lineas crudas contra el archivo del periodo anterior: guardo el CUIT y un hash de 64 bits de la
+        linea de cada CUIT y del archivo nuevo solo pasan a pandas (proceso_columnas, codificacion, comparacion) los
+        registros nuevos o que cambiaron. Las lineas iguales no pueden dar registros distintos, salvo:
+            - CUITs duplicados en el archivo: siempre pasan todos sus registros
+            - Registros con fechas que quedaron nulas (posteriores al periodo o invalidas): pueden cambiar con el
+              periodo sin que cambie la linea, se marcan con marco_cambiantes y pasan siempre
+            - Cambios en los lookups: si cambia la huella pasa el archivo entero
+        Los CUITs del periodo anterior que no estan en el archivo nuevo se informan aparte.
+
+        El estado nuevo de cada periodo queda pendiente en memoria (lo usa el periodo siguiente, que se prepara
+        mientras se escribe este) y se guarda en carpeta/estado.npz recien con confirmo, cuando el periodo quedo
+        en la base. Si el filtro corre en otro proceso (pf.preparo_periodo_en_proceso) el estado de cada periodo
+        vuelve al proceso principal con estado y se registra con agrego_estado.
+    '''
+
+    def __init__(self, carpeta= prefiltro_path):
+
+        '''
+            input:
+                carpeta: (str) Carpeta del estado y de los CUITs faltantes de cada periodo
+        '''
+
+        self.carpeta = carpeta
+        self._estados = {}
+        self._lock = threading.Lock()
+
+        path = os.path.join(carpeta, 'estado.npz')
+        if os.path.exists(path):
+            with np.load(path) as estado:
+                self._estados[int(estado['periodo'])] = {'cuits': estado['cuits'], 'hashes': estado['hashes'], 'huella': str(estado['huella'])}
+
+    def __getstate__(self):
+        # El lock no se puede pasar a otro proceso, la copia crea el suyo
+        estado = dict(self.__dict__)
+        del estado['_lock']
+        return estado
+
+    def __setstate__(self, estado):
+        self.__dict__.update(estado)
+        self._lock = threading.Lock()
+
+    def filtro(self, file_path, file_period, lookups):
+
+        '''
+            Filtro los registros del archivo que no cambiaron desde el periodo anterior
+
+            input:
+                file_path: (str) Path del .csv del periodo
+                file_period: (int) Periodo AAAAMM del archivo
+                lookups: (dict) Lookups con los que se va a codificar (ver huella_lookups)
+            output:
+                archivo: (io.BufferedRandom) .csv temporal en carpeta con headers y solo los registros a procesar (se lee
+                         como el original y se borra al cerrarlo)
+                resumen: (dict) Registros del archivo, sin cambios, a procesar, CUITs nuevos, cambiados, duplicados y faltantes
+        '''
+
+        huella = huella_lookups(lookups)
+
+        with self._lock:
+            anterior = self._estados.get(uf.periodo_anterior(file_period))
+
+        resumen = {'periodo_anterior': None}
+        if anterior is not None and anterior['huella'] != huella:
+            anterior = None
+            resumen['periodo_anterior'] = 'lookups distintos'
+        elif anterior is not None:
+            resumen['periodo_anterior'] = uf.periodo_anterior(file_period)
+
+        os.makedirs(self.carpeta, exist_ok= True)
+
+        # Los registros a procesar van a un archivo temporal que se borra al cerrarlo: sin estado anterior es el
+        # archivo entero, asi que no lo armo en memoria
+        salida = tempfile.TemporaryFile(dir= self.carpeta, buffering= 1024 * 1024)
+
+        try:
+            cuits, hashes, iguales = [], [], []
+
+            archivo, headers = abro_registros(file_path)
+            salida.write((','.join(headers) + '\n').encode('utf-8'))
+
+            for registros in leo_registros(archivo):
+                cuits_lote, hashes_lote = claves_registros(registros)
+
+                if anterior is not None and anterior['cuits'].shape[0] > 0:
+                    posiciones = np.minimum(np.searchsorted(anterior['cuits'], cuits_lote), anterior['cuits'].shape[0] - 1)
+                    igual = (anterior['cuits'][posiciones] == cuits_lote) & (anterior['hashes'][posiciones] == hashes_lote) & (cuits_lote > 0)
+                else:
+                    igual = np.zeros(cuits_lote.shape[0], dtype= bool)
+
+                salida.writelines([registro for registro, descarto in zip(registros, igual) if not descarto])
+
+                cuits.append(cuits_lote)
+                hashes.append(hashes_lote)
+                iguales.append(igual)
+
+            archivo.close()
+
+            cuits = np.concatenate(cuits) if cuits else np.array([], dtype= 'int64')
+            hashes = np.concatenate(hashes) if hashes else np.array([], dtype= 'uint64')
+            iguales = np.concatenate(iguales) if iguales else np.array([], dtype= bool)
+
+            # CUITs duplicados en el archivo: pasan todos sus registros
+            distintos, inversa, repeticiones = np.unique(cuits, return_inverse= True, return_counts= True)
+            duplicado = (repeticiones[inversa] > 1) & (cuits > 0)
+
+            if (iguales & duplicado).any():
+                iguales &= ~duplicado
+                salida.seek(0)
+                salida.truncate()
+                salida.write((','.join(headers) + '\n').encode('utf-8'))
+
+                archivo, _ = abro_registros(file_path)
+                i = 0
+                for registros in leo_registros(archivo):
+                    salida.writelines([registro for registro, descarto in zip(registros, iguales[i:i+len(registros)]) if not descarto])
+                    i += len(registros)
+                archivo.close()
+
+            # Estado nuevo: un hash por CUIT valido, los duplicados con hash_siempre
+            validos = distintos > 0
+            primera = np.zeros(distintos.shape[0], dtype= 'int64')
+            primera[inversa] = np.arange(cuits.shape[0])
+            hashes_estado = np.where(repeticiones > 1, hash_siempre, hashes[primera]).astype('uint64')
+            estado = {'cuits': distintos[validos], 'hashes': hashes_estado[validos], 'huella': huella}
+
+            if anterior is not None:
+                cuit_nuevo = ~np.isin(cuits, anterior['cuits']) & (cuits > 0)
+                faltantes = np.setdiff1d(anterior['cuits'], estado['cuits'], assume_unique= True)
+            else:
+                cuit_nuevo = cuits > 0
+                faltantes = np.array([], dtype= 'int64')
+
+            path_faltantes = os.path.join(self.carpeta, f'cuits_faltantes_{file_period}.csv')
+            pd.DataFrame({'nu_cuit': faltantes}).to_csv(path_faltantes, index= False)
+
+            with self._lock:
+                self._estados[file_period] = estado
+
+            resumen.update({'registros': int(cuits.shape[0]),
+                            'registros_sin_cambios': int(iguales.sum()),
+                            'registros_a_procesar': int((~iguales).sum()),
+                            'cuits_nuevos': int(cuit_nuevo.sum()),
+                            'registros_cambiados': int((~iguales & ~cuit_nuevo & (cuits > 0)).sum()),
+                            'registros_duplicados': int(duplicado.sum()),
+                            'cuits_faltantes': int(faltantes.shape[0]),
+                            'archivo_cuits_faltantes': path_faltantes})
+        except Exception:
+            salida.close()
+            raise
+
+        salida.seek(0)
+
+        return salida, resumen
+
+    def marco_cambiantes(self, file_period, cuits):
+
+        '''
+            Marco CUITs del estado del periodo para que pasen siempre el prefiltro (registros que pueden cambiar sin
+            que cambie la linea)
+
+            input:
+                file_period: (int) Periodo AAAAMM del estado
+                cuits: (array) CUITs a marcar
+            output:
+        '''
+
+        with self._lock:
+            estado = self._estados.get(file_period)
+            if estado is not None and len(cuits):
+                estado['hashes'][np.isin(estado['cuits'], np.asarray(cuits, dtype= 'int64'))] = hash_siempre
+
+    def estado(self, file_period):
+
+        '''
+            Estado pendiente del periodo (CUITs, hashes y huella de los lookups), None si no se filtro el periodo
+        '''
+
+        with self._lock:
+            return self._estados.get(file_period)
+
+    def agrego_estado(self, file_period, estado):
+
+        '''
+            Registro el estado de un periodo filtrado en otro proceso (ver estado), queda pendiente hasta confirmo
+
+            input:
+                file_period: (int) Periodo AAAAMM del estado
+                estado: (dict) Estado del periodo (ver estado)
+            output:
+        '''
+
+        with self._lock:
+            self._estados[file_period] = estado
+
+    def descarto_anteriores(self, file_period):
+
+        '''
+            Descarto de memoria los estados de los periodos anteriores a file_period
+        '''
+
+        with self._lock:
+            for periodo in [periodo for periodo in self._estados if periodo < file_period]:
+                del self._estados[periodo]
+
+    def confirmo(self, file_period):
+
+        '''
+            Guardo el estado del periodo cuando ya quedo en la base (archivo temporal y rename) y descarto los anteriores
+
+            input:
+                file_period: (int) Periodo AAAAMM confirmado
+            output:
+        '''
+
+        with self._lock:
+            estado = self._estados.get(file_period)
+            if estado is None:
+                return
+
+            os.makedirs(self.carpeta, exist_ok= True)
+            path = os.path.join(self.carpeta, 'estado.npz')
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, periodo= file_period, cuits= estado['cuits'], hashes= estado['hashes'], huella= estado['huella'])
+            os.replace(path + '.tmp', path)
+
+        self.descarto_anteriores(file_period)
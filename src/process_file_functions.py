@@ -1,7 +1,210 @@
+import io
+import os
+import sys
+import shutil
+import itertools
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
 import pandas as pd
 import numpy as np
 import utils_file_functions as uf
-from artifacts.connections import make_mysql_connection
+import backend_functions as bk
+import instrumentation_functions as ins
+from backend_functions import make_connection as make_mysql_connection
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# Variables de la base final que se comparan contra la base actual en MySql
+variables_finales = ['nu_cuit', 'nb_razon_social', 'cd_tipo_societario', 'fh_contrato_social', 'fh_actualizacion',
+                     'cd_provincia_dom_fiscal', 'nb_localidad_dom_fiscal', 'cd_postal_dom_fiscal',
+                     'nb_calle_dom_fiscal', 'nu_calle_dom_fiscal', 'tx_piso_dom_fiscal', 'tx_depto_dom_fiscal','cd_estado_dom_fiscal',
+                     'cd_provincia_dom_legal', 'nb_localidad_dom_legal', 'cd_postal_dom_legal',
+                     'nb_calle_dom_legal', 'nu_calle_dom_legal', 'tx_piso_dom_legal', 'tx_depto_dom_legal','cd_estado_dom_legal']
+
+# Esquema de la base para comparar y de la base vigente: enteros, categoricas y fechas en lugar de objetos de Python.
+# Se aplica desde la lectura del archivo hasta la escritura, donde recien se pasa a valores de MySql (ver valores_para_mysql)
+esquema_registro = {'nu_cuit': 'int64',
+                    'nb_razon_social': 'object',
+                    'cd_tipo_societario': 'Int16',
+                    'fh_contrato_social': 'datetime64[ns]',
+                    'fh_actualizacion': 'datetime64[ns]',
+                    'cd_provincia_dom_fiscal': 'Int16',
+                    'nb_localidad_dom_fiscal': 'category',
+                    'cd_postal_dom_fiscal': 'Int64',
+                    'nb_calle_dom_fiscal': 'object',
+                    'nu_calle_dom_fiscal': 'Int64',
+                    'tx_piso_dom_fiscal': 'category',
+                    'tx_depto_dom_fiscal': 'category',
+                    'cd_estado_dom_fiscal': 'Int16',
+                    'cd_provincia_dom_legal': 'Int16',
+                    'nb_localidad_dom_legal': 'category',
+                    'cd_postal_dom_legal': 'Int64',
+                    'nb_calle_dom_legal': 'object',
+                    'nu_calle_dom_legal': 'Int64',
+                    'tx_piso_dom_legal': 'category',
+                    'tx_depto_dom_legal': 'category',
+                    'cd_estado_dom_legal': 'Int16',
+                    'fh_inicio_registro': 'datetime64[ns]',
+                    'fh_fin_registro': 'datetime64[ns]',
+                    'cd_log_proceso': 'Int64',
+                    'cd_periodo_proceso': 'Int64',
+                    'nu_digest': 'Int64'}
+
+# Columnas del archivo con pocos valores distintos, se leen directamente como categoricas
+categoricas_archivo = ['tipo_societario', 'dom_fiscal_provincia', 'dom_fiscal_localidad', 'dom_fiscal_piso',
+                       'dom_fiscal_departamento', 'dom_fiscal_estado_domicilio', 'dom_legal_provincia',
+                       'dom_legal_localidad', 'dom_legal_piso', 'dom_legal_departamento', 'dom_legal_estado_domicilio']
+
+# Cache en memoria de las tablas de lookup (ver descargo_lookups)
+_cache_lookups = {}
+
+# Carpeta donde proceso_archivo_por_lotes deja los registros de cada lote (ver base_por_lotes)
+lotes_path = './data/lotes'
+
+
+def tipos_lectura(headers):
+
+    '''
+        Tipos para leer el archivo con pd.read_csv: categoricas las de pocos valores distintos y el resto como objeto
+        
+        input:
+            headers: (list) Headers del file
+        output: 
+            tipos: (dict) {columna: tipo}
+    '''
+    
+    return {col: 'category' if col in categoricas_archivo else 'object' for col in headers}
+
+
+def a_entero(serie):
+
+    '''
+        Paso una columna a entero nullable: lo que no es numero o no entra en un int64 queda nulo y los decimales se redondean
+        
+        input:
+            serie: (pandas.Series) Columna a convertir
+        output: 
+            serie: (pandas.Series) Columna Int64
+    '''
+    
+    numeros = pd.to_numeric(serie, errors= 'coerce')
+
+    if not pd.api.types.is_float_dtype(numeros):
+        return numeros.astype('Int64')
+
+    enteros = numeros.where(numeros.abs() < 2 ** 62).round().astype('Int64')
+
+    # Con nulos to_numeric pasa a float64 y los enteros de mas de 53 bits (nu_digest, por ejemplo) pierden precision:
+    # si vienen como objetos (de MySql o de texto) esos los paso uno por uno desde el valor original
+    grandes = (numeros.abs() >= 2 ** 53).to_numpy()
+    if serie.dtype == 'object' and grandes.any():
+        enteros[grandes] = pd.array([entero_exacto(valor) for valor in serie[grandes]], dtype= 'Int64')
+
+    return enteros
+
+
+def entero_exacto(valor):
+
+    '''
+        Paso un valor (int, Decimal, float o texto) a int sin pasar por float64
+
+        input:
+            valor: Valor a convertir
+        output:
+            entero: (int) Valor redondeado, None si no es numero o no entra en un int64
+    '''
+
+    try:
+        entero = int(Decimal(str(valor).strip()).to_integral_value())
+    except (InvalidOperation, ValueError):
+        return None
+
+    return entero if -2 ** 63 <= entero < 2 ** 63 else None
+
+
+def aplico_esquema(data):
+
+    '''
+        Paso las columnas de la base a los tipos de esquema_registro (las columnas que no estan en el esquema quedan igual)
+        
+        input:
+            data: (pandas.DataFrame) Base a tipar
+        output: 
+            data: (pandas.DataFrame) Base con los tipos del esquema
+    '''
+    
+    data = data.copy(deep= False)
+    
+    for col, tipo in esquema_registro.items():
+        if col not in data.columns or data[col].dtype == tipo:
+            continue
+        
+        if tipo == 'datetime64[ns]':
+            data[col] = pd.to_datetime(data[col], errors= 'coerce')
+        elif tipo in ('int64', 'Int64', 'Int16'):
+            data[col] = a_entero(data[col]).astype(tipo)
+        elif tipo == 'category':
+            data[col] = data[col].astype('category')
+        else:
+            data[col] = data[col].astype('object')
+    
+    return data
+
+
+def concateno_bases(bases):
+
+    '''
+        Concateno bases con columnas categoricas unificando antes las categorias, para que no terminen como objeto
+        
+        input:
+            bases: (list) Bases a concatenar
+        output: 
+            base: (pandas.DataFrame) Base concatenada
+    '''
+    
+    bases = [base.copy(deep= False) for base in bases]
+    
+    for col in bases[0].columns:
+        if all(base[col].dtype == 'category' for base in bases):
+            categorias = pd.api.types.union_categoricals([base[col] for base in bases]).categories
+            for base in bases:
+                base[col] = base[col].cat.set_categories(categorias)
+    
+    return pd.concat(bases, ignore_index= True)
+
+
+def registros_iguales(base_a, base_b):
+
+    '''
+        Comparo registro a registro dos bases con las mismas columnas en el mismo orden. Dos nulos se toman como iguales.
+        
+        input:
+            base_a: (pandas.DataFrame) Primera base
+            base_b: (pandas.DataFrame) Segunda base
+        output: 
+            iguales: (numpy.array) True en los registros que son iguales en todas las columnas
+    '''
+    
+    iguales = np.ones(base_a.shape[0], dtype= bool)
+    
+    for col_a, col_b in zip(base_a.columns, base_b.columns):
+        a = base_a[col_a].reset_index(drop= True)
+        b = base_b[col_b].reset_index(drop= True)
+        
+        if a.dtype == 'category' or b.dtype == 'category':
+            a = a.astype('object')
+            b = b.astype('object')
+        
+        nulos = a.isnull().to_numpy() & b.isnull().to_numpy()
+        iguales &= (a == b).to_numpy(dtype= bool, na_value= False) | nulos
+    
+    return iguales
 
 def proceso_columnas(data, file_period):
 
@@ -9,7 +212,7 @@ def proceso_columnas(data, file_period):
         Proceso el archivo:
             1) Saco espacios de mas en los nombres como razon social, domicilios, etc.
             2) Creo variables fechas y corrijo algunos casos en donde la empresa se creo despues del archivo actual
-            3) Paso a numerico los codigos postales
+            3) Paso a enteros nullables los codigos postales, numeros de calle y CUITs
         
         input:
             data: (pandas.DataFrame) Base a procesar
@@ -29,8 +232,14 @@ def proceso_columnas(data, file_period):
                    'dom_legal_localidad', 'dom_legal_calle', 'dom_legal_piso', 'dom_legal_departamento',
                    'dom_legal_estado_domicilio']
 
-    # Lower todos los tipos strings
-    data.loc[:,string_cols] = data[string_cols].apply(lambda x: uf.proceso_string(x))
+    # Columnas con pocos valores distintos, reuso la normalizacion de archivos anteriores
+    dict_cols = ['tipo_societario', 'dom_fiscal_provincia', 'dom_fiscal_localidad', 'dom_fiscal_estado_domicilio',
+                 'dom_legal_provincia', 'dom_legal_localidad', 'dom_legal_estado_domicilio']
+
+    # Lower todos los tipos strings, las de pocos valores distintos quedan categoricas
+    for col in string_cols:
+        data[col] = uf.proceso_string(data[col], uf.diccionario_normalizacion if col in dict_cols else None, 
+                                      categoria= col in categoricas_archivo)
 
     # Corrijo la fecha de constitucion para ser YYYY-MM-DD
     data['fh_contrato_social'] = data['fecha_contrato_social'].str[:10] 
@@ -43,10 +252,10 @@ def proceso_columnas(data, file_period):
     data.loc[data['fh_actualizacion'] >= file_next_date, 'fh_actualizacion'] = np.NaN
 
     # Pongo en Integer el Codigo Postal y el domicilio 
-    data['dom_fiscal_cp'] = pd.to_numeric(data['dom_fiscal_cp'], errors= 'coerce')
-    data['dom_legal_cp'] = pd.to_numeric(data['dom_legal_cp'], errors= 'coerce')
-    data['dom_fiscal_numero'] = pd.to_numeric(data['dom_fiscal_numero'], errors= 'coerce')
-    data['dom_legal_numero'] = pd.to_numeric(data['dom_legal_numero'], errors= 'coerce')
+    data['dom_fiscal_cp'] = a_entero(data['dom_fiscal_cp'])
+    data['dom_legal_cp'] = a_entero(data['dom_legal_cp'])
+    data['dom_fiscal_numero'] = a_entero(data['dom_fiscal_numero'])
+    data['dom_legal_numero'] = a_entero(data['dom_legal_numero'])
 
     # Filtro un poco los pisos y deptos de los domicilios
     data.loc[data['dom_legal_piso'].str.len() > 20, 'dom_legal_piso'] = np.NaN
@@ -58,21 +267,61 @@ def proceso_columnas(data, file_period):
     data['cuit_valido'] = uf.cuit_validation(data['cuit'])
     
     # Cambio de string a int
-    data['cuit'] = pd.to_numeric(data['cuit'], errors= 'coerce')
+    data['cuit'] = a_entero(data['cuit'])
     
     return data
 
-def codifico_columnas(data):
+def filtro_registros_invalidos(data):
 
     '''
-        Codifico las columnas: dom_fiscal_provincia, dom_legal_provincia, dom_fiscal_estado_domicilio, dom_legal_estado_domicilio y tipo_societario.
+        Saco los registros sin CUIT, razon social o fecha de contrato social y los que tienen CUITs invalidos
         
         input:
-            data: (pandas.DataFrame) Base a codificar
+            data: (pandas.DataFrame) Base procesada con proceso_columnas
         output: 
-            data: (pandas.DataFrame) Base con columnas codificadas
+            data: (pandas.DataFrame) Base con registros validos
+    '''
+    
+    invalid_rows = data[['cuit','razon_social','fh_contrato_social']].isnull().any(axis= 1)
+    invalid_rows = invalid_rows | ~data['cuit_valido']
+    
+    return data.loc[~invalid_rows,:]
+
+
+def cuits_con_fechas_nulas(data):
+
+    '''
+        CUITs con fecha de contrato social o de actualizacion en el archivo que quedaron nulas en proceso_columnas
+        (posteriores al periodo o invalidas). Con la misma linea el registro puede cambiar de un periodo a otro
+        (ver prefiltro_functions)
+        
+        input:
+            data: (pandas.DataFrame) Base procesada con proceso_columnas
+        output:
+            cuits: (numpy.array) CUITs int64
+    '''
+    
+    nulas = (data['fecha_contrato_social'].notnull() & data['fh_contrato_social'].isnull()) | \
+            (data['fecha_actualizacion'].notnull() & data['fh_actualizacion'].isnull())
+    
+    return data.loc[nulas, 'cuit'].dropna().to_numpy(dtype= 'int64')
+
+
+def descargo_lookups(forzar= False):
+
+    '''
+        Descargo de MySql las tablas de lookup para codificar provincias, tipos societarios y estados del domicilio.
+        Quedan en cache en memoria para los siguientes archivos que se procesen (ver invalido_cache_lookups)
+        
+        input:
+            forzar: (bool) Si es True las vuelvo a descargar aunque esten en cache
+        output: 
+            lookups: (dict) Diccionarios {valor: codigo} para 'provincia', 'tipo_societario' y 'estado_domicilio'
     '''
     
+    if _cache_lookups and not forzar:
+        return _cache_lookups
+    
     mysql = make_mysql_connection('empresas')
     
     with mysql.cursor() as cur:
@@ -89,24 +338,59 @@ def codifico_columnas(data):
         look_estado_domicilio = {est: cod for cod, est in cur.fetchall()}
     mysql.close()
     
-    data['cd_provincia_dom_fiscal'] = data['dom_fiscal_provincia'].apply(lambda x: look_provincia.get(x, -2))
-    data['cd_provincia_dom_legal'] = data['dom_legal_provincia'].apply(lambda x: look_provincia.get(x, -2))
-    data['cd_estado_dom_fiscal'] = data['dom_fiscal_estado_domicilio'].apply(lambda x: look_estado_domicilio.get(x, -2))
-    data['cd_estado_dom_legal'] = data['dom_legal_estado_domicilio'].apply(lambda x: look_estado_domicilio.get(x, -2))
-    data['cd_tipo_societario'] = data['tipo_societario'].apply(lambda x: look_tipo_societario.get(x, -2))
+    _cache_lookups.clear()
+    _cache_lookups.update({'provincia': look_provincia, 'tipo_societario': look_tipo_societario, 'estado_domicilio': look_estado_domicilio})
+    
+    return _cache_lookups
+
+
+def invalido_cache_lookups():
+
+    '''
+        Borro la cache de lookups, la proxima llamada a descargo_lookups los vuelve a descargar de MySql
+        (por ejemplo despues de dar de alta valores nuevos en look_provincia)
+        
+        input:
+        output:
+    '''
+    
+    _cache_lookups.clear()
+
+
+def codifico_columnas(data, lookups= None):
+
+    '''
+        Codifico las columnas: dom_fiscal_provincia, dom_legal_provincia, dom_fiscal_estado_domicilio, dom_legal_estado_domicilio y tipo_societario.
+        Por cada columna factorizo los valores, busco el codigo solo de los valores distintos y en la misma
+        pasada saco los valores que no estan en el lookup. Los nulos y los valores no registrados quedan en -1.
+        
+        input:
+            data: (pandas.DataFrame) Base a codificar
+            lookups: (dict) Lookups ya descargados con descargo_lookups(). Si es None uso los de la cache
+        output: 
+            data: (pandas.DataFrame) Base con columnas codificadas
+            valores_no_registrados: (dict) Valores de cada columna que no estan en el lookup
+    '''
+    
+    if lookups is None:
+        lookups = descargo_lookups()
+    
+    cols = {'dom_fiscal_provincia': ('cd_provincia_dom_fiscal', 'provincia'), 
+            'dom_legal_provincia': ('cd_provincia_dom_legal', 'provincia'),
+            'dom_fiscal_estado_domicilio': ('cd_estado_dom_fiscal', 'estado_domicilio'),
+            'dom_legal_estado_domicilio': ('cd_estado_dom_legal', 'estado_domicilio'),
+            'tipo_societario': ('cd_tipo_societario', 'tipo_societario')}
     
     valores_no_registrados = {}
-    cols = {'dom_fiscal_provincia': 'cd_provincia_dom_fiscal', 
-            'dom_legal_provincia': 'cd_provincia_dom_legal',
-            'dom_fiscal_estado_domicilio': 'cd_estado_dom_fiscal',
-            'dom_legal_estado_domicilio': 'cd_estado_dom_legal',
-            'tipo_societario': 'cd_tipo_societario'}
-    for col in cols.keys():
+    for col, (col_codigo, lookup) in cols.items():
         
-        valores_no_registrados[col] = list(data.query(f'{cols[col]} == -2 and {col}.notnull()', engine='python')[col].unique())
+        codigos, valores = pd.factorize(data[col])
         
-        # Reemplazo los valores de -2 por -1 para ser validos en la base de datos
-        data.loc[data[cols[col]] == -2, cols[col]] = -1
+        # Codigo de cada valor distinto, al final agrego el -1 para los nulos (codigo -1 de factorize)
+        codigos_valores = np.array([lookups[lookup].get(valor, -1) for valor in valores] + [-1])
+        
+        data[col_codigo] = codigos_valores[codigos]
+        valores_no_registrados[col] = [valor for valor in valores if valor not in lookups[lookup]]
     
     return data, valores_no_registrados
 
@@ -119,234 +403,1256 @@ def base_para_comprar(data):
         input:
             data: (pandas.DataFrame) Base a modificar
         output:
-            data: (pandas.DataFrame) Base a para comparar
+            data: (pandas.DataFrame) Base a para comparar, con los tipos de esquema_registro
     '''
     
-    data = data.copy()
-    
-    data.rename(columns= {'cuit': 'nu_cuit',
-                          'razon_social': 'nb_razon_social',
-                          'dom_fiscal_localidad': 'nb_localidad_dom_fiscal',
-                          'dom_fiscal_cp': 'cd_postal_dom_fiscal',
-                          'dom_fiscal_calle': 'nb_calle_dom_fiscal',
-                          'dom_fiscal_numero': 'nu_calle_dom_fiscal',
-                          'dom_fiscal_piso': 'tx_piso_dom_fiscal',
-                          'dom_fiscal_departamento': 'tx_depto_dom_fiscal',
-                          'dom_legal_localidad': 'nb_localidad_dom_legal',
-                          'dom_legal_cp': 'cd_postal_dom_legal',
-                          'dom_legal_calle': 'nb_calle_dom_legal',
-                          'dom_legal_numero': 'nu_calle_dom_legal',
-                          'dom_legal_piso': 'tx_piso_dom_legal',
-                          'dom_legal_departamento': 'tx_depto_dom_legal'},
-                inplace= True)
+    data = data.rename(columns= {'cuit': 'nu_cuit',
+                                 'razon_social': 'nb_razon_social',
+                                 'dom_fiscal_localidad': 'nb_localidad_dom_fiscal',
+                                 'dom_fiscal_cp': 'cd_postal_dom_fiscal',
+                                 'dom_fiscal_calle': 'nb_calle_dom_fiscal',
+                                 'dom_fiscal_numero': 'nu_calle_dom_fiscal',
+                                 'dom_fiscal_piso': 'tx_piso_dom_fiscal',
+                                 'dom_fiscal_departamento': 'tx_depto_dom_fiscal',
+                                 'dom_legal_localidad': 'nb_localidad_dom_legal',
+                                 'dom_legal_cp': 'cd_postal_dom_legal',
+                                 'dom_legal_calle': 'nb_calle_dom_legal',
+                                 'dom_legal_numero': 'nu_calle_dom_legal',
+                                 'dom_legal_piso': 'tx_piso_dom_legal',
+                                 'dom_legal_departamento': 'tx_depto_dom_legal'})
         
-    variables_finales = ['nu_cuit', 'nb_razon_social', 'cd_tipo_societario', 'fh_contrato_social', 'fh_actualizacion',
-                         'cd_provincia_dom_fiscal', 'nb_localidad_dom_fiscal', 'cd_postal_dom_fiscal',
-                         'nb_calle_dom_fiscal', 'nu_calle_dom_fiscal', 'tx_piso_dom_fiscal', 'tx_depto_dom_fiscal','cd_estado_dom_fiscal',
-                         'cd_provincia_dom_legal', 'nb_localidad_dom_legal', 'cd_postal_dom_legal',
-                         'nb_calle_dom_legal', 'nu_calle_dom_legal', 'tx_piso_dom_legal', 'tx_depto_dom_legal','cd_estado_dom_legal']
-    
-    data['fh_contrato_social'] = np.where(data['fh_contrato_social'].isnull(), None, data['fh_contrato_social'].astype('str'))
-    data['fh_actualizacion'] = np.where(data['fh_actualizacion'].isnull(), None, data['fh_actualizacion'].astype('str'))
-    data = data.where(pd.notnull, None)
 
-    return data[variables_finales]
+    # Las fechas y los nulos quedan con sus tipos, se pasan a valores de MySql recien al escribir
+    return aplico_esquema(data[variables_finales])
     
     
-def descargo_base_mysql():
+class base_por_lotes:
 
     '''
-        Descargo la base actualizada que tengo en MySql
-        
+        Base para comparar de un archivo procesado por lotes (proceso_archivo_por_lotes). Los registros de cada lote
+        quedan en disco (carpeta/lote_NNNNN.parquet, o .pkl sin pyarrow) y en memoria solo queda lo que hace falta
+        para separar los CUITs a insertar de los CUITs a updatear: por cada registro nu_cuit, nu_digest y su
+        posicion (nu_lote, nu_fila). Despues se leen del disco solo los registros a insertar o updatear.
+    '''
+
+    def __init__(self, file_period, carpeta= lotes_path):
+
+        '''
+            input:
+                file_period: (int) Periodo AAAAMM del archivo
+                carpeta: (str) Carpeta donde se crea la carpeta de los lotes (una por archivo procesado)
+        '''
+
+        os.makedirs(carpeta, exist_ok= True)
+        self.path = tempfile.mkdtemp(prefix= f'{file_period}_', dir= carpeta)
+        self.lotes = 0
+        self._estados = []
+        self.estado = pd.DataFrame({'nu_cuit': pd.Series([], dtype= 'int64'), 'nu_digest': pd.Series([], dtype= 'int64'),
+                                    'nu_lote': pd.Series([], dtype= 'int32'), 'nu_fila': pd.Series([], dtype= 'int32')})
+
+    @property
+    def shape(self):
+        return (self.estado.shape[0], len(variables_finales))
+
+    def _path_lote(self, nu_lote):
+        return os.path.join(self.path, f'lote_{nu_lote:05d}.' + ('parquet' if pq is not None else 'pkl'))
+
+    def agrego_lote(self, lote):
+
+        '''
+            Guardo en disco los registros de un lote (base_para_comprar) y me quedo con su digest
+
+            input:
+                lote: (pandas.DataFrame) Registros del lote con las variables_finales
+            output:
+        '''
+
+        lote = lote.reset_index(drop= True)
+
+        if pq is not None:
+            lote.to_parquet(self._path_lote(self.lotes), index= False)
+        else:
+            lote.to_pickle(self._path_lote(self.lotes))
+
+        self._estados.append(pd.DataFrame({'nu_cuit': lote['nu_cuit'].to_numpy(dtype= 'int64'),
+                                           'nu_digest': calculo_digest(lote).to_numpy(),
+                                           'nu_lote': np.full(lote.shape[0], self.lotes, dtype= 'int32'),
+                                           'nu_fila': np.arange(lote.shape[0], dtype= 'int32')}))
+        self.lotes += 1
+
+    def cierro(self):
+
+        '''
+            Junto el estado de todos los lotes, se llama una vez despues del ultimo agrego_lote
+        '''
+
+        if self._estados:
+            self.estado = pd.concat([self.estado] + self._estados, ignore_index= True)
+            self._estados = []
+
+    def _leo_lote(self, nu_lote):
+        if pq is not None:
+            return aplico_esquema(pd.read_parquet(self._path_lote(nu_lote)))
+        return pd.read_pickle(self._path_lote(nu_lote))
+
+    def recorro_lotes(self, posiciones= None):
+
+        '''
+            Recorro los lotes leyendo del disco solo los registros pedidos
+
+            input:
+                posiciones: (numpy.array) Posiciones de los registros en estado. Si es None todos
+            output:
+                lotes: (generator) Registros pedidos de cada lote (con los tipos de esquema_registro), en el orden del archivo
+        '''
+
+        estado = self.estado if posiciones is None else self.estado.iloc[np.sort(posiciones)]
+
+        for nu_lote, filas in estado.groupby('nu_lote', sort= True)['nu_fila']:
+            yield self._leo_lote(nu_lote).iloc[filas.to_numpy(),:].reset_index(drop= True)
+
+    def leo_filas(self, posiciones= None):
+
+        '''
+            Leo del disco los registros pedidos (ver recorro_lotes)
+
+            input:
+                posiciones: (numpy.array) Posiciones de los registros en estado. Si es None todos
+            output:
+                base: (pandas.DataFrame) Registros pedidos en el orden del archivo
+        '''
+
+        lotes = list(self.recorro_lotes(posiciones))
+
+        if not lotes:
+            return aplico_esquema(pd.DataFrame(columns= variables_finales))
+
+        return concateno_bases(lotes)
+
+    def borro(self):
+
+        '''
+            Borro los lotes del disco cuando ya no hacen falta
+        '''
+
+        shutil.rmtree(self.path, ignore_errors= True)
+
+
+def posiciones_unicas(cuits):
+
+    '''
+        Posiciones de un registro por CUIT, el ultimo del archivo (igual que bf.normalizo_periodo)
+
         input:
-            
+            cuits: (numpy.array) CUITs del archivo en orden
         output:
-            registro_sociedades_actual: (pandas.DataFrame) Base actual en MySql
+            posiciones: (numpy.array) Posiciones ordenadas del ultimo registro de cada CUIT
     '''
-    
-    mysql = make_mysql_connection('empresas')
 
-    variables = ['nu_cuit','nb_razon_social','cd_tipo_societario','fh_contrato_social',
-                 'fh_actualizacion','cd_provincia_dom_fiscal','nb_localidad_dom_fiscal',
-                 'cd_postal_dom_fiscal','nb_calle_dom_fiscal','nu_calle_dom_fiscal',
-                 'tx_piso_dom_fiscal','tx_depto_dom_fiscal','cd_estado_dom_fiscal',
-                 'cd_provincia_dom_legal','nb_localidad_dom_legal','cd_postal_dom_legal',
-                 'nb_calle_dom_legal','nu_calle_dom_legal','tx_piso_dom_legal',
-                 'tx_depto_dom_legal','cd_estado_dom_legal','fh_inicio_registro','fh_fin_registro']
-    
-    with mysql.cursor() as cur:
+    return np.flatnonzero(~pd.Series(cuits).duplicated(keep= 'last').to_numpy())
 
-        sql = 'select %s from registro_sociedades where fh_fin_registro = "2100-12-31"' % ','.join(variables)
 
-        cur.execute(sql)
+def proceso_archivo_por_lotes(file_path, file_period, memoria_maxima_mb= 512, carpeta_lotes= lotes_path):
 
-        registro_sociedades_actual = cur.fetchall()
+    '''
+        Proceso el archivo por lotes de registros para acotar la memoria usada. Cada lote pasa por
+        check_headers -> proceso_columnas -> filtro_registros_invalidos -> codifico_columnas -> base_para_comprar
+        y se guarda en disco (ver base_por_lotes). Entre lotes solo queda en memoria el nu_cuit y el nu_digest de
+        cada registro, que es lo unico que se necesita para separar los CUITs a insertar de los CUITs a updatear.
         
-    registro_sociedades_actual = pd.DataFrame(registro_sociedades_actual, columns= variables)
+        input:
+            file_path: (str) Path del .csv a procesar (puede ser 'archivo.zip/archivo.csv', ver uf.abro_archivo)
+            file_period: (int) Periodo AAAAMM del archivo
+            memoria_maxima_mb: (int) Memoria maxima aproximada a usar por lote en MB
+            carpeta_lotes: (str) Carpeta donde quedan los lotes en disco
+        output:
+            base_comparar: (base_por_lotes) Base para comparar con la actual en MySql. Hay que borrarla (borro)
+                           cuando ya se separaron los CUITs a insertar y updatear
+            resumen: (dict) Resumen del proceso para dejar en el log:
+                -> registros_iniciales, nulos, p_cuits_invalidos, registros_validos y valores_no_registrados
+                -> cuits_fechas_nulas: CUITs de cuits_con_fechas_nulas
+    '''
     
-    registro_sociedades_actual['fh_contrato_social'] = np.where(registro_sociedades_actual['fh_contrato_social'].isnull(), None, registro_sociedades_actual['fh_contrato_social'].astype('str'))
-    registro_sociedades_actual['fh_actualizacion'] = np.where(registro_sociedades_actual['fh_actualizacion'].isnull(), None, registro_sociedades_actual['fh_actualizacion'].astype('str'))
-    registro_sociedades_actual = registro_sociedades_actual.where(pd.notnull, None)
+    # Los lookups los busco una sola vez para todos los lotes
+    lookups = descargo_lookups()
     
-    mysql.close()
+    base_comparar = base_por_lotes(file_period, carpeta_lotes)
+    registros_iniciales = 0
+    nulos = None
+    cuits_invalidos = 0
+    cuits_fechas_nulas = []
+    valores_no_registrados = {}
     
-    return registro_sociedades_actual
-
-
-def base_final_para_actualizar(base_para_comparar, base_actual, cd_log, file_period):
+    archivo = uf.abro_archivo(file_path)
+    
+    try:
+        # Headers y tamaño de lote salen de espiar el mismo buffer que despues lee el parser
+        skip, headers = uf.check_headers(archivo)
+        registros_por_lote = uf.calculo_registros_por_lote(archivo, skip, headers, memoria_maxima_mb)
+        
+        lector = pd.read_csv(archivo, header= None, names= headers, skiprows= skip, dtype= tipos_lectura(headers), chunksize= registros_por_lote, encoding= 'utf-8-sig')
+        
+        for lote in lector:
+            
+            lote = lote.drop(columns= 'numero_inscripcion')
+            registros_iniciales += lote.shape[0]
+            
+            lote = proceso_columnas(lote, file_period)
+            
+            # Acumulo los nulos como cantidades para sacar el promedio al final
+            nulos_lote = uf.resumen_nas(lote) * lote.shape[0]
+            nulos = nulos_lote if nulos is None else nulos + nulos_lote
+            cuits_invalidos += (~lote['cuit_valido']).sum()
+            cuits_fechas_nulas.append(cuits_con_fechas_nulas(lote))
+            
+            lote = filtro_registros_invalidos(lote)
+            lote, no_registrados_lote = codifico_columnas(lote, lookups)
+            
+            for col, valores in no_registrados_lote.items():
+                valores_no_registrados.setdefault(col, [])
+                valores_no_registrados[col] += [valor for valor in valores if valor not in valores_no_registrados[col]]
+            
+            base_comparar.agrego_lote(base_para_comprar(lote))
+            del lote
+    except Exception:
+        base_comparar.borro()
+        raise
+    finally:
+        archivo.close()
+    
+    # Con el prefiltro de lineas el archivo puede no tener registros
+    base_comparar.cierro()
+    
+    resumen = {'registros_iniciales': registros_iniciales,
+               'nulos': (nulos / max(registros_iniciales, 1)).to_dict() if nulos is not None else {},
+               'p_cuits_invalidos': cuits_invalidos / max(registros_iniciales, 1),
+               'registros_validos': base_comparar.shape[0],
+               'valores_no_registrados': valores_no_registrados,
+               'cuits_fechas_nulas': np.concatenate(cuits_fechas_nulas) if cuits_fechas_nulas else np.array([], dtype= 'int64')}
+    
+    return base_comparar, resumen
+    
+    
+def preparo_periodo(file_path, file_period, lectura_por_lotes= True, memoria_maxima_mb= 512, prefiltro= None, paso_perfilado= None, tipo_perfil= 'cprofile'):
 
     '''
-        Comparo la base en MySql que descargue con la que tiene la novedad y saco 2 bases: 
-            1) Los CUITs que no tenia y por lo tanto voy a insertar
-            2) Los CUITs que cambiaron y por lo tanto voy a updatear
+        Preparo la base para comparar de un periodo: leo el archivo, proceso las columnas, filtro los registros
+        invalidos, codifico y armo la base para comparar. No escribe nada en MySql, asi que se puede correr
+        mientras se escribe el periodo anterior.
         
         input:
-            base_para_comparar: (pandas.DataFrame) Base con la novedad
-            base_actual: (pandas.DataFrame) Base actual en MySql
-            cd_log: (int) Codigo log del proceso que esta corriendo
-            file_period: (int) Periodo AAAAMM de .csv que esta corriendo
-            
+            file_path: (str) Path del .csv a procesar
+            file_period: (int) Periodo AAAAMM del archivo
+            lectura_por_lotes: (bool) Si es True uso proceso_archivo_por_lotes
+            memoria_maxima_mb: (int) Memoria maxima aproximada a usar por lote en MB
+            prefiltro: (prefiltro_functions.prefiltro_lineas) Si no es None solo proceso los registros nuevos o que
+                       cambiaron desde el periodo anterior
+            paso_perfilado: (str) Si no es None perfilo el primer paso que tenga este texto en el nombre (ver ins.pasos_medidos)
+            tipo_perfil: (str) 'cprofile' o 'muestreo'
         output:
-            base_insert: (pandas.DataFrame) Base que voy a insertar a la base actual en MySql
-            base_update: (pandas.DataFrame) Base que voy a updatear a la base actual en MySql
+            base_comparar: (pandas.DataFrame o base_por_lotes) Base para comparar con la actual en MySql. Con
+                           lectura_por_lotes queda en disco (ver base_por_lotes)
+            resumen: (dict) Resumen del proceso para dejar en el log (ver proceso_archivo_por_lotes), con
+                     'pasos': lista de (nombre del paso, registros procesados) para el log en MySql,
+                     'tiempos_pasos': mediciones de cada paso en este proceso (mismo orden que 'pasos', ver
+                     ins.medicion_paso) y 'prefiltro': resumen del prefiltro (si se uso)
     '''
     
-    base_para_comparar = base_para_comparar.copy()
-    base_actual = base_actual.copy()
+    pasos = ins.pasos_medidos(file_period, paso_perfilado, tipo_perfil)
+    resumen_prefiltro = None
     
-    base_para_comparar.set_index('nu_cuit', inplace=True)
-    base_actual.set_index('nu_cuit', inplace=True)
+    if lectura_por_lotes:
+        with pasos.mido('Inicio: Leo y proceso por lotes el archivo %s' % file_period):
+            if prefiltro is not None:
+                file_path, resumen_prefiltro = prefiltro.filtro(file_path, file_period, descargo_lookups())
+            base_comparar, resumen = proceso_archivo_por_lotes(file_path, file_period, memoria_maxima_mb)
+        resumen['pasos'] = [('Inicio: Leo y proceso por lotes el archivo %s' % file_period, base_comparar.shape[0])]
+        resumen['tiempos_pasos'] = pasos.mediciones
+        
+        return base_comparar, resumen_con_prefiltro(resumen, resumen_prefiltro, prefiltro, file_period)
     
-    # Me fijo CUITs que no tenia en la base y voy a insertar
-    base_insert = base_para_comparar.drop(base_actual.index, errors='ignore')
-
-    base_insert['fh_inicio_registro'] ='1900-01-01'
-    base_insert['fh_fin_registro'] ='2100-12-31'
-    base_insert['cd_log_proceso'] = cd_log
-    base_insert['cd_periodo_proceso'] = file_period
+    with pasos.mido('Inicio: Leo archivo %s' % file_period):
+        if prefiltro is not None:
+            file_path, resumen_prefiltro = prefiltro.filtro(file_path, file_period, descargo_lookups())
+        with uf.abro_archivo(file_path) as archivo:
+            skip, headers = uf.check_headers(archivo)
+            rns = pd.read_csv(archivo, header= None, names= headers, skiprows= skip, dtype= tipos_lectura(headers), encoding= 'utf-8-sig').drop(columns= 'numero_inscripcion')
+    registros = [('Inicio: Leo archivo %s' % file_period, rns.shape[0])]
     
-    # Distringo CUITs que ya tenia en la base y voy a updatear
-    cuits_actual = pd.merge(base_para_comparar, base_actual, how='inner', on='nu_cuit', suffixes=['_novedad','_vigente'])
-
-    cuits_novedad = cuits_actual.filter(regex='novedad')
-    cuits_vigente = cuits_actual.filter(regex='vigente')
-
-    registros_iguales = (cuits_novedad.to_numpy() == cuits_vigente.to_numpy()).all(axis=1)
-    base_update = cuits_actual.loc[~registros_iguales,:].filter(regex='novedad').rename(lambda x: x.replace('_novedad',''), axis=1)
+    with pasos.mido('Proceso Columnas'):
+        rns_p = proceso_columnas(rns, file_period)
+        del rns
+        
+        resumen = {'registros_iniciales': registros[0][1],
+                   'nulos': uf.resumen_nas(rns_p).to_dict(),
+                   'p_cuits_invalidos': (~rns_p['cuit_valido']).mean(),
+                   'cuits_fechas_nulas': cuits_con_fechas_nulas(rns_p)}
+    registros.append(('Proceso Columnas', rns_p.shape[0]))
     
-    file_next_date = pd.to_datetime(str(file_period*100+1)).strftime('%Y-%m-%d')
+    with pasos.mido('Filtro registros invalidos'):
+        rns_p = filtro_registros_invalidos(rns_p)
+    registros.append(('Filtro registros invalidos', rns_p.shape[0]))
     
-    base_update['fh_inicio_registro'] = file_next_date
-    base_update['fh_fin_registro'] ='2100-12-31'
-    base_update['cd_log_proceso'] = cd_log
-    base_update['cd_periodo_proceso'] = file_period
+    paso = 'Reemplazo texto por codigos en cols con provincias, tipos societarios y estados del domicilios'
+    with pasos.mido(paso):
+        rns_p, valores_no_registrados = codifico_columnas(rns_p)
+        base_comparar = base_para_comprar(rns_p)
+    registros.append((paso, rns_p.shape[0]))
+    
+    resumen.update({'registros_validos': rns_p.shape[0], 'valores_no_registrados': valores_no_registrados, 'pasos': registros, 'tiempos_pasos': pasos.mediciones})
+    
+    return base_comparar, resumen_con_prefiltro(resumen, resumen_prefiltro, prefiltro, file_period)
+
 
-    return base_insert.reset_index(),base_update.reset_index()
+# Prefiltro y perfilado del proceso que prepara los periodos (ver inicio_preparacion)
+_prefiltro_preparacion = None
+_perfilado_preparacion = {}
 
 
-def inserto_cuits(data, database):
+def inicio_preparacion(lookups, diccionario, prefiltro= None, paso_perfilado= None, tipo_perfil= 'cprofile'):
+
     '''
-        Inserto nuevos registros a la tabla "database.registro_sociedades"
+        Inicializo el proceso que prepara los periodos (preparo_periodo_en_proceso) con los lookups, el diccionario
+        de normalizacion y una copia del prefiltro del proceso principal, asi el proceso no se conecta a MySql.
+        Con un solo proceso los periodos se preparan en orden y el prefiltro de cada uno compara contra el estado
+        que dejo el anterior. Las llamadas a MySql de este proceso se cuentan en su propio ins.contador_bd y cada
+        paso se mide (y se perfila si corresponde) en este proceso.
         
         input:
-            data: (pandas.DataFrame) Base con CUITs a insertar
-        output:        
-           -1: (int) No hay registros para insertar
-            0: (int) No corrio el proceso
-            1: (int) Corrio bien el proceso
+            lookups: (dict) Lookups de descargo_lookups
+            diccionario: (dict) Diccionario de normalizacion (ver uf.diccionario_normalizacion)
+            prefiltro: (prefiltro_functions.prefiltro_lineas) Prefiltro del proceso principal, None si no se usa
+            paso_perfilado: (str) paso_perfilado del log del proceso principal (ver ins.log_instrumentado)
+            tipo_perfil: (str) 'cprofile' o 'muestreo'
+        output:
     '''
     
-    if data.shape[0] == 0:
-        return -1
-    try:
-        mysql = make_mysql_connection(database)
-
-        with mysql.cursor() as cur:
-
-            cols = data.columns.values.tolist()
-            n_cols = len(cols)
-            sql = 'insert into `registro_sociedades` (`{}`) values ({}%s)'.format('`,`'.join(cols), '%s,'*(n_cols-1))
-
-            n = data.shape[0]
-            i = 0
-            chunks = uf.get_chunks(n)
-            while chunks:
-                chunk = chunks.pop(0)
-                list_input = data.iloc[i:chunk,:].to_numpy().tolist()
+    global _prefiltro_preparacion
+    
+    _cache_lookups.clear()
+    _cache_lookups.update(lookups)
+    uf.diccionario_normalizacion.update(diccionario)
+    _prefiltro_preparacion = prefiltro
+    _perfilado_preparacion.update({'paso_perfilado': paso_perfilado, 'tipo_perfil': tipo_perfil})
+    ins.instrumento_conexiones(sys.modules[__name__])
 
-                cur.executemany(sql, list_input)
-                mysql.commit()    
 
-                i = chunk
-                
-        mysql.close()
-        return 1
-    except:
-        if mysql.open:
-            mysql.close()
-        return 0
-    
+def preparo_periodo_en_proceso(file_path, file_period, lectura_por_lotes= True, memoria_maxima_mb= 512):
 
-def update_cuits(base_update):
     '''
-        Inserto nuevos registros a la tabla "step.registro_sociedades", cambio la fh_fin_registro de los CUITs
-        que estoy updateando como un dia antes a la fh_inicio_registro de los CUITs que subi anteriomente.
-        Finalmente, inserto los CUITs de "step.registro_sociedades" en la tabla final.
+        preparo_periodo en el proceso de preparacion (ver inicio_preparacion). Lo que la preparacion agrega al
+        proceso vuelve en el resumen para sumarlo al proceso principal con agrego_preparacion.
         
         input:
-            base_update: (pandas.DataFrame) Base con CUITs para updatear
+            file_path: (str) Path del .csv a procesar
+            file_period: (int) Periodo AAAAMM del archivo
+            lectura_por_lotes: (bool) Si es True uso proceso_archivo_por_lotes
+            memoria_maxima_mb: (int) Memoria maxima aproximada a usar por lote en MB
         output:
-           -1: (int) No hay registros para actualizar
-            0: (int) No corrio el proceso
-            1: (int) Corrio bien el proceso
+            base_comparar: (pandas.DataFrame o base_por_lotes) Base para comparar (ver preparo_periodo)
+            resumen: (dict) Resumen de preparo_periodo con 'diccionario_nuevo': valores normalizados en este periodo
+                     y 'estado_prefiltro': estado del prefiltro del periodo (si se uso)
     '''
     
-    try:
+    valores_previos = len(uf.diccionario_normalizacion)
+    
+    base_comparar, resumen = preparo_periodo(file_path, file_period, lectura_por_lotes, memoria_maxima_mb, _prefiltro_preparacion, **_perfilado_preparacion)
+    
+    # El diccionario solo crece, los valores nuevos quedan al final
+    resumen['diccionario_nuevo'] = dict(itertools.islice(uf.diccionario_normalizacion.items(), valores_previos, None))
+    
+    if _prefiltro_preparacion is not None:
+        resumen['estado_prefiltro'] = _prefiltro_preparacion.estado(file_period)
+        _prefiltro_preparacion.descarto_anteriores(file_period)
+    
+    return base_comparar, resumen
+
+
+def agrego_preparacion(resumen, file_period, prefiltro= None):
+
+    '''
+        Sumo al proceso principal lo que agrego la preparacion de un periodo en otro proceso: los valores nuevos del
+        diccionario de normalizacion y el estado del prefiltro, que se guarda con prefiltro.confirmo
         
-        mysql = make_mysql_connection('empresas')
+        input:
+            resumen: (dict) Resumen de preparo_periodo_en_proceso, se sacan 'diccionario_nuevo' y 'estado_prefiltro'
+            file_period: (int) Periodo AAAAMM preparado
+            prefiltro: (prefiltro_functions.prefiltro_lineas) Prefiltro del proceso principal, None si no se usa
+        output:
+    '''
+    
+    uf.diccionario_normalizacion.update(resumen.pop('diccionario_nuevo', {}))
+    
+    estado = resumen.pop('estado_prefiltro', None)
+    if prefiltro is not None and estado is not None:
+        prefiltro.agrego_estado(file_period, estado)
+
+
+def descarto_preparacion(preparacion):
+
+    '''
+        Cancelo la preparacion (preparo_periodo) de un periodo que no se va a cargar. Si ya estaba corriendo, cuando
+        termine borro sus lotes del disco (ver base_por_lotes)
+        
+        input:
+            preparacion: (concurrent.futures.Future) Preparacion pendiente
+        output:
+    '''
+    
+    def borro_lotes(preparacion):
+        if not preparacion.cancelled() and preparacion.exception() is None and isinstance(preparacion.result()[0], base_por_lotes):
+            preparacion.result()[0].borro()
+    
+    if not preparacion.cancel():
+        preparacion.add_done_callback(borro_lotes)
+
+
+def resumen_con_prefiltro(resumen, resumen_prefiltro, prefiltro, file_period):
+
+    '''
+        Marco en el estado del prefiltro los CUITs con fechas nulas (tienen que pasar siempre) y agrego al resumen
+        el resumen del prefiltro
+        
+        input:
+            resumen: (dict) Resumen de preparo_periodo con 'cuits_fechas_nulas'
+            resumen_prefiltro: (dict) Resumen de prefiltro.filtro (None si no se uso)
+            prefiltro: (prefiltro_functions.prefiltro_lineas) Prefiltro usado (None si no se uso)
+            file_period: (int) Periodo AAAAMM del archivo
+        output:
+            resumen: (dict) Resumen sin 'cuits_fechas_nulas' y con 'prefiltro'
+    '''
+    
+    cuits_fechas_nulas = resumen.pop('cuits_fechas_nulas')
+    
+    if prefiltro is not None:
+        prefiltro.marco_cambiantes(file_period, cuits_fechas_nulas)
+        resumen['prefiltro'] = resumen_prefiltro
+    
+    return resumen
 
-        # Trunco tabla de step
-        with mysql.cursor() as cur:  
+
+def descargo_base_mysql(cuits= None):
+
+    '''
+        Descargo la base actualizada que tengo en MySql
+        
+        input:
+            cuits: (list) Si no es None, descargo solo los registros vigentes de estos CUITs
+        output:
+            registro_sociedades_actual: (pandas.DataFrame) Base actual en MySql, con los tipos de esquema_registro
+    '''
+    
+    mysql = make_mysql_connection('empresas')
+
+    variables = ['nu_cuit','nb_razon_social','cd_tipo_societario','fh_contrato_social',
+                 'fh_actualizacion','cd_provincia_dom_fiscal','nb_localidad_dom_fiscal',
+                 'cd_postal_dom_fiscal','nb_calle_dom_fiscal','nu_calle_dom_fiscal',
+                 'tx_piso_dom_fiscal','tx_depto_dom_fiscal','cd_estado_dom_fiscal',
+                 'cd_provincia_dom_legal','nb_localidad_dom_legal','cd_postal_dom_legal',
+                 'nb_calle_dom_legal','nu_calle_dom_legal','tx_piso_dom_legal',
+                 'tx_depto_dom_legal','cd_estado_dom_legal','fh_inicio_registro','fh_fin_registro']
+    
+    with mysql.cursor() as cur:
+
+        sql = "select %s from registro_sociedades where fh_fin_registro = '2100-12-31'" % ','.join(variables)
+
+        if cuits is None:
+            cur.execute(sql)
+
+            registro_sociedades_actual = cur.fetchall()
+        else:
+            # Descargo por chunks para no armar un "in" gigante
+            cuits = list(cuits)
+            registro_sociedades_actual = []
+            i = 0
+            for chunk in uf.get_chunks(len(cuits)):
+                cur.execute(sql + ' and nu_cuit in (%s)' % ','.join(['%s']*(chunk-i)), cuits[i:chunk])
+                registro_sociedades_actual += list(cur.fetchall())
+                i = chunk
+        
+    registro_sociedades_actual = aplico_esquema(pd.DataFrame(registro_sociedades_actual, columns= variables))
+    
+    mysql.close()
+    
+    return registro_sociedades_actual
+
+
+def descargo_ultimo_periodo_mysql():
+
+    '''
+        Busco el ultimo periodo cargado en MySql
+        
+        input:
+        output:
+            periodo: (int) Maximo cd_periodo_proceso de registro_sociedades (None si la tabla esta vacia)
+    '''
+    
+    mysql = make_mysql_connection('empresas')
+    
+    with mysql.cursor() as cur:
+        cur.execute('select max(cd_periodo_proceso) from registro_sociedades')
+        periodo = cur.fetchone()[0]
+    
+    mysql.close()
+    
+    return None if periodo is None else int(periodo)
+
+
+def calculo_digest(data):
+
+    '''
+        Calculo un digest de 64 bits del contenido de cada registro (variables_finales). Antes de hashear paso
+        cada columna a una forma canonica en string (enteros sin decimales, fechas AAAA-MM-DD, nulos con un
+        valor reservado) para que el digest no dependa de los tipos con los que venga la base.
+        Se usa el mismo calculo para la novedad y para lo que se guarda en MySql, por lo que dos registros
+        con el mismo contenido tienen el mismo digest.
+        
+        input:
+            data: (pandas.DataFrame) Base con las variables_finales
+        output:
+            digest: (pandas.Series) Digest int64 de cada registro
+    '''
+    
+    canonica = pd.DataFrame(index= data.index)
+    
+    for col in variables_finales:
+        if col[:3] == 'fh_':
+            canonica[col] = pd.to_datetime(data[col], errors= 'coerce').dt.strftime('%Y-%m-%d')
+        elif col[:3] in ('cd_', 'nu_'):
+            canonica[col] = pd.to_numeric(data[col], errors= 'coerce').astype('Int64').astype('string')
+        else:
+            canonica[col] = data[col].astype('string')
+    
+    canonica = canonica.astype('object').where(canonica.notnull(), '\\N')
+    
+    digest = pd.util.hash_pandas_object(canonica, index= False)
+    
+    # MySql no tiene uint64 comodo para comparar, lo guardo como bigint con signo
+    return pd.Series(digest.to_numpy().view('int64'), index= data.index)
+
+
+def agrego_columna_digest():
+
+    '''
+        Agrego la columna nu_digest (bigint) a empresas.registro_sociedades y a step.registro_sociedades
+        si todavia no existe. Se agrega al final de la tabla en ambas para que las dos tablas sigan teniendo
+        las mismas columnas en el mismo orden.
+        
+        input:
+        output:
+    '''
+    
+    # Las tablas de los backends embebidos ya se crean con nu_digest
+    if bk.es_embebido():
+        return
+    
+    mysql = make_mysql_connection('empresas')
+    
+    with mysql.cursor() as cur:
+        for database in ['empresas', 'step']:
             sql = '''
-                    truncate table step.registro_sociedades
+                    select count(*) from information_schema.columns
+                    where table_schema = %s and table_name = "registro_sociedades" and column_name = "nu_digest"
                   '''
-            cur.execute(sql)
+            cur.execute(sql, [database])
+            
+            if cur.fetchone()[0] == 0:
+                cur.execute(f'alter table {database}.registro_sociedades add column nu_digest bigint null')
+                mysql.commit()
+    
+    mysql.close()
+
+
+def completo_digest_mysql(cuits):
+
+    '''
+        Calculo y guardo el digest de los registros vigentes que todavia no lo tienen (por ejemplo los
+        cargados antes de agregar la columna nu_digest)
+        
+        input:
+            cuits: (list) CUITs vigentes sin digest
+        output:
+            digest: (pandas.DataFrame) nu_cuit y nu_digest calculados
+    '''
+    
+    base = descargo_base_mysql(cuits)
+    
+    digest = pd.DataFrame({'nu_cuit': base['nu_cuit'], 'nu_digest': calculo_digest(base)})
+    
+    mysql = make_mysql_connection('empresas')
+    
+    with mysql.cursor() as cur:
+        
+        sql = "update registro_sociedades set nu_digest = %s where nu_cuit = %s and fh_fin_registro = '2100-12-31'"
+        
+        i = 0
+        for chunk in uf.get_chunks(digest.shape[0]):
+            cur.executemany(sql, digest.iloc[i:chunk,:][['nu_digest','nu_cuit']].to_numpy().tolist())
             mysql.commit()
+            i = chunk
+    
+    mysql.close()
+    
+    return digest
+
+
+def descargo_digest_mysql():
+
+    '''
+        Descargo solo los pares (nu_cuit, nu_digest) de la base vigente en MySql. Si hay registros
+        sin digest se los calculo y los guardo antes de devolverlos.
+        
+        input:
+        output:
+            digest_actual: (pandas.DataFrame) nu_cuit y nu_digest de la base actual en MySql
+    '''
+    
+    mysql = make_mysql_connection('empresas')
+    
+    with mysql.cursor() as cur:
+        
+        cur.execute("select nu_cuit, nu_digest from registro_sociedades where fh_fin_registro = '2100-12-31'")
+        
+        digest_actual = pd.DataFrame(cur.fetchall(), columns= ['nu_cuit', 'nu_digest'])
+        
+    mysql.close()
+    
+    sin_digest = digest_actual['nu_digest'].isnull()
+    
+    if sin_digest.any():
+        digest_nuevo = completo_digest_mysql(digest_actual.loc[sin_digest, 'nu_cuit'].tolist())
+        digest_actual = pd.concat([digest_actual.loc[~sin_digest,:], digest_nuevo], ignore_index= True)
+    
+    digest_actual['nu_cuit'] = digest_actual['nu_cuit'].astype('int64')
+    digest_actual['nu_digest'] = digest_actual['nu_digest'].astype('int64')
+    
+    return digest_actual
+
+
+def base_final_para_actualizar(base_para_comparar, base_actual, cd_log, file_period):
+
+    '''
+        Comparo la base en MySql que descargue con la que tiene la novedad y saco 2 bases: 
+            1) Los CUITs que no tenia y por lo tanto voy a insertar
+            2) Los CUITs que cambiaron y por lo tanto voy a updatear
+        Si la novedad esta por lotes en disco (base_por_lotes) comparo un lote por vez, con un registro por CUIT.
+        
+        input:
+            base_para_comparar: (pandas.DataFrame o base_por_lotes) Base con la novedad
+            base_actual: (pandas.DataFrame) Base actual en MySql
+            cd_log: (int) Codigo log del proceso que esta corriendo
+            file_period: (int) Periodo AAAAMM de .csv que esta corriendo
             
-        # Iserto registro en step
-        resultado = inserto_cuits(base_update, 'step')
-        if resultado == -1:
-            return -1
-        elif resultado == 0:
-            raise ValueError(f'No se pudieron isertar los registros en la base step')
+        output:
+            base_insert: (pandas.DataFrame) Base que voy a insertar a la base actual en MySql
+            base_update: (pandas.DataFrame) Base que voy a updatear a la base actual en MySql
+    '''
+    
+    # set_index devuelve una base nueva, no hace falta copiarla antes
+    base_actual = base_actual.set_index('nu_cuit')
+    
+    if not isinstance(base_para_comparar, base_por_lotes):
+        return _separo_cuits(base_para_comparar, base_actual, cd_log, file_period)
+    
+    bases = [_separo_cuits(lote, base_actual, cd_log, file_period)
+             for lote in base_para_comparar.recorro_lotes(posiciones_unicas(base_para_comparar.estado['nu_cuit'].to_numpy()))]
+    
+    if not bases:
+        return _separo_cuits(base_para_comparar.leo_filas(), base_actual, cd_log, file_period)
+    
+    return (aplico_esquema(concateno_bases([base_insert for base_insert, _ in bases])),
+            aplico_esquema(concateno_bases([base_update for _, base_update in bases])))
 
-        with mysql.cursor() as cur:
 
-            sql = '''
-                    update
-                        empresas.registro_sociedades as a,
-                        step.registro_sociedades as b
-                    set
-                        a.fh_fin_registro = date_sub(b.fh_inicio_registro, interval 1 day)
-                    where
-                        a.nu_cuit = b.nu_cuit and
-                        a.fh_fin_registro = "2100-12-31"
-            '''
-            cur.execute(sql)
+def _separo_cuits(base_para_comparar, base_actual, cd_log, file_period):
+
+    '''
+        Separo los CUITs a insertar y updatear de base_final_para_actualizar, con base_actual indexada por nu_cuit
+    '''
+    
+    base_para_comparar = base_para_comparar.set_index('nu_cuit')
+    
+    # Me fijo CUITs que no tenia en la base y voy a insertar
+    base_insert = base_para_comparar.drop(base_actual.index, errors='ignore')
+
+    base_insert['fh_inicio_registro'] = pd.Timestamp('1900-01-01')
+    base_insert['fh_fin_registro'] = pd.Timestamp('2100-12-31')
+    base_insert['cd_log_proceso'] = cd_log
+    base_insert['cd_periodo_proceso'] = file_period
+    
+    # Distringo CUITs que ya tenia en la base y voy a updatear
+    cuits_actual = pd.merge(base_para_comparar, base_actual, how='inner', on='nu_cuit', suffixes=['_novedad','_vigente'])
+
+    cuits_novedad = cuits_actual.filter(regex='novedad')
+    cuits_vigente = cuits_actual.filter(regex='vigente')
+
+    iguales = registros_iguales(cuits_novedad, cuits_vigente)
+    base_update = cuits_actual.loc[~iguales,:].filter(regex='novedad').rename(lambda x: x.replace('_novedad',''), axis=1)
+    
+    file_next_date = pd.to_datetime(str(file_period*100+1))
+    
+    base_update['fh_inicio_registro'] = file_next_date
+    base_update['fh_fin_registro'] = pd.Timestamp('2100-12-31')
+    base_update['cd_log_proceso'] = cd_log
+    base_update['cd_periodo_proceso'] = file_period
+    
+    base_insert = base_insert.reset_index()
+    base_update = base_update.reset_index()
+    
+    base_insert['nu_digest'] = calculo_digest(base_insert)
+    base_update['nu_digest'] = calculo_digest(base_update)
+
+    return base_insert,base_update
+
+
+def base_final_para_actualizar_digest(base_para_comparar, digest_actual, cd_log, file_period):
+
+    '''
+        Igual que base_final_para_actualizar pero comparo solo el digest de cada registro contra los
+        digests de la base vigente en MySql (ver descargo_digest_mysql). Comparo un registro por CUIT, el ultimo
+        del archivo. Si la novedad esta por lotes en disco (base_por_lotes) solo se leen los registros a insertar
+        y updatear.
+        
+        input:
+            base_para_comparar: (pandas.DataFrame o base_por_lotes) Base con la novedad
+            digest_actual: (pandas.DataFrame) nu_cuit y nu_digest de la base actual en MySql
+            cd_log: (int) Codigo log del proceso que esta corriendo
+            file_period: (int) Periodo AAAAMM de .csv que esta corriendo
+            
+        output:
+            base_insert: (pandas.DataFrame) Base que voy a insertar a la base actual en MySql
+            base_update: (pandas.DataFrame) Base que voy a updatear a la base actual en MySql
+    '''
+    
+    if isinstance(base_para_comparar, base_por_lotes):
+        # Los digests ya estan calculados por lote
+        estado = base_para_comparar.estado
+        estado = estado.iloc[posiciones_unicas(estado['nu_cuit'].to_numpy()),:]
+        leo_filas = base_para_comparar.leo_filas
+    else:
+        base = base_para_comparar.reset_index(drop= True)
+        estado = pd.DataFrame({'nu_cuit': base['nu_cuit'].to_numpy(dtype= 'int64'), 'nu_digest': calculo_digest(base).to_numpy()})
+        estado = estado.iloc[posiciones_unicas(estado['nu_cuit'].to_numpy()),:]
+        leo_filas = lambda posiciones: base.iloc[posiciones,:].reset_index(drop= True)
+    
+    # Join de enteros: CUIT -> digest vigente. Si un CUIT quedo con dos registros vigentes (un archivo viejo con el
+    # CUIT repetido) comparo contra el ultimo; el update cierra los dos
+    digest_actual = digest_actual.drop_duplicates('nu_cuit', keep= 'last')
+    digest_vigente = pd.Series(digest_actual['nu_digest'].to_numpy(), index= digest_actual['nu_cuit'].to_numpy())
+    digest_vigente = digest_vigente.reindex(estado['nu_cuit'].to_numpy())
+    
+    cuit_nuevo = digest_vigente.isnull().to_numpy()
+    registro_cambiado = ~cuit_nuevo & (digest_vigente.to_numpy() != estado['nu_digest'].to_numpy())
+    
+    columnas = variables_finales + ['fh_inicio_registro', 'fh_fin_registro', 'cd_log_proceso', 'cd_periodo_proceso', 'nu_digest']
+    
+    # Solo leo los registros a insertar y updatear (las posiciones de estado estan ordenadas, como los registros leidos)
+    posiciones = estado.index.to_numpy()
+    
+    base_insert = leo_filas(posiciones[cuit_nuevo])
+    base_insert['nu_digest'] = estado['nu_digest'].to_numpy()[cuit_nuevo]
+    base_insert['fh_inicio_registro'] = pd.Timestamp('1900-01-01')
+    base_insert['fh_fin_registro'] = pd.Timestamp('2100-12-31')
+    base_insert['cd_log_proceso'] = cd_log
+    base_insert['cd_periodo_proceso'] = file_period
+    
+    file_next_date = pd.to_datetime(str(file_period*100+1))
+    
+    base_update = leo_filas(posiciones[registro_cambiado])
+    base_update['nu_digest'] = estado['nu_digest'].to_numpy()[registro_cambiado]
+    base_update['fh_inicio_registro'] = file_next_date
+    base_update['fh_fin_registro'] = pd.Timestamp('2100-12-31')
+    base_update['cd_log_proceso'] = cd_log
+    base_update['cd_periodo_proceso'] = file_period
+    
+    return base_insert[columnas].reset_index(drop= True),base_update[columnas].reset_index(drop= True)
+
+
+def base_final_para_actualizar_sql(base_para_comparar, cd_log, file_period):
+
+    '''
+        Igual que base_final_para_actualizar pero la comparacion la hace MySql: subo la novedad con LOAD DATA a la
+        tabla step.novedad_registro_sociedades y separo con SQL los CUITs nuevos y los que cambiaron contra la base
+        vigente en empresas.registro_sociedades. Solo vuelven por la red los registros a insertar y a updatear.
+        Los registros se comparan por nu_digest: la collation de la tabla no distingue tildes ni mayusculas y el
+        digest si (igual que la comparacion en pandas). Al terminar se vacia la tabla de la novedad.
+        
+        input:
+            base_para_comparar: (pandas.DataFrame o base_por_lotes) Base con la novedad
+            cd_log: (int) Codigo log del proceso que esta corriendo
+            file_period: (int) Periodo AAAAMM de .csv que esta corriendo
+            
+        output:
+            base_insert: (pandas.DataFrame) Base que voy a insertar a la base actual en MySql
+            base_update: (pandas.DataFrame) Base que voy a updatear a la base actual en MySql
+    '''
+    
+    columnas = variables_finales + ['fh_inicio_registro', 'fh_fin_registro', 'cd_log_proceso', 'cd_periodo_proceso', 'nu_digest']
+    
+    # Subo un registro por CUIT (el ultimo del archivo). Si la novedad esta por lotes en disco subo un lote por vez
+    if isinstance(base_para_comparar, base_por_lotes):
+        lotes = base_para_comparar.recorro_lotes(posiciones_unicas(base_para_comparar.estado['nu_cuit'].to_numpy()))
+    else:
+        lotes = [base_para_comparar.iloc[posiciones_unicas(base_para_comparar['nu_cuit'].to_numpy()),:]]
+    
+    mysql = make_mysql_connection('step')
+    
+    try:
+        # Los registros vigentes cargados antes de agregar nu_digest no lo tienen, se los completo antes de comparar
+        with mysql.cursor() as cur:
+            cur.execute("select nu_cuit from empresas.registro_sociedades where fh_fin_registro = '2100-12-31' and nu_digest is null")
+            sin_digest = [fila[0] for fila in cur.fetchall()]
+        
+        if sin_digest:
+            completo_digest_mysql(sin_digest)
+        
+        with mysql.cursor() as cur:
+            cur.execute('create table if not exists step.novedad_registro_sociedades like step.registro_sociedades')
+            cur.execute('truncate table step.novedad_registro_sociedades')
             mysql.commit()
+        
+        for lote in lotes:
+            novedad = lote.reset_index(drop= True)
+            novedad['fh_inicio_registro'] = pd.Timestamp('1900-01-01')
+            novedad['fh_fin_registro'] = pd.Timestamp('2100-12-31')
+            novedad['cd_log_proceso'] = cd_log
+            novedad['cd_periodo_proceso'] = file_period
+            novedad['nu_digest'] = calculo_digest(novedad)
             
-            sql = '''
-                    insert into empresas.registro_sociedades
-                        select * from step.registro_sociedades
-            '''
+            resultado = inserto_cuits(novedad[columnas], 'step', 'novedad_registro_sociedades', metodo= 'load_data')
+            if resultado == 0:
+                raise ValueError('No se pudo subir la novedad a step.novedad_registro_sociedades')
+            del novedad
+        
+        select = ','.join([f'n.{col}' for col in columnas])
+        
+        with mysql.cursor() as cur:
+            
+            sql = f'''
+                    select {select}
+                    from step.novedad_registro_sociedades as n
+                        left join empresas.registro_sociedades as v
+                            on v.nu_cuit = n.nu_cuit and v.fh_fin_registro = '2100-12-31'
+                    where v.nu_cuit is null
+                  '''
             cur.execute(sql)
+            base_insert = pd.DataFrame(cur.fetchall(), columns= columnas)
+            
+            # <=> es la igualdad de MySql que toma NULL = NULL como verdadero
+            sql = f'''
+                    select {select}
+                    from step.novedad_registro_sociedades as n
+                        inner join empresas.registro_sociedades as v
+                            on v.nu_cuit = n.nu_cuit and v.fh_fin_registro = '2100-12-31'
+                    where not (n.nu_digest <=> v.nu_digest)
+                  '''
+            cur.execute(sql)
+            base_update = pd.DataFrame(cur.fetchall(), columns= columnas)
+    
+    finally:
+        # La novedad no queda en step (si falla el truncate se vacia al principio de la proxima corrida)
+        try:
+            with mysql.cursor() as cur:
+                cur.execute('truncate table step.novedad_registro_sociedades')
             mysql.commit()
+        except Exception:
+            pass
+        mysql.close()
+    
+    # Un CUIT con dos registros vigentes vuelve una vez por cada uno
+    base_update = base_update.drop_duplicates('nu_cuit', keep= 'last')
+    
+    file_next_date = pd.to_datetime(str(file_period*100+1))
+    base_update['fh_inicio_registro'] = file_next_date
+    
+    return aplico_esquema(base_insert),aplico_esquema(base_update.reset_index(drop= True))
+
+
+def valores_para_mysql(data):
+    '''
+        Paso la base a una lista de listas para cur.executemany, con None en los nulos y las fechas como AAAA-MM-DD.
+        Es el unico lugar donde los tipos de esquema_registro se pasan a valores de MySql.
+        
+        input:
+            data: (pandas.DataFrame) Base a subir
+        output:
+            list_input: (list) Registros de la base
+    '''
+    
+    data = data.copy(deep= False)
+    for col in data.columns:
+        if pd.api.types.is_datetime64_any_dtype(data[col]):
+            data[col] = data[col].dt.strftime('%Y-%m-%d')
+    
+    return data.astype('object').where(data.notnull(), None).to_numpy().tolist()
+
+
+def serializo_tsv(data):
+    '''
+        Serializo la base en memoria como TSV para LOAD DATA: los nulos van como \\N (igual que los None
+        de valores_para_mysql), los enteros guardados como float van sin decimales y escapo \\, tabs y
+        saltos de linea en los strings.
+        
+        input:
+            data: (pandas.DataFrame) Base a serializar
+        output:
+            buffer: (io.BytesIO) TSV en utf-8
+    '''
+    
+    columnas = []
+    for col in data.columns:
+        valores = data[col]
+        nulos = valores.isnull()
+        
+        if valores.dtype == 'object' and pd.api.types.infer_dtype(valores, skipna= True) in ('integer', 'floating', 'mixed-integer-float'):
+            valores = pd.to_numeric(valores)
+        
+        if pd.api.types.is_float_dtype(valores) and (valores[~nulos] % 1 == 0).all():
+            valores = valores.astype('Int64').astype('str')
+        elif pd.api.types.is_datetime64_any_dtype(valores):
+            valores = valores.dt.strftime('%Y-%m-%d')
+        else:
+            valores = valores.astype('str')
+            if not pd.api.types.is_numeric_dtype(data[col]):
+                valores = (valores.str.replace('\\', '\\\\', regex= False)
+                                  .str.replace('\t', '\\t', regex= False)
+                                  .str.replace('\n', '\\n', regex= False)
+                                  .str.replace('\r', '\\r', regex= False))
+        
+        columnas.append(valores.where(~nulos, '\\N'))
+    
+    lineas = columnas[0].str.cat(columnas[1:], sep= '\t')
+    
+    return io.BytesIO(('\n'.join(lineas) + '\n').encode('utf-8'))
+
+
+def inserto_load_data(data, database, tabla= 'registro_sociedades', registros_por_carga= 200e3, hechos= None, al_commitear= None, stats= None):
+    '''
+        Inserto la base con LOAD DATA LOCAL INFILE. Cada carga de registros_por_carga registros se serializa
+        en memoria con serializo_tsv y se commitea por separado. pymysql solo lee LOCAL INFILE desde un path,
+        asi que el buffer se vuelca de una a un archivo temporal que se borra despues de la carga.
+        La conexion y el servidor tienen que tener habilitado local_infile.
+        Con LOCAL, MySql pasa los errores de datos a warnings y saltea o trunca los registros con problemas: si
+        la carga no inserto todos los registros o dejo warnings hago rollback de esa carga y no sigo.
+        
+        input:
+            data: (pandas.DataFrame) Base con CUITs a insertar
+            database: (str) Base de MySql donde inserto
+            tabla: (str) Tabla donde inserto
+            registros_por_carga: (int) Registros por cada LOAD DATA
+            hechos: (list) Rangos (desde, hasta) de registros ya commiteados que salteo (ver uf.get_rangos)
+            al_commitear: (function) Si no es None la llamo con (desde, hasta) despues de commitear cada carga
+            stats: (dict) Si no es None y falla una carga le dejo el error en 'error_load_data'
+        output:
+            registros_commiteados: (int) Registros que quedaron commiteados. Si es menor a los pendientes fallo una carga
+    '''
+    
+    registros_commiteados = 0
+    mysql = None
+    
+    try:
+        mysql = make_mysql_connection(database)
+        
+        cols = data.columns.values.tolist()
+        sql = '''
+                load data local infile %s into table `{}` character set utf8mb4
+                fields terminated by '\\t' escaped by '\\\\' lines terminated by '\\n' (`{}`)
+              '''.format(tabla, '`,`'.join(cols))
+        
+        for desde, hasta in uf.get_rangos(data.shape[0], registros_por_carga, hechos):
+            buffer = serializo_tsv(data.iloc[desde:hasta,:])
+            
+            with tempfile.NamedTemporaryFile(suffix= '.tsv', delete= False) as f:
+                f.write(buffer.getbuffer())
+            
+            try:
+                with mysql.cursor() as cur:
+                    cur.execute(sql, [f.name])
+                    registros = cur.rowcount
+                    cur.execute('show warnings')
+                    avisos = cur.fetchall()
+                
+                if registros != hasta - desde or avisos:
+                    mysql.rollback()
+                    raise ValueError(f'LOAD DATA inserto {registros} de {hasta - desde} registros ({desde}-{hasta}), warnings: {list(avisos)[:5]}')
+                
+                mysql.commit()
+            finally:
+                os.remove(f.name)
             
+            registros_commiteados += hasta - desde
+            if al_commitear is not None:
+                al_commitear(desde, hasta)
+        
         mysql.close()
+    except Exception as e:
+        if stats is not None:
+            stats['error_load_data'] = '%s: %s' % (type(e).__name__, e)
+        if mysql is not None and mysql.open:
+            mysql.close()
+    
+    return registros_commiteados
+
+
+def inserto_cuits_paralelo(data, database, tabla= 'registro_sociedades', n_conexiones= 4, reintentos= 3, stats= None, hechos= None, al_commitear= None):
+    '''
+        Inserto la base repartiendo los chunks de uf.get_chunks entre n_conexiones conexiones a MySql, cada
+        una en su propio thread. Cada chunk se commitea por separado y si falla se hace rollback y se reintenta
+        con una conexion nueva. Al final controlo que la cantidad de registros commiteados sea data.shape[0].
+        
+        input:
+            data: (pandas.DataFrame) Base con CUITs a insertar
+            database: (str) Base de MySql donde inserto
+            tabla: (str) Tabla donde inserto
+            n_conexiones: (int) Cantidad de conexiones (y threads) en paralelo
+            reintentos: (int) Reintentos por chunk antes de dar el proceso por fallado
+            stats: (dict) Si no es None le dejo metodo, registros, segundos y registros_por_segundo de la carga
+            hechos: (list) Rangos (desde, hasta) de registros ya commiteados que salteo (ver uf.get_rangos)
+            al_commitear: (function) Si no es None la llamo con (desde, hasta) despues de commitear cada chunk (desde cada thread)
+        output:
+           -1: (int) No hay registros para insertar
+            0: (int) No corrio el proceso o no coinciden los registros commiteados
+            1: (int) Corrio bien el proceso
+    '''
+    
+    if data.shape[0] == 0:
+        return -1
+    
+    inicio = time.time()
+    
+    cols = data.columns.values.tolist()
+    sql = 'insert into `{}` (`{}`) values ({}%s)'.format(tabla, '`,`'.join(cols), '%s,'*(len(cols)-1))
+    
+    rangos = uf.get_rangos(data.shape[0], hechos= hechos)
+    pendientes = sum(hasta - desde for desde, hasta in rangos)
+    
+    conexiones = []
+    lock = threading.Lock()
+    local = threading.local()
+    
+    def conexion():
+        if getattr(local, 'mysql', None) is None:
+            local.mysql = make_mysql_connection(database)
+            with lock:
+                conexiones.append(local.mysql)
+        return local.mysql
+    
+    def inserto_chunk(rango):
+        desde, hasta = rango
+        list_input = valores_para_mysql(data.iloc[desde:hasta,:])
+        
+        for intento in range(reintentos + 1):
+            try:
+                mysql = conexion()
+                with mysql.cursor() as cur:
+                    cur.executemany(sql, list_input)
+                    registros = cur.rowcount
+                mysql.commit()
+                if al_commitear is not None:
+                    al_commitear(desde, hasta)
+                return registros
+            except Exception:
+                # Descarto la conexion: el chunk no quedo commiteado y lo vuelvo a intentar
+                try:
+                    local.mysql.rollback()
+                    local.mysql.close()
+                except Exception:
+                    pass
+                local.mysql = None
+                
+                if intento == reintentos:
+                    raise
+                time.sleep(2 ** intento)
+    
+    try:
+        with ThreadPoolExecutor(max_workers= n_conexiones) as executor:
+            registros_commiteados = sum(executor.map(inserto_chunk, rangos), 0)
+    except Exception:
+        registros_commiteados = -1
+    finally:
+        for mysql in conexiones:
+            if mysql.open:
+                mysql.close()
+    
+    if stats is not None:
+        segundos = time.time() - inicio
+        stats.update({'metodo': 'paralelo', 'conexiones': n_conexiones, 'registros': data.shape[0], 'segundos': segundos,
+                      'registros_por_segundo': data.shape[0] / max(segundos, 1e-6)})
+    
+    # Control de consistencia: todo lo que mande tiene que haber quedado commiteado
+    if registros_commiteados != pendientes:
+        return 0
+    return 1
+
+
+def inserto_cuits(data, database, tabla= 'registro_sociedades', metodo= 'executemany', stats= None, n_conexiones= 4,
+                  hechos= None, al_commitear= None):
+    '''
+        Inserto nuevos registros a la tabla "database.tabla"
+        
+        input:
+            data: (pandas.DataFrame) Base con CUITs a insertar
+            database: (str) Base de MySql donde inserto
+            tabla: (str) Tabla donde inserto
+            metodo: (str) 'executemany', 'load_data' o 'paralelo'. Si falla 'load_data' sigo con executemany con los registros que faltan
+            stats: (dict) Si no es None le dejo metodo, registros, segundos y registros_por_segundo de la carga
+            n_conexiones: (int) Conexiones en paralelo para metodo 'paralelo' (ver inserto_cuits_paralelo)
+            hechos: (list) Rangos (desde, hasta) de registros de data ya commiteados en una corrida anterior, no se vuelven a insertar
+            al_commitear: (function) Si no es None la llamo con (desde, hasta) despues de commitear cada chunk, para
+                          guardar el avance (ver checkpoint_functions)
+        output:        
+           -1: (int) No hay registros para insertar
+            0: (int) No corrio el proceso
+            1: (int) Corrio bien el proceso
+    '''
+    
+    if data.shape[0] == 0:
+        return -1
+    
+    inicio = time.time()
+    
+    commiteados = [tuple(rango) for rango in (hechos or [])]
+    
+    def commiteo(desde, hasta):
+        commiteados.append((desde, hasta))
+        if al_commitear is not None:
+            al_commitear(desde, hasta)
+    
+    # En los backends embebidos no hay LOAD DATA ni conexiones en paralelo: inserto lo que falta en una transaccion
+    if bk.es_embebido():
+        rangos = uf.get_rangos(data.shape[0], data.shape[0], hechos)
+        try:
+            if rangos:
+                bk.inserto_dataframe(pd.concat([data.iloc[desde:hasta,:] for desde, hasta in rangos]), database, tabla, valores_para_mysql)
+        except Exception:
+            return 0
+        
+        for desde, hasta in rangos:
+            commiteo(desde, hasta)
+        
+        if stats is not None:
+            segundos = time.time() - inicio
+            stats.update({'metodo': bk.backend['nombre'], 'registros': data.shape[0], 'segundos': segundos,
+                          'registros_por_segundo': data.shape[0] / max(segundos, 1e-6)})
         return 1
     
-    except:            
+    if metodo == 'paralelo':
+        return inserto_cuits_paralelo(data, database, tabla, n_conexiones= n_conexiones, stats= stats, hechos= hechos, al_commitear= al_commitear)
+    
+    # Si falla una carga de LOAD DATA sigo con executemany desde los registros que no quedaron commiteados
+    if metodo == 'load_data':
+        inserto_load_data(data, database, tabla, hechos= hechos, al_commitear= commiteo, stats= stats)
+        if uf.get_rangos(data.shape[0], hechos= commiteados):
+            metodo = 'load_data+executemany'
+    
+    try:
+        rangos = uf.get_rangos(data.shape[0], hechos= commiteados)
+        if rangos:
+            mysql = make_mysql_connection(database)
+
+            with mysql.cursor() as cur:
+
+                cols = data.columns.values.tolist()
+                n_cols = len(cols)
+                sql = 'insert into `{}` (`{}`) values ({}%s)'.format(tabla, '`,`'.join(cols), '%s,'*(n_cols-1))
+
+                for desde, hasta in rangos:
+                    list_input = valores_para_mysql(data.iloc[desde:hasta,:])
+
+                    cur.executemany(sql, list_input)
+                    mysql.commit()    
+
+                    commiteo(desde, hasta)
+                    
+            mysql.close()
+        
+        if stats is not None:
+            segundos = time.time() - inicio
+            stats.update({'metodo': metodo, 'registros': data.shape[0], 'segundos': segundos,
+                          'registros_por_segundo': data.shape[0] / max(segundos, 1e-6)})
+        return 1
+    except Exception as e:
+        if stats is not None:
+            stats['error'] = '%s: %s' % (type(e).__name__, e)
         if 'mysql' in locals():
             if mysql.open:
                 mysql.close()
-        return 0
\ No newline at end of file
+        return 0
+    
+
+def update_cuits(base_update, stats= None, registros_por_lote= 2000):
+    '''
+        Aplico las versiones nuevas de los CUITs que cambiaron directamente en empresas.registro_sociedades en una
+        sola transaccion y una sola pasada: por lotes de CUITs ordenados cierro la version vigente (fh_fin_registro
+        un dia antes de la fh_inicio_registro de la version nueva) e inserto la version nueva. Se commitea una sola
+        vez al final; si algo falla se hace rollback y la tabla queda como estaba (ya no se usa step.registro_sociedades).
+
+        input:
+            base_update: (pandas.DataFrame) Base con CUITs para updatear
+            stats: (dict) Si no es None le agrego registros cerrados, abiertos, lotes y segundos
+            registros_por_lote: (int) CUITs por lote
+        output:
+           -1: (int) No hay registros para actualizar
+            0: (int) No corrio el proceso
+            1: (int) Corrio bien el proceso
+    '''
+
+    if base_update.shape[0] == 0:
+        return -1
+
+    inicio = time.time()
+
+    # Ordeno por CUIT para recorrer el indice en orden y tomar los locks siempre en el mismo orden
+    base_update = base_update.sort_values('nu_cuit', kind= 'stable')
+    fecha_cierre = (pd.to_datetime(base_update['fh_inicio_registro']) - pd.Timedelta(days= 1)).dt.strftime('%Y-%m-%d').to_numpy()
+
+    cols = base_update.columns.values.tolist()
+    sql_insert = 'insert into `registro_sociedades` (`{}`) values ({}%s)'.format('`,`'.join(cols), '%s,'*(len(cols)-1))
+
+    cerrados = 0
+    lotes = 0
+
+    try:
+
+        mysql = make_mysql_connection('empresas')
+
+        with mysql.cursor() as cur:
+
+            i = 0
+            for chunk in uf.get_chunks(base_update.shape[0], registros_por_lote):
+                lote = base_update.iloc[i:chunk,:]
+
+                # Cierro las versiones vigentes del lote, un update por fecha de cierre (en general es una sola)
+                for fecha, cuits in lote['nu_cuit'].groupby(fecha_cierre[i:chunk]):
+                    sql = f'''
+                            update registro_sociedades
+                            set
+                                fh_fin_registro = %s
+                            where
+                                fh_fin_registro = '2100-12-31' and
+                                nu_cuit in ({','.join(['%s']*len(cuits))})
+                    '''
+                    cur.execute(sql, [fecha] + [int(cuit) for cuit in cuits])
+                    cerrados += max(cur.rowcount, 0)
+
+                # Inserto las versiones nuevas del lote
+                cur.executemany(sql_insert, valores_para_mysql(lote))
+
+                lotes += 1
+                i = chunk
+
+        mysql.commit()
+        mysql.close()
+
+    except:
+        if 'mysql' in locals():
+            if mysql.open:
+                mysql.rollback()
+                mysql.close()
+        return 0
+
+    if stats is not None:
+        stats.update({'cerrados': cerrados, 'abiertos': base_update.shape[0], 'lotes': lotes,
+                      'segundos': round(time.time() - inicio, 4)})
+
+    return 1
\ No newline at end of file
@@ -0,0 +1,241 @@
+import os
+import numpy as np
+import pandas as pd
+import utils_file_functions as uf
+import process_file_functions as pf
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+snapshot_path = './data/snapshot/registro_sociedades_vigente.parquet'
+
+def leo_snapshot(path= snapshot_path):
+    
+    '''
+        Leo el snapshot local de la base vigente (memory map del Parquet)
+        
+        input:
+            path: (str) Path del snapshot
+        output:
+            -> (base, periodo) (tuple)
+                    -> base (pandas.DataFrame) Base vigente con el mismo formato que pf.descargo_base_mysql
+                    -> periodo (int) Ultimo cd_periodo_proceso aplicado al snapshot
+            -> (None, None) si no hay snapshot
+    '''
+    
+    if pq is None or not os.path.exists(path):
+        return None, None
+    
+    tabla = pq.read_table(path, memory_map= True)
+    periodo = int(tabla.schema.metadata[b'cd_periodo_proceso'])
+    
+    base = pf.aplico_esquema(tabla.to_pandas())
+    
+    return base, periodo
+
+def guardo_snapshot(base, periodo, path= snapshot_path, periodo_mysql= None):
+    
+    '''
+        Guardo la base vigente como Parquet marcada con el periodo, con los tipos de pf.esquema_registro.
+        Escribo a un archivo temporal y lo renombro para no dejar un snapshot a medio escribir.
+        Ademas del periodo guardo el max(cd_periodo_proceso) de MySql que refleja la base: un periodo sin
+        inserts ni updates avanza el periodo pero no cambia MySql (ver descargo_base_vigente).
+        
+        input:
+            base: (pandas.DataFrame) Base vigente
+            periodo: (int) Ultimo periodo aplicado a la base (aunque no haya tenido novedades)
+            path: (str) Path del snapshot
+            periodo_mysql: (int) max(cd_periodo_proceso) en MySql con la base aplicada. Si es None es periodo
+        output:
+    '''
+    
+    if pa is None:
+        return
+    
+    periodo_mysql = periodo if periodo_mysql is None else periodo_mysql
+    
+    tabla = pa.Table.from_pandas(pf.aplico_esquema(base), preserve_index= False)
+    tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}), b'cd_periodo_proceso': str(periodo).encode(),
+                                           b'cd_periodo_mysql': str(periodo_mysql).encode()})
+    
+    os.makedirs(os.path.dirname(path), exist_ok= True)
+    pq.write_table(tabla, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+def periodo_snapshot(path= snapshot_path):
+    
+    '''
+        Ultimo periodo aplicado al snapshot (solo leo la metadata del Parquet)
+        
+        input:
+            path: (str) Path del snapshot
+        output:
+            periodo: (int) Periodo, None si no hay snapshot
+    '''
+    
+    if pq is None or not os.path.exists(path):
+        return None
+    
+    return int(pq.read_schema(path).metadata[b'cd_periodo_proceso'])
+
+def periodo_mysql_snapshot(path= snapshot_path):
+    
+    '''
+        max(cd_periodo_proceso) de MySql que refleja el snapshot (solo leo la metadata del Parquet)
+        
+        input:
+            path: (str) Path del snapshot
+        output:
+            periodo_mysql: (int) Periodo, None si no hay snapshot
+    '''
+    
+    if pq is None or not os.path.exists(path):
+        return None
+    
+    metadata = pq.read_schema(path).metadata
+    
+    # Los snapshots anteriores solo tienen el periodo aplicado, que era el de MySql
+    return int(metadata.get(b'cd_periodo_mysql', metadata[b'cd_periodo_proceso']))
+
+def guardo_snapshot_periodo(base, base_insert, base_update, periodo, path= snapshot_path):
+    
+    '''
+        Guardo el snapshot despues de cargar un periodo (base ya con aplico_novedad). Si el periodo no tuvo
+        inserts ni updates MySql sigue en el mismo max(cd_periodo_proceso) que el snapshot anterior
+        
+        input:
+            base: (pandas.DataFrame) Base vigente con la novedad del periodo aplicada
+            base_insert: (pandas.DataFrame) CUITs insertados en el periodo
+            base_update: (pandas.DataFrame) CUITs updateados en el periodo
+            periodo: (int) Periodo AAAAMM cargado
+            path: (str) Path del snapshot
+        output:
+    '''
+    
+    periodo_mysql = periodo if base_insert.shape[0] + base_update.shape[0] > 0 else periodo_mysql_snapshot(path)
+    
+    guardo_snapshot(base, periodo, path, periodo_mysql= periodo_mysql)
+
+def actualizo_snapshot(base_insert, base_update, periodo, path= snapshot_path, registros_por_lote= 500000):
+    
+    '''
+        Aplico la novedad del periodo al snapshot en disco sin cargar la base vigente entera: copio el snapshot por
+        lotes de registros sin los CUITs de la novedad y agrego al final las versiones nuevas (archivo temporal y
+        rename). Si el snapshot no es el del periodo anterior lo regenero con descargo_base_vigente (MySql ya tiene
+        el periodo cargado).
+        
+        input:
+            base_insert: (pandas.DataFrame) CUITs insertados en el periodo
+            base_update: (pandas.DataFrame) CUITs updateados en el periodo
+            periodo: (int) Periodo AAAAMM cargado
+            path: (str) Path del snapshot
+            registros_por_lote: (int) Registros del snapshot que copio por vez
+        output:
+            True si el snapshot quedo al dia con el periodo (False sin pyarrow)
+    '''
+    
+    if pq is None:
+        return False
+    
+    if periodo_snapshot(path) != uf.periodo_anterior(periodo):
+        guardo_snapshot_periodo(descargo_base_vigente(path), base_insert, base_update, periodo, path)
+        return True
+    
+    periodo_mysql = periodo if base_insert.shape[0] + base_update.shape[0] > 0 else periodo_mysql_snapshot(path)
+    
+    archivo = pq.ParquetFile(path)
+    esquema = archivo.schema_arrow
+    esquema = esquema.with_metadata({**esquema.metadata, b'cd_periodo_proceso': str(periodo).encode(),
+                                     b'cd_periodo_mysql': str(periodo_mysql).encode()})
+    
+    novedad = pf.concateno_bases([base_update, base_insert])
+    cuits = novedad['nu_cuit'].to_numpy(dtype= 'int64')
+    
+    with pq.ParquetWriter(path + '.tmp', esquema) as snapshot:
+        for lote in archivo.iter_batches(batch_size= registros_por_lote):
+            lote = pa.Table.from_batches([lote])
+            snapshot.write_table(lote.filter(~np.isin(lote.column('nu_cuit').to_numpy(), cuits)).cast(esquema))
+        
+        if novedad.shape[0] > 0:
+            novedad = pf.aplico_esquema(novedad[esquema.names])
+            snapshot.write_table(pa.Table.from_pandas(novedad, preserve_index= False).cast(esquema))
+    
+    archivo.close()
+    os.replace(path + '.tmp', path)
+    
+    return True
+
+def leo_snapshot_cuits(cuits, periodo, path= snapshot_path):
+    
+    '''
+        Leo del snapshot solo los registros vigentes de unos CUITs, si el snapshot es el del periodo anterior a periodo
+        (por ejemplo las versiones que cierra el periodo, sin cargar la base vigente entera)
+        
+        input:
+            cuits: (array) CUITs a leer
+            periodo: (int) Periodo AAAAMM que se esta cargando
+            path: (str) Path del snapshot
+        output:
+            base: (pandas.DataFrame) Registros vigentes de los CUITs, None si el snapshot no esta al dia
+    '''
+    
+    if periodo_snapshot(path) != uf.periodo_anterior(periodo):
+        return None
+    
+    cuits = pd.unique(np.asarray(cuits, dtype= 'int64'))
+    if len(cuits) == 0:
+        return pf.aplico_esquema(pq.read_schema(path).empty_table().to_pandas())
+    
+    tabla = pq.read_table(path, memory_map= True, filters= [('nu_cuit', 'in', cuits.tolist())])
+    
+    return pf.aplico_esquema(tabla.to_pandas())
+
+def aplico_novedad(base_actual, base_insert, base_update):
+    
+    '''
+        Aplico a la base vigente los registros insertados y updateados en el periodo: saco la version
+        vigente de los CUITs updateados y agrego las versiones nuevas
+        
+        input:
+            base_actual: (pandas.DataFrame) Base vigente
+            base_insert: (pandas.DataFrame) CUITs insertados (pf.base_final_para_actualizar)
+            base_update: (pandas.DataFrame) CUITs updateados (pf.base_final_para_actualizar)
+        output:
+            base_actual: (pandas.DataFrame) Base vigente actualizada
+    '''
+    
+    columnas = base_actual.columns.tolist()
+    
+    base_actual = base_actual.loc[~base_actual['nu_cuit'].isin(base_update['nu_cuit']),:]
+    
+    return pf.aplico_esquema(pf.concateno_bases([base_actual, base_update[columnas], base_insert[columnas]]))
+
+def descargo_base_vigente(path= snapshot_path):
+    
+    '''
+        Traigo la base vigente del snapshot local si esta al dia con MySql (el max(cd_periodo_proceso) de MySql
+        es el que refleja el snapshot, ver guardo_snapshot). Si no, la descargo de MySql con pf.descargo_base_mysql
+        y regenero el snapshot.
+        
+        input:
+            path: (str) Path del snapshot
+        output:
+            base: (pandas.DataFrame) Base vigente con el mismo formato que pf.descargo_base_mysql
+    '''
+    
+    periodo_mysql = pf.descargo_ultimo_periodo_mysql()
+    
+    base = None
+    if periodo_mysql_snapshot(path) == periodo_mysql:
+        base, _ = leo_snapshot(path)
+    
+    if base is None:
+        base = pf.descargo_base_mysql()
+        if periodo_mysql is not None:
+            guardo_snapshot(base, periodo_mysql, path)
+    
+    return base
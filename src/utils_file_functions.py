@@ -1,5 +1,15 @@
+import io
 import json
 import os
+import re
+import numpy as np
+import pandas as pd
+from zipfile import ZipFile
+
+re_espacios = re.compile(r'\s+')
+
+# Diccionario {valor original: valor normalizado} de las columnas string de baja cardinalidad (ver proceso_string)
+diccionario_normalizacion = {}
 
 def get_last_period_updated():
     
@@ -19,35 +29,154 @@ def get_last_period_updated():
                 last_period_updated = log['periodo_actual_en_mysql']
     return last_period_updated
 
+def periodo_anterior(periodo):
+    
+    '''
+        Periodo anterior
+        input:
+            periodo: (int) AAAAMM
+        output:
+            periodo_anterior: (int) AAAAMM del mes anterior
+    '''
+    
+    return periodo - 1 if periodo % 100 != 1 else (periodo // 100 - 1) * 100 + 12
+
 def check_local_files_to_update(ultimo_periodo_actualizado):
     
     '''
-        Me fijo si ya tengo el ultimo .csv en la carpeta data/zip para actualizar
+        Me fijo si ya tengo el ultimo .csv en la carpeta data/zip para actualizar, suelto o dentro de un .zip
         input:
             last_period_updated: (str) AAAAMMM ultimo periodo actualizado
         output:
-            files_to_use: (list) Archivos ya descargados para actualizar
+            files_to_use: (list) Archivos ya descargados para actualizar. Los que estan dentro de un .zip
+                          van como 'archivo.zip/archivo.csv' (ver abro_archivo)
     '''
     files_already_downloaded = [file for file in os.listdir('data/zip') if file[-3:] == 'csv']
     
-    files_to_use = [file for file in files_already_downloaded if file[-10:-4] > ultimo_periodo_actualizado]
+    for zip_file in [file for file in os.listdir('data/zip') if file[-3:] == 'zip']:
+        with ZipFile(os.path.join('data/zip', zip_file), 'r') as zipf:
+            files_already_downloaded += [f'{zip_file}/{file}' for file in zipf.namelist() if file[-3:] == 'csv']
+    
+    # Si un periodo esta suelto y dentro de un .zip uso el suelto
+    files_to_use = {}
+    for file in sorted(files_already_downloaded, key= lambda file: '.zip/' in file):
+        if file[-10:-4] > ultimo_periodo_actualizado:
+            files_to_use.setdefault(file[-10:-4], file)
+    
+    return list(files_to_use.values())
+
+def abro_archivo(file, buffer_size= 1024 * 1024):
+    
+    '''
+        Abro un .csv para leerlo en binario con buffer. Si el path es 'archivo.zip/archivo.csv' leo el archivo
+        directo del .zip sin extraerlo a disco.
+        
+        input:
+            file: File path o archivo ya abierto (se devuelve igual)
+            buffer_size: (int) Tamaño del buffer, es lo maximo que se puede espiar con peek()
+        output: (io.BufferedReader) Archivo abierto
+    '''
+    
+    # Ya esta abierto (por ejemplo el .csv temporal del prefiltro de lineas)
+    if hasattr(file, 'read'):
+        return file
+    
+    if '.zip/' in file:
+        zip_file, member = file.split('.zip/', 1)
+        with ZipFile(zip_file + '.zip', 'r') as zipf:
+            # El archivo del zip queda abierto hasta que se cierre el member
+            return io.BufferedReader(zipf.open(member), buffer_size= buffer_size)
+    
+    return open(file, 'rb', buffering= buffer_size)
+
+def normalizo_string(valor):
+
+    '''
+        Normalizo un string: lowercase, saco espacios al principio y al final y dejo un solo espacio entre palabras
+        
+        input: (str) Valor a normalizar
+        output: (str) Valor normalizado, NaN si no es un string
+    '''
+    
+    if not isinstance(valor, str):
+        return np.nan
     
-    return files_to_use
+    return re_espacios.sub(' ', valor.lower().strip())
 
-def proceso_string(str_var):
+def proceso_string(str_var, diccionario= None, categoria= False):
 
     '''
         Proceso campos string -> Todo to lowercase, saco espacios, etc.
+        Factorizo la columna y normalizo solo los valores distintos, asi el costo depende de la cantidad
+        de valores distintos y no de la cantidad de registros.
         
-        input: Pandas Series en string
+        input: 
+            str_var: Pandas Series en string
+            diccionario: (dict) Diccionario {valor: valor normalizado} que se reusa y se completa con los valores nuevos
+                         (ver diccionario_normalizacion). Si es None no se usa
+            categoria: (bool) Si es True devuelvo la columna como categorica, armada directamente desde los codigos
         output: Pandas Series de la string procesada     
     '''
     
-    str_var = str_var.str.lower()
-    str_var = str_var.str.strip()
-    str_var = str_var.str.replace('\s+', ' ')
+    codigos, valores = pd.factorize(str_var)
+    valores = np.asarray(valores, dtype= 'object')
+    
+    if diccionario is None:
+        normalizados = [normalizo_string(valor) for valor in valores]
+    else:
+        normalizados = []
+        for valor in valores:
+            if valor not in diccionario:
+                diccionario[valor] = normalizo_string(valor)
+            normalizados.append(diccionario[valor])
+    
+    if categoria:
+        # Varios valores pueden normalizarse al mismo, asi que vuelvo a factorizar los normalizados (el -1 de los nulos se mantiene)
+        codigos_normalizados, categorias = pd.factorize(pd.Series(normalizados, dtype= 'object'))
+        codigos = np.append(codigos_normalizados, -1)[codigos]
+        return pd.Series(pd.Categorical.from_codes(codigos, categorias), index= str_var.index, name= str_var.name)
+    
+    # Al final agrego el NaN para los nulos (codigo -1 de factorize)
+    normalizados = np.array(normalizados + [np.nan], dtype= 'object')
+    
+    return pd.Series(normalizados[codigos], index= str_var.index, name= str_var.name)
+
+def cargo_diccionario_normalizacion(path):
+
+    '''
+        Cargo el diccionario de normalizacion guardado en corridas anteriores
+        
+        input: (str) Path del .json
+        output:
+    '''
+    
+    if os.path.exists(path):
+        with open(path, 'r', encoding= 'utf-8') as f:
+            diccionario_normalizacion.update(json.load(f))
+
+def guardo_diccionario_normalizacion(path, max_valores= 500e3):
+
+    '''
+        Guardo el diccionario de normalizacion para las proximas corridas. Si supera max_valores no lo guardo
+        para no arrastrar columnas de alta cardinalidad.
+        
+        input: 
+            path: (str) Path del .json
+            max_valores: (int) Maxima cantidad de valores a guardar
+        output:
+    '''
+    
+    # Copio el diccionario de una, lo puede estar completando el periodo que se prepara en paralelo
+    diccionario = dict(diccionario_normalizacion)
     
-    return str_var
+    if len(diccionario) > max_valores:
+        return
+    
+    diccionario = {valor: normalizado for valor, normalizado in diccionario.items() if isinstance(normalizado, str)}
+    
+    with open(path + '.tmp', 'w', encoding= 'utf-8') as f:
+        json.dump(diccionario, f, ensure_ascii= False)
+    os.replace(path + '.tmp', path)
 
 def cuit_validation(cuit):
     
@@ -67,7 +196,8 @@ def check_headers(file):
     '''
         Me fijo si el archivo viene con Headers o no
         
-        input: File path
+        input: File path o archivo abierto con abro_archivo. Si es un archivo abierto espio la primera linea
+               con peek() sin moverme, para que despues se pueda leer desde el principio
         output: 
             -> (skip,headers) (tuple)
                     -> skip (int) es la cantidad de filas a skipear (1 si tiene headers, 0 sino). 
@@ -76,10 +206,13 @@ def check_headers(file):
     '''
     
     with open('./data/headers.csv', 'r', encoding= 'utf-8-sig') as f:
-        headers = f.readline().split(',')
-        
-    with open(file, 'r', encoding= 'utf-8-sig') as f:
-        first_line = f.readline().split(',')
+        headers = f.readline().strip().split(',')
+    
+    if hasattr(file, 'peek'):
+        first_line = file.peek(4096).split(b'\n')[0].decode('utf-8-sig', errors= 'replace').split(',')
+    else:
+        with open(file, 'r', encoding= 'utf-8-sig') as f:
+            first_line = f.readline().split(',')
     
     if (first_line[0][:2] == '30') or (first_line[0][:3] == '"30'):
         return (0,headers)
@@ -103,13 +236,75 @@ def get_chunks(n, chunk= 10e3):
     n = int(n)
     chunk = int(chunk)
      
-    if n % chunk > 0:
+    # El ultimo tope siempre es n (aunque n sea multiplo de chunk)
+    if n > 0:
         chunks = list(range(chunk, n, chunk)) + [n]
     else:
-        chunks = list(range(chunk, n, chunk))
+        chunks = []
     
     return chunks
 
+def uno_rangos(rangos):
+    
+    '''
+        Uno rangos [desde, hasta) que se pisan o se tocan
+        
+        input:
+            -> rangos: Lista de rangos (desde, hasta)
+        output:
+            -> Lista de rangos [desde, hasta] ordenados y sin pisarse
+    '''
+    
+    unidos = []
+    for desde, hasta in sorted((int(desde), int(hasta)) for desde, hasta in rangos):
+        if unidos and desde <= unidos[-1][1]:
+            unidos[-1][1] = max(unidos[-1][1], hasta)
+        else:
+            unidos.append([desde, hasta])
+    
+    return unidos
+
+def get_rangos(n, chunk= 10e3, hechos= None):
+    
+    '''
+       Igual que get_chunks pero devuelvo los rangos (desde, hasta) de cada chunk, salteando los registros que ya
+       estan en hechos (por ejemplo los chunks ya commiteados de una corrida anterior, ver checkpoint_functions)
+        
+        input: 
+            -> n: Cantidad de registros a subir
+            -> chunk: Cantidad de registros por chunk
+            -> hechos: Lista de rangos (desde, hasta) a saltear
+        output: 
+            -> Lista de rangos (desde, hasta) de a lo sumo chunk registros
+    '''
+    
+    n = int(n)
+    chunk = int(chunk)
+    
+    rangos = []
+    desde = 0
+    for hecho_desde, hecho_hasta in uno_rangos(hechos or []) + [[n, n]]:
+        hasta = min(hecho_desde, n)
+        rangos += [(inicio, min(inicio + chunk, hasta)) for inicio in range(desde, hasta, chunk)]
+        desde = max(desde, hecho_hasta)
+    
+    return rangos
+
+def rangos_de_mascara(mascara):
+    
+    '''
+        Paso una mascara de registros a rangos (desde, hasta) de registros seguidos en True
+        
+        input:
+            -> mascara: numpy.array de bool
+        output:
+            -> Lista de rangos (desde, hasta)
+    '''
+    
+    bordes = np.flatnonzero(np.diff(np.concatenate([[0], np.asarray(mascara, dtype= 'int8'), [0]])))
+    
+    return [(int(desde), int(hasta)) for desde, hasta in zip(bordes[::2], bordes[1::2])]
+
 def resumen_nas(data):
     '''
         Saco los % de NAs por columna que importa para luego dejarlos en el log
@@ -125,4 +320,35 @@ def resumen_nas(data):
     
     nulos = data[cols].isnull().mean()
     
-    return nulos
\ No newline at end of file
+    return nulos
+
+def calculo_registros_por_lote(file, skip, headers, memoria_maxima_mb, factor_copias= 6, n_muestra= 1000):
+    '''
+        Estimo cuantos registros entran en un lote para no pasarme de la memoria maxima.
+        Leo una muestra del archivo, mido los bytes por registro y lo multiplico por la
+        cantidad de copias que hacen los pasos del proceso.
+        
+        input:
+            file: File path o archivo abierto con abro_archivo (la muestra sale de peek() sin moverme)
+            skip: (int) Filas a skipear (ver check_headers)
+            headers: (list) Headers del file
+            memoria_maxima_mb: (int) Memoria maxima a usar por lote en MB
+            factor_copias: (int) Copias de cada lote que se generan durante el proceso
+            n_muestra: (int) Registros de la muestra
+        output:
+            registros_por_lote: (int) Cantidad de registros por lote
+    '''
+    
+    if hasattr(file, 'peek'):
+        buffer = file.peek(1024 * 1024)
+        file = io.BytesIO(buffer[:buffer.rfind(b'\n') + 1])
+    
+    muestra = pd.read_csv(file, header= None, names= headers, skiprows= skip, nrows= n_muestra, dtype= 'object', encoding= 'utf-8-sig')
+    
+    if muestra.shape[0] == 0:
+        return n_muestra
+    
+    bytes_por_registro = muestra.memory_usage(deep= True).sum() / muestra.shape[0]
+    registros_por_lote = int(memoria_maxima_mb * 1024 ** 2 / (bytes_por_registro * factor_copias))
+    
+    return max(registros_por_lote, n_muestra)
@@ -0,0 +1,69 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import pytest
+import process_file_functions as pf
+import benchmark_functions as bmk
+
+# Headers de data/headers.csv (uf.check_headers y bmk.leo_headers los leen de ahi)
+headers_rns = ['cuit', 'razon_social', 'fecha_contrato_social', 'tipo_societario', 'fecha_actualizacion', 'numero_inscripcion',
+               'dom_fiscal_provincia', 'dom_fiscal_localidad', 'dom_fiscal_calle', 'dom_fiscal_numero', 'dom_fiscal_piso',
+               'dom_fiscal_departamento', 'dom_fiscal_cp', 'dom_fiscal_estado_domicilio', 'dom_legal_provincia',
+               'dom_legal_localidad', 'dom_legal_calle', 'dom_legal_numero', 'dom_legal_piso', 'dom_legal_departamento',
+               'dom_legal_cp', 'dom_legal_estado_domicilio']
+
+
+@pytest.fixture
+def lookups_sinteticos():
+
+    '''
+        Lookups de los archivos sinteticos en la cache de pf.descargo_lookups, asi el proceso no va a MySql
+    '''
+
+    pf.invalido_cache_lookups()
+    pf._cache_lookups.update(bmk.lookups_sinteticos())
+    yield pf._cache_lookups
+    pf.invalido_cache_lookups()
+
+
+@pytest.fixture
+def archivo_rns(tmp_path, monkeypatch):
+
+    '''
+        Escribo un archivo sintetico del RNS y devuelvo (path, periodo, registros). Corre en tmp_path con el
+        data/headers.csv que lee uf.check_headers
+    '''
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data', exist_ok= True)
+    with open('data/headers.csv', 'w') as f:
+        f.write(','.join(headers_rns) + '\n')
+
+    def escribo(n_registros= 300, data= None, periodo= 202101):
+        if data is None:
+            periodo, data = next(iter(bmk.genero_periodos_rns(n_registros, 1, periodo_inicial= periodo)))
+        path = str(tmp_path / f'registro-nacional-sociedades-{periodo}.csv')
+        data.to_csv(path, index= False)
+        return path, periodo, data
+
+    return escribo
+
+
+@pytest.fixture(params= ['sqlite', 'duckdb'])
+def backend_embebido(request, tmp_path, lookups_sinteticos):
+
+    '''
+        Backend embebido (sqlite y duckdb, si esta instalado) en tmp_path con los lookups sinteticos cargados.
+        Al terminar vuelvo a MySql
+    '''
+
+    import backend_functions as bk
+
+    if request.param == 'duckdb':
+        pytest.importorskip('duckdb')
+
+    bk.configuro_backend(request.param, str(tmp_path / 'embebido'))
+    bk.cargo_lookups_embebido(lookups_sinteticos)
+    yield bk
+    bk.configuro_backend('mysql')
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+import benchmark_functions as bmk
+import process_file_functions as pf
+import snapshot_functions as sf
+
+
+def corro_periodo(path, periodo, modo_comparacion, rns_vigente):
+
+    '''
+        Pasos de app.py para un periodo: preparo el archivo por lotes, comparo, inserto y updateo
+    '''
+
+    rns_para_comprar, _ = pf.preparo_periodo(path, periodo)
+    pf.agrego_columna_digest()
+
+    try:
+        if modo_comparacion == 'digest':
+            rns_insert, rns_update = pf.base_final_para_actualizar_digest(rns_para_comprar, pf.descargo_digest_mysql(), periodo, periodo)
+        elif modo_comparacion == 'sql':
+            rns_insert, rns_update = pf.base_final_para_actualizar_sql(rns_para_comprar, periodo, periodo)
+        else:
+            if rns_vigente is None:
+                rns_vigente = sf.descargo_base_vigente()
+            rns_insert, rns_update = pf.base_final_para_actualizar(rns_para_comprar, rns_vigente, periodo, periodo)
+    finally:
+        rns_para_comprar.borro()
+
+    assert pf.inserto_cuits(rns_insert, 'empresas', metodo= 'load_data') != 0
+    assert pf.update_cuits(rns_update) != 0
+
+    if modo_comparacion == 'completo':
+        rns_vigente = sf.aplico_novedad(rns_vigente, rns_insert, rns_update)
+
+    return rns_insert, rns_update, rns_vigente
+
+
+@pytest.mark.parametrize('modo_comparacion', ['digest', 'sql', 'completo'])
+def test_pipeline_embebido(archivo_rns, backend_embebido, modo_comparacion):
+
+    # Tres periodos con altas, cambios y bajas: queda un registro vigente por CUIT con el ultimo archivo y una
+    # version cerrada por cada cambio
+    rns_vigente = None
+    insertados, updateados = 0, 0
+
+    for periodo, data in bmk.genero_periodos_rns(2000, 3, p_cambios= 0.1, p_altas= 0.05):
+        path, periodo, _ = archivo_rns(data= data, periodo= periodo)
+        rns_insert, rns_update, rns_vigente = corro_periodo(path, periodo, modo_comparacion, rns_vigente)
+        insertados += rns_insert.shape[0]
+        updateados += rns_update.shape[0]
+
+    assert insertados > 0 and updateados > 0
+
+    mysql = pf.make_mysql_connection('empresas')
+    with mysql.cursor() as cur:
+        cur.execute("select nu_cuit, fh_fin_registro from registro_sociedades")
+        registros = pd.DataFrame(cur.fetchall(), columns= ['nu_cuit', 'fh_fin_registro'])
+    mysql.close()
+
+    vigentes = registros.loc[pd.to_datetime(registros['fh_fin_registro']) == pd.Timestamp('2100-12-31'), 'nu_cuit']
+    assert vigentes.is_unique
+    assert vigentes.shape[0] == insertados
+    assert registros.shape[0] == insertados + updateados
+
+    # El digest vigente de cada CUIT es el del ultimo archivo
+    ultimo, _ = pf.preparo_periodo(path, periodo, False)
+    ultimo = ultimo.drop_duplicates('nu_cuit', keep= 'last')
+    digest_vigente = pf.descargo_digest_mysql().set_index('nu_cuit')['nu_digest']
+    assert digest_vigente.reindex(ultimo['nu_cuit']).tolist() == pf.calculo_digest(ultimo).tolist()
@@ -0,0 +1,63 @@
+import pandas as pd
+import benchmark_functions as bmk
+import backfill_functions as bf
+import process_file_functions as pf
+from test_backend_functions import corro_periodo
+
+
+def leo_registro_sociedades():
+
+    '''
+        Todas las versiones de registro_sociedades sin cd_log_proceso (cambia entre corridas), ordenadas por CUIT y periodo
+    '''
+
+    columnas = pf.variables_finales + ['fh_inicio_registro', 'fh_fin_registro', 'cd_periodo_proceso', 'nu_digest']
+
+    mysql = pf.make_mysql_connection('empresas')
+    with mysql.cursor() as cur:
+        cur.execute('select `%s` from registro_sociedades' % '`,`'.join(columnas))
+        registros = pd.DataFrame(cur.fetchall(), columns= columnas)
+    mysql.close()
+
+    registros = pf.aplico_esquema(registros)
+    registros['cd_periodo_proceso'] = registros['cd_periodo_proceso'].astype('int64')
+    registros['nu_digest'] = registros['nu_digest'].astype('int64')
+
+    return registros.sort_values(['nu_cuit', 'cd_periodo_proceso']).reset_index(drop= True)
+
+
+def test_calculo_intervalos():
+
+    # Tres versiones de un CUIT y una sola de otro: la primera desde 1900-01-01, cada una cierra el dia anterior a la siguiente
+    intervalos = bf.calculo_intervalos(pd.DataFrame({'nu_cuit': [30000000002, 30000000001, 30000000001, 30000000001],
+                                                     'cd_periodo_proceso': [202103, 202112, 202101, 202103]}))
+
+    assert intervalos['nu_cuit'].tolist() == [30000000001] * 3 + [30000000002]
+    assert intervalos['cd_periodo_proceso'].tolist() == [202101, 202103, 202112, 202103]
+    assert intervalos['fh_inicio_registro'].dt.strftime('%Y-%m-%d').tolist() == ['1900-01-01', '2021-03-01', '2021-12-01', '1900-01-01']
+    assert intervalos['fh_fin_registro'].dt.strftime('%Y-%m-%d').tolist() == ['2021-02-28', '2021-11-30', '2100-12-31', '2100-12-31']
+
+
+def test_backfill_igual_a_periodo_por_periodo(archivo_rns, backend_embebido, tmp_path):
+
+    # Los mismos archivos cargados con el backfill y con los pasos de app.py periodo por periodo dejan las mismas versiones
+    archivos = [archivo_rns(data= data, periodo= periodo)[:2] for periodo, data in
+                bmk.genero_periodos_rns(2000, 4, p_cambios= 0.1, p_altas= 0.05, p_bajas= 0.02)]
+    lookups = dict(pf.descargo_lookups())
+
+    resumen = bf.corro_backfill([(periodo, path) for path, periodo in archivos], cd_log= 1, n_procesos= 2,
+                                carpeta= str(tmp_path / 'backfill'))
+    backfill = leo_registro_sociedades()
+
+    assert resumen['versiones'] == backfill.shape[0]
+    assert resumen['ultimo_periodo'] == archivos[-1][1]
+
+    backend_embebido.configuro_backend(backend_embebido.backend['nombre'], str(tmp_path / 'periodo_por_periodo'))
+    backend_embebido.cargo_lookups_embebido(lookups)
+
+    for path, periodo in archivos:
+        corro_periodo(path, periodo, 'digest', None)
+    periodo_por_periodo = leo_registro_sociedades()
+
+    assert (periodo_por_periodo['cd_periodo_proceso'] > archivos[0][1]).any()
+    pd.testing.assert_frame_equal(backfill, periodo_por_periodo)
@@ -0,0 +1,59 @@
+import pandas as pd
+import benchmark_functions as bmk
+import snapshot_functions as sf
+import cdc_functions as cdc
+from test_backend_functions import corro_periodo
+
+
+def test_exporto_y_sigo_cambios(archivo_rns, backend_embebido, tmp_path):
+
+    # Tres periodos en modo 'completo': el primero solo tiene altas, en los otros dos los cambios de razon social,
+    # calle o numero quedan con el bit de esa columna
+    carpeta = str(tmp_path / 'cdc')
+    rns_vigente = None
+
+    for periodo, data in bmk.genero_periodos_rns(1500, 3, p_cambios= 0.1, p_altas= 0.05):
+        path, periodo, _ = archivo_rns(data= data, periodo= periodo)
+        base_anterior = rns_vigente if rns_vigente is not None else sf.descargo_base_vigente()
+        rns_insert, rns_update, rns_vigente = corro_periodo(path, periodo, 'completo', rns_vigente)
+        resumen = cdc.exporto_cdc(rns_insert, rns_update, periodo, base_anterior, carpeta)
+
+        assert resumen['inserts'] == rns_insert.shape[0] and resumen['updates'] == rns_update.shape[0]
+        assert resumen['updates_con_columnas'] == rns_update.shape[0]
+
+    periodos = cdc.periodos_cdc(carpeta)
+    assert len(periodos) == 3
+
+    # Cambios del ultimo periodo contra la version anterior de cada CUIT
+    cambios = cdc.leo_cdc(periodo, carpeta)
+    updates = cambios.loc[cambios['tx_operacion'] == 'update', :].set_index('nu_cuit')
+    anterior = base_anterior.set_index('nu_cuit').loc[updates.index, :]
+    nueva = rns_update.set_index('nu_cuit').loc[updates.index, :]
+
+    # Los archivos sinteticos solo cambian razon social, calle fiscal o numero legal, con su fecha de actualizacion
+    columnas_cambiadas = updates['nu_columnas_cambiadas'].map(cdc.columnas_de_mascara)
+    assert all(set(columnas) <= {'nb_razon_social', 'nb_calle_dom_fiscal', 'nu_calle_dom_legal', 'fh_actualizacion'} and
+               set(columnas) & {'nb_razon_social', 'nb_calle_dom_fiscal', 'nu_calle_dom_legal'} for columnas in columnas_cambiadas)
+
+    bit = 2 ** cdc.columnas_cdc.index('nb_razon_social')
+    cambio = (nueva['nb_razon_social'].astype('object') != anterior['nb_razon_social'].astype('object')).to_numpy()
+    assert ((updates['nu_columnas_cambiadas'].to_numpy() & bit) > 0).tolist() == cambio.tolist()
+    assert set(cdc.columnas_de_mascara(cdc.mascara_columnas(['nb_razon_social', 'cd_estado_dom_legal']))) == {'nb_razon_social', 'cd_estado_dom_legal'}
+    assert (cambios.loc[cambios['tx_operacion'] == 'insert', 'nu_columnas_cambiadas'] == cdc.mascara_todas).all()
+    pd.testing.assert_series_equal((updates['fh_inicio_registro'] - updates['fh_fin_registro_anterior']).dt.days,
+                                   pd.Series(1, index= updates.index), check_names= False)
+
+    # El consumidor lee en orden, confirma y al volver a abrirlo sigue desde lo confirmado
+    consumidor = cdc.consumidor_cdc('reportes', carpeta)
+    leidos = []
+    for periodo_leido, _ in consumidor.pendientes():
+        leidos.append(periodo_leido)
+        consumidor.confirmo(periodo_leido)
+        if len(leidos) == 2:
+            break
+    assert leidos == periodos[:2]
+
+    consumidor = cdc.consumidor_cdc('reportes', carpeta)
+    assert consumidor.ultimo_periodo == periodos[1]
+    assert [periodo_leido for periodo_leido, _ in consumidor.pendientes()] == periodos[2:]
+    assert [periodo_leido for periodo_leido, _ in cdc.consumidor_cdc('otro', carpeta).pendientes()] == periodos
@@ -0,0 +1,76 @@
+import pandas as pd
+import pytest
+import benchmark_functions as bmk
+import process_file_functions as pf
+import checkpoint_functions as ck
+
+
+def leo_registros():
+    mysql = pf.make_mysql_connection('empresas')
+    with mysql.cursor() as cur:
+        cur.execute("select nu_cuit, cd_periodo_proceso, fh_fin_registro from registro_sociedades")
+        registros = pd.DataFrame(cur.fetchall(), columns= ['nu_cuit', 'cd_periodo_proceso', 'fh_fin_registro'])
+    mysql.close()
+    return registros
+
+
+def test_reanudo_periodo_sin_duplicar_versiones(archivo_rns, backend_embebido, tmp_path):
+
+    # El segundo periodo se corta dos veces, como lo seguiria app.py: despues de commitear parte del insert (con un
+    # chunk commiteado que no llego al checkpoint) y despues de commitear el update sin marcarlo
+    carpeta = str(tmp_path / 'checkpoints')
+    pf.agrego_columna_digest()
+
+    (periodo_1, data_1), (periodo, data) = bmk.genero_periodos_rns(2000, 2, p_cambios= 0.1, p_altas= 0.05)
+
+    path, periodo_1, _ = archivo_rns(data= data_1, periodo= periodo_1)
+    base, _ = pf.preparo_periodo(path, periodo_1, False)
+    insert_1, _ = pf.base_final_para_actualizar_digest(base, pf.descargo_digest_mysql(), 1, periodo_1)
+    assert pf.inserto_cuits(insert_1, 'empresas') == 1
+
+    path, periodo, _ = archivo_rns(data= data, periodo= periodo)
+    base, _ = pf.preparo_periodo(path, periodo, False)
+    rns_insert, rns_update = pf.base_final_para_actualizar_digest(base, pf.descargo_digest_mysql(), 2, periodo)
+    n = rns_insert.shape[0]
+    assert n >= 3 and rns_update.shape[0] > 0
+
+    checkpoint = ck.checkpoint_periodo(periodo, carpeta)
+    checkpoint.guardo_bases(rns_insert, rns_update)
+    assert pf.inserto_cuits(rns_insert, 'empresas', hechos= [(n // 3, n)], al_commitear= checkpoint.commiteado) == 1
+    assert pf.inserto_cuits(rns_insert, 'empresas', hechos= [(0, n // 3), (2 * n // 3, n)]) == 1
+
+    # Segunda corrida: sigo con las bases guardadas y no vuelvo a insertar lo commiteado, aunque no este en el checkpoint
+    checkpoint = ck.checkpoint_periodo(periodo, carpeta)
+    assert checkpoint.hecho('comparacion') and not checkpoint.hecho('insert')
+    rns_insert, rns_update = checkpoint.cargo_bases()
+
+    hechos = ck.rangos_insert_hechos(checkpoint, rns_insert)
+    assert hechos == [[0, 2 * n // 3]]
+    assert pf.inserto_cuits(rns_insert, 'empresas', hechos= hechos, al_commitear= checkpoint.commiteado) == 1
+    checkpoint.marco('insert')
+
+    assert not ck.update_en_base(periodo, rns_update)
+    assert pf.update_cuits(rns_update) == 1
+
+    # Tercera corrida: el update quedo commiteado sin marcar, no se vuelve a aplicar
+    checkpoint = ck.checkpoint_periodo(periodo, carpeta)
+    assert checkpoint.hecho('insert') and not checkpoint.hecho('update')
+    rns_insert, rns_update = checkpoint.cargo_bases()
+    assert ck.update_en_base(periodo, rns_update)
+
+    # Si solo algunos CUITs tienen la version del periodo la base no es la que dejo update_cuits
+    sin_cambios = insert_1.loc[~insert_1['nu_cuit'].isin(rns_update['nu_cuit']), :].iloc[[0], :]
+    with pytest.raises(ValueError):
+        ck.update_en_base(periodo, pd.concat([rns_update, sin_cambios], ignore_index= True))
+
+    checkpoint.marco('update')
+    checkpoint.borro()
+
+    registros = leo_registros()
+    del_periodo = registros.loc[registros['cd_periodo_proceso'] == periodo, 'nu_cuit']
+    vigentes = registros.loc[pd.to_datetime(registros['fh_fin_registro']) == pd.Timestamp('2100-12-31'), 'nu_cuit']
+
+    assert not registros.duplicated(['nu_cuit', 'cd_periodo_proceso']).any()
+    assert sorted(del_periodo) == sorted(pd.concat([rns_insert['nu_cuit'], rns_update['nu_cuit']]))
+    assert vigentes.is_unique and vigentes.shape[0] == insert_1.shape[0] + n
+    assert registros.shape[0] == insert_1.shape[0] + n + rns_update.shape[0]
@@ -0,0 +1,159 @@
+import io
+import os
+import re
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import download_files_functions as dw
+
+
+def armo_zip(texto):
+    salida = io.BytesIO()
+    with zipfile.ZipFile(salida, 'w') as zipf:
+        zipf.writestr('registro-nacional-sociedades-202101.csv', texto * 2000)
+    return salida.getvalue()
+
+
+class servidor_zip(BaseHTTPRequestHandler):
+
+    '''
+        Sirve un zip con ETag como el servidor de datos: 304 con If-None-Match, 206 con Range (si If-Range coincide),
+        416 si el rango empieza en el final y 200 con todo el archivo si If-Range no coincide
+    '''
+
+    contenido = b''
+    etag = '"1"'
+    pedidos = []
+
+    def do_GET(self):
+        cls = type(self)
+        cls.pedidos.append(dict(self.headers))
+        rango = re.findall(r'bytes=(\d+)-', self.headers.get('Range', ''))
+
+        if self.headers.get('If-None-Match') == cls.etag:
+            self.send_response(304)
+            self.end_headers()
+        elif rango and self.headers.get('If-Range', cls.etag) == cls.etag:
+            desde = int(rango[0])
+            if desde >= len(cls.contenido):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(cls.contenido)}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('ETag', cls.etag)
+            self.send_header('Content-Range', f'bytes {desde}-{len(cls.contenido)-1}/{len(cls.contenido)}')
+            self.send_header('Content-Length', str(len(cls.contenido) - desde))
+            self.end_headers()
+            self.wfile.write(cls.contenido[desde:])
+        else:
+            self.send_response(200)
+            self.send_header('ETag', cls.etag)
+            self.send_header('Content-Length', str(len(cls.contenido)))
+            self.end_headers()
+            self.wfile.write(cls.contenido)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def descarga(tmp_path, monkeypatch):
+
+    '''
+        Servidor local con un zip y carpeta data/zip vacia en tmp_path. Devuelvo (url, zip_file, servidor)
+    '''
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data/zip')
+
+    servidor_zip.contenido = armo_zip('a,b,c\n')
+    servidor_zip.etag = '"1"'
+    servidor_zip.pedidos = []
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), servidor_zip)
+    hilo = threading.Thread(target= servidor.serve_forever, daemon= True)
+    hilo.start()
+
+    yield f'http://127.0.0.1:{servidor.server_port}/registro-nacional-sociedades-2021.zip', 'data/zip/registro-nacional-sociedades-2021.zip', servidor_zip
+
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def test_304_no_vuelve_a_descargar(descarga):
+
+    url, zip_file, servidor = descarga
+
+    assert dw.descargo_archivo(url, zip_file) == (zip_file, True)
+    assert dw.descargo_archivo(url, zip_file) == (zip_file, False)
+    assert servidor.pedidos[-1]['If-None-Match'] == servidor.etag
+
+
+def test_206_reanudo_descarga_cortada(descarga):
+
+    url, zip_file, servidor = descarga
+    with open(zip_file + '.part', 'wb') as f:
+        f.write(servidor.contenido[:1000])
+    dw.actualizo_cache_descargas(url, {'etag': servidor.etag, 'completo': False})
+
+    assert dw.descargo_archivo(url, zip_file) == (zip_file, True)
+    assert servidor.pedidos[-1]['Range'] == 'bytes=1000-'
+    with open(zip_file, 'rb') as f:
+        assert f.read() == servidor.contenido
+
+
+@pytest.mark.parametrize('corrupto', [False, True])
+def test_416_verifico_el_part(descarga, corrupto):
+
+    # El .part tiene todos los bytes pero se corto antes de verificarlo: sano lo dejo en su lugar, corrupto lo bajo de cero
+    url, zip_file, servidor = descarga
+    with open(zip_file + '.part', 'wb') as f:
+        f.write(servidor.contenido if not corrupto else b'x' * len(servidor.contenido))
+    dw.actualizo_cache_descargas(url, {'etag': servidor.etag, 'completo': False})
+
+    assert dw.descargo_archivo(url, zip_file, reintentos= 1) == (zip_file, True)
+    assert not os.path.exists(zip_file + '.part')
+    assert len(servidor.pedidos) == (2 if corrupto else 1)
+    with open(zip_file, 'rb') as f:
+        assert f.read() == servidor.contenido
+    assert dw.cargo_cache_descargas()[url]['completo']
+
+
+def test_etag_cambiado_descargo_todo(descarga):
+
+    # El archivo cambio en el servidor: If-Range no coincide y el .part viejo se reemplaza con el archivo nuevo
+    url, zip_file, servidor = descarga
+    with open(zip_file + '.part', 'wb') as f:
+        f.write(servidor.contenido[:1000])
+    dw.actualizo_cache_descargas(url, {'etag': servidor.etag, 'completo': False})
+
+    servidor.contenido = armo_zip('d,e,f\n')
+    servidor.etag = '"2"'
+
+    assert dw.descargo_archivo(url, zip_file) == (zip_file, True)
+    assert servidor.pedidos[-1]['If-Range'] == '"1"'
+    with open(zip_file, 'rb') as f:
+        assert f.read() == servidor.contenido
+    assert dw.cargo_cache_descargas()[url]['etag'] == '"2"'
+
+
+@pytest.mark.parametrize('ultimo, esperados, proximo', [
+    ('202103', ['2021-semestre-1', '2021-semestre-2', '2022', '2023-semestre-1'], '202104'),
+    ('202106', ['2021-semestre-2', '2022', '2023-semestre-1'], '202107'),
+    ('202112', ['2022', '2023-semestre-1'], '202201'),
+    ('202208', ['2022', '2023-semestre-1'], '202209'),
+    ('202306', [], '202307')])
+def test_planeo_descargas(ultimo, esperados, proximo):
+
+    # Años con zips por semestre y un año entero: el primer semestre se saltea solo si el proximo periodo es posterior a junio
+    # y los años anteriores al del proximo periodo no se bajan
+    pagina = 'https://datos.jus.gob.ar/dataset/registro-nacional-de-sociedades/archivo/registro-nacional-sociedades-{}.zip'
+    zips = [pagina.format(zip_anio) for zip_anio in ['2023-semestre-1', '2021-semestre-2', '2020', '2022', '2021-semestre-1']]
+
+    url_zips, next_period_to_update = dw.planeo_descargas(zips, ultimo)
+
+    assert next_period_to_update == proximo
+    assert url_zips == [pagina.format(zip_anio) for zip_anio in esperados]
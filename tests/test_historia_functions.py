@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import historia_functions as hs
+
+
+def test_busco_version_vigente_en_cada_fecha():
+
+    # Un CUIT con dos versiones seguidas y otro con una sola version cerrada que empieza tarde
+    historia = pd.DataFrame({'nu_cuit': [30000000001, 30000000002, 30000000001],
+                             'fh_inicio_registro': pd.to_datetime(['2021-03-01', '2021-05-01', '1900-01-01']),
+                             'fh_fin_registro': pd.to_datetime(['2100-12-31', '2021-05-31', '2021-02-28']),
+                             'nb_razon_social': ['a nueva', 'b', 'a vieja'],
+                             'cd_tipo_societario': pd.array([1, 2, 1], dtype= 'Int16')})
+    indice = hs.indice_historia(historia)
+
+    consultas = [(30000000001, '2021-02-28', 'a vieja'),   # fh_fin_registro igual a la fecha
+                 (30000000001, '2021-03-01', 'a nueva'),
+                 (30000000001, '2150-01-01', None),        # despues de la vigente
+                 (30000000002, '2021-04-30', None),        # antes de la primera version
+                 (30000000002, '2021-05-31', 'b'),
+                 (30000000002, '2021-06-01', None),        # despues de la version cerrada
+                 (30000000003, '2021-03-01', None),        # CUIT que no esta
+                 (20000000000, '2021-03-01', None),        # CUIT menor que todos
+                 ('abc', '2021-03-01', None),              # CUIT invalido
+                 (30000000001, None, None)]                # sin fecha
+    cuits, fechas, esperadas = zip(*consultas)
+
+    posiciones = indice.posiciones(cuits, fechas)
+    assert [posicion >= 0 for posicion in posiciones] == [esperada is not None for esperada in esperadas]
+
+    versiones = indice.busco(cuits, fechas, posiciones= posiciones)
+    assert versiones.shape[0] == len(consultas)
+    assert versiones['nb_razon_social'].where(versiones['nb_razon_social'].notnull(), None).tolist() == list(esperadas)
+    assert versiones.loc[versiones['nb_razon_social'].isnull(), ['fh_inicio_registro', 'fh_fin_registro', 'cd_tipo_societario']].isnull().all().all()
+    assert versiones['cd_tipo_societario'].tolist()[:2] == [1, 1]
+
+    # La fila vacia de los que no tienen version es siempre la ultima del indice y las posiciones no cambian
+    assert np.array_equal(posiciones, indice.posiciones(cuits, fechas))
+    assert indice.tabla.shape[0] == len(indice) + 1
+    assert versiones['nu_cuit'].isnull().tolist() == [cuit == 'abc' for cuit in cuits]
+    assert versiones['fecha'].isnull().tolist() == [fecha is None for fecha in fechas]
+
+    # Sin posiciones busco lo mismo
+    pd.testing.assert_frame_equal(indice.busco(cuits, fechas, columnas= ['nb_razon_social']),
+                                  versiones[['nu_cuit', 'fecha', 'nb_razon_social']])
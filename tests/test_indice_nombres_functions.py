@@ -0,0 +1,60 @@
+import os
+import pandas as pd
+import indice_nombres_functions as inm
+
+
+def dice(a, b):
+    a, b = inm.trigramas(a), inm.trigramas(b)
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def test_delta_borrados_y_compactacion(tmp_path):
+
+    carpeta = str(tmp_path / 'indice_nombres')
+    base = pd.DataFrame({'nu_cuit': [30000000005, 30000000001, 30000000002, 30000000003, 30000000004, 30000000006],
+                         'nb_razon_social': ['transportes del norte sa', 'panaderia el sol sa', 'panaderia el sol del sur srl',
+                                             'ferreteria el sol sa', 'panaderia la luna sa', None]})
+    inm.construyo_indice_nombres(base, 202101, carpeta)
+    indice = inm.indice_nombres(carpeta)
+    assert len(indice) == 5
+
+    # Ranking por Dice entre los trigramas de la busqueda y los de cada nombre
+    resultados = indice.busco('Panaderia  El SOL', k= 3, similitud_minima= 0.2)
+    esperados = sorted(((dice('panaderia el sol', nombre), cuit) for cuit, nombre in base.dropna().itertuples(index= False)
+                        if dice('panaderia el sol', nombre) >= 0.2), key= lambda x: (-x[0], x[1]))[:3]
+    assert resultados['nu_cuit'].tolist() == [cuit for _, cuit in esperados]
+    assert resultados['similitud'].round(10).tolist() == [round(similitud, 10) for similitud, _ in esperados]
+    assert resultados['nu_cuit'].iloc[0] == 30000000001
+    assert indice.busco('panaderia el sol sa')['similitud'].iloc[0] == 1
+
+    # Periodo siguiente: un CUIT cambia de nombre, uno nuevo y uno que queda igual
+    resumen = indice.actualizo(pd.DataFrame({'nu_cuit': [30000000001, 30000000007, 30000000003],
+                                             'nb_razon_social': ['confiteria la estrella sa', 'panaderia el sol sas', 'ferreteria el sol sa']}),
+                               202102, fraccion_compactacion= 1)
+    assert resumen['nombres_nuevos'] == 2 and resumen['registros_delta'] == 2 and not resumen['compactado']
+    assert indice.borrados.tolist() == [0]
+    assert len(indice) == 6 and indice.periodo == 202102
+    assert indice.nombres_actuales(pd.Series([30000000001, 30000000003, 30000000006]).to_numpy()) == \
+           ['confiteria la estrella sa', 'ferreteria el sol sa', None]
+
+    # El nombre viejo ya no se encuentra, el nuevo si (en el delta)
+    assert 30000000001 not in indice.busco('panaderia el sol sa', k= 10, similitud_minima= 0.9)['nu_cuit'].tolist()
+    assert indice.busco('confiteria la estrella')['nu_cuit'].tolist()[:1] == [30000000001]
+    assert indice.busco('panaderia el sol sas')[['nu_cuit', 'similitud']].iloc[0].tolist() == [30000000007, 1]
+
+    # Un CUIT del delta que vuelve a cambiar se reemplaza en el delta
+    indice.actualizo(pd.DataFrame({'nu_cuit': [30000000007], 'nb_razon_social': ['panificadora el sol sas']}), 202103, fraccion_compactacion= 1)
+    assert indice.delta['cuits'].tolist() == [30000000001, 30000000007]
+    antes = indice.busco('panaderia el sol', k= 10, similitud_minima= 0.1)
+
+    # Compacto: todo queda en el principal, sin borrados, con las mismas busquedas y solo los archivos de la version nueva
+    resumen = indice.actualizo(pd.DataFrame({'nu_cuit': [30000000008], 'nb_razon_social': ['molinos del sur sa']}), 202104,
+                               fraccion_compactacion= 0)
+    assert resumen['compactado'] and resumen['registros_delta'] == 0
+    assert indice.borrados.shape[0] == 0 and indice.principal['cuits'].shape[0] == len(indice) == 7
+    despues = indice.busco('panaderia el sol', k= 10, similitud_minima= 0.1)
+    pd.testing.assert_frame_equal(despues.loc[despues['nu_cuit'] != 30000000008, :].reset_index(drop= True), antes)
+
+    version = indice.actual['version']
+    assert sorted(os.listdir(carpeta)) == sorted(['ACTUAL.json', f'principal_{version}', f'delta_{version}', f'borrados_{version}.npy'])
+    assert inm.indice_nombres(carpeta).busco('molinos del sur')['nu_cuit'].tolist()[:1] == [30000000008]
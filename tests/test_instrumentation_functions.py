@@ -0,0 +1,39 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import instrumentation_functions as ins
+import process_file_functions as pf
+import backend_functions as bk
+
+
+def test_pasos_de_la_preparacion_se_miden_en_su_proceso(archivo_rns, backend_embebido, tmp_path):
+
+    # La preparacion corre en otro proceso: sus pasos se miden y se perfilan alla. Sin lookups el proceso los baja
+    # de la base en el paso que codifica (una conexion y tres execute)
+    path, periodo, _ = archivo_rns(2000)
+
+    with ProcessPoolExecutor(max_workers= 1, initializer= pf.inicio_preparacion, initargs= ({}, {}, None, 'Proceso Columnas')) as preparador:
+        _, resumen = preparador.submit(pf.preparo_periodo_en_proceso, path, periodo, False).result()
+
+    mediciones = resumen['tiempos_pasos']
+    assert len(mediciones) == len(resumen['pasos']) == 4
+    assert all({'segundos', 'segundos_cpu', 'rss_pico_delta_mb', 'llamadas_bd'} <= set(medicion) for medicion in mediciones)
+    assert [medicion['llamadas_bd'] for medicion in mediciones] == [0, 0, 0, 4]
+
+    assert [i for i, medicion in enumerate(mediciones) if 'perfil' in medicion] == [1]
+    with open(mediciones[1]['perfil'][:-len('.prof')] + '.txt') as f:
+        assert 'proceso_columnas' in f.read()
+
+    # En el proceso principal los pasos se loguean con lo medido en la preparacion y no se vuelven a perfilar
+    log = ins.log_instrumentado(bk.log_sin_mysql('prueba', 'empresas'), paso_perfilado= 'Proceso Columnas',
+                                carpeta_perfiles= str(tmp_path / 'perfiles'))
+    log.update_log_procesos()
+    log.inicio_periodo(periodo)
+    for (step_name, registros), medicion in zip(resumen['pasos'], mediciones):
+        log.log_step(step_name, medido_aparte= True)
+        log.update_log_step(step_status= 'OK', registros_procesados= registros, metricas= {**medicion, 'en_paralelo': True})
+
+    resumen_periodo = log.resumen_periodo()
+    assert [paso['llamadas_bd'] for paso in resumen_periodo['pasos']] == [0, 0, 0, 4]
+    assert resumen_periodo['total']['llamadas_bd'] == 4
+    assert resumen_periodo['pasos'][1]['perfil'] == mediciones[1]['perfil']
+    assert not os.path.exists(tmp_path / 'perfiles')
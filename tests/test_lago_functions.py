@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import benchmark_functions as bmk
+import process_file_functions as pf
+import historia_functions as hf
+import lago_functions as lg
+from test_backend_functions import corro_periodo
+
+
+def ordeno(filas, orden):
+    filas = filas.sort_values(orden, kind= 'stable').reset_index(drop= True)
+    return filas.astype({col: 'object' for col in filas.columns if isinstance(filas[col].dtype, pd.CategoricalDtype)})
+
+
+def test_lago_particionado_ida_y_vuelta(archivo_rns, backend_embebido, tmp_path):
+
+    # Tres periodos exportados al lago como en app.py (el primero lo arma desde la historia) y el mismo lago armado
+    # de una vez desde la historia en la base
+    carpeta_periodos = str(tmp_path / 'lago_periodos')
+    carpeta = str(tmp_path / 'lago')
+    periodos = []
+
+    for periodo, data in bmk.genero_periodos_rns(1500, 3, p_cambios= 0.1, p_altas= 0.05):
+        path, periodo, _ = archivo_rns(data= data, periodo= periodo)
+        rns_insert, rns_update, _ = corro_periodo(path, periodo, 'digest', None)
+        lg.exporto_periodo_lago(rns_insert, rns_update, periodo, carpeta_periodos)
+        periodos.append(periodo)
+
+    # Vuelvo a exportar el ultimo periodo: reemplaza la particion, no duplica filas
+    resumen = lg.exporto_periodo_lago(rns_insert, rns_update, periodo, carpeta_periodos)
+    assert resumen['alta'] == rns_insert.shape[0] and resumen['cambio'] == resumen['cierre'] == rns_update.shape[0]
+
+    historia = hf.descargo_historia([col for col in pf.esquema_registro if col not in ('nu_cuit', 'fh_inicio_registro', 'fh_fin_registro')])
+    resumen = lg.construyo_lago(historia, carpeta)
+
+    assert sorted(resumen) == periodos == lg.periodos_lago(carpeta) == lg.periodos_lago(carpeta_periodos)
+    assert sum(particion['alta'] + particion['cambio'] for particion in resumen.values()) == historia.shape[0]
+
+    filas = lg.leo_lago(carpeta= carpeta)
+    assert list(filas.columns) == list(lg.esquema_lago().names) + ['cd_periodo_proceso']
+    assert all(filas[col].dtype == tipo for col, tipo in pf.esquema_registro.items())
+    orden = ['cd_periodo_proceso', 'tx_novedad', 'nu_cuit']
+    pd.testing.assert_frame_equal(ordeno(lg.leo_lago(carpeta= carpeta_periodos), orden), ordeno(filas, orden))
+
+    # Con las versiones y los cierres vuelvo a la historia: cada cierre es el fin de la version anterior del CUIT
+    versiones = filas.loc[filas['tx_novedad'] != 'cierre', :].drop(columns= 'tx_novedad')
+    versiones = versiones.sort_values(['nu_cuit', 'fh_inicio_registro']).reset_index(drop= True)
+    cierres = filas.loc[filas['tx_novedad'] == 'cierre', :].sort_values(['nu_cuit', 'fh_fin_registro'])
+
+    cuits = versiones['nu_cuit'].to_numpy()
+    cerradas = np.flatnonzero(np.append(cuits[1:] == cuits[:-1], False))
+    assert np.array_equal(cuits[cerradas], cierres['nu_cuit'].to_numpy())
+    versiones.loc[cerradas, 'fh_fin_registro'] = cierres['fh_fin_registro'].to_numpy()
+
+    orden = ['nu_cuit', 'fh_inicio_registro']
+    pd.testing.assert_frame_equal(ordeno(versiones[historia.columns], orden), ordeno(historia, orden))
+
+    # Filtros por periodo, novedad y columna: solo lee lo que corresponde
+    cambios = lg.leo_lago(columnas= ['nu_cuit', 'cd_provincia_dom_fiscal'], desde= periodos[1], hasta= periodos[1], novedad= ['cambio'],
+                          carpeta= carpeta)
+    esperados = filas.loc[(filas['cd_periodo_proceso'] == periodos[1]) & (filas['tx_novedad'] == 'cambio'), :]
+    assert list(cambios.columns) == ['nu_cuit', 'cd_provincia_dom_fiscal', 'cd_periodo_proceso']
+    assert esperados.shape[0] > 0 and sorted(cambios['nu_cuit']) == sorted(esperados['nu_cuit'])
+
+    provincia = int(filas['cd_provincia_dom_fiscal'].dropna().iloc[0])
+    de_provincia = lg.leo_lago(columnas= ['nu_cuit'], filtros= [('cd_provincia_dom_fiscal', '=', provincia)], carpeta= carpeta)
+    assert sorted(de_provincia['nu_cuit']) == sorted(filas.loc[filas['cd_provincia_dom_fiscal'] == provincia, 'nu_cuit'])
@@ -0,0 +1,28 @@
+import os
+import pandas as pd
+import benchmark_functions as bmk
+import prefiltro_functions as pfl
+import utils_file_functions as uf
+
+
+def test_filtro_escribe_a_disco(archivo_rns, lookups_sinteticos, tmp_path):
+
+    # Los registros a procesar quedan en un .csv temporal en disco que se lee por chunks como el original
+    prefiltro = pfl.prefiltro_lineas(str(tmp_path / 'prefiltro'))
+
+    for periodo, data in bmk.genero_periodos_rns(3000, 2, p_cambios= 0.05):
+        path, periodo, _ = archivo_rns(data= data, periodo= periodo)
+        archivo, resumen = prefiltro.filtro(path, periodo, lookups_sinteticos)
+
+        assert archivo.fileno() >= 0
+        with archivo:
+            skip, headers = uf.check_headers(archivo)
+            chunks = pd.read_csv(archivo, header= None, names= headers, skiprows= skip, dtype= 'object', chunksize= 500)
+            registros = sum(chunk.shape[0] for chunk in chunks)
+
+        assert registros == resumen['registros_a_procesar']
+
+    assert 0 < resumen['registros_a_procesar'] < resumen['registros']
+
+    # Al cerrarlos no queda ningun temporal en la carpeta del prefiltro
+    assert sorted(os.listdir(tmp_path / 'prefiltro')) == [f'cuits_faltantes_{p}.csv' for p in [periodo - 1, periodo]]
@@ -0,0 +1,263 @@
+import threading
+import pytest
+import pandas as pd
+import process_file_functions as pf
+
+
+def test_digest_cuit_repetido_en_vigente(archivo_rns, lookups_sinteticos):
+
+    # Un archivo viejo con un CUIT repetido dejo dos registros vigentes del mismo CUIT
+    path, periodo, _ = archivo_rns()
+    base, _ = pf.preparo_periodo(path, periodo, False)
+
+    digest_actual = pd.DataFrame({'nu_cuit': base['nu_cuit'], 'nu_digest': pf.calculo_digest(base)})
+    repetido = digest_actual.iloc[[0],:].assign(nu_digest= 1)
+    digest_actual = pd.concat([digest_actual, repetido], ignore_index= True)
+
+    base_insert, base_update = pf.base_final_para_actualizar_digest(base, digest_actual, 1, periodo)
+
+    assert base_insert.shape[0] == 0
+    assert base_update['nu_cuit'].tolist() == [base['nu_cuit'].iloc[0]]
+
+
+def test_digest_cuit_repetido_en_archivo(archivo_rns, lookups_sinteticos):
+
+    # El archivo trae dos veces el mismo CUIT (en lotes distintos): se inserta una sola vez, con el ultimo registro
+    path, periodo, data = archivo_rns(2500)
+    repetido = data.iloc[[0],:].assign(razon_social= 'OTRA RAZON SOCIAL SA')
+    path, periodo, _ = archivo_rns(data= pd.concat([data, repetido], ignore_index= True), periodo= periodo)
+
+    vacia = pd.DataFrame({'nu_cuit': pd.Series([], dtype= 'int64'), 'nu_digest': pd.Series([], dtype= 'int64')})
+
+    for lectura_por_lotes in [False, True]:
+        base, _ = pf.preparo_periodo(path, periodo, lectura_por_lotes, memoria_maxima_mb= 1)
+        cuits = base.estado['nu_cuit'] if lectura_por_lotes else base['nu_cuit']
+        base_insert, base_update = pf.base_final_para_actualizar_digest(base, vacia, 1, periodo)
+        if lectura_por_lotes:
+            assert base.lotes > 1
+            base.borro()
+
+        assert not cuits.is_unique
+        assert base_insert['nu_cuit'].is_unique
+        assert set(base_insert['nu_cuit']) == set(cuits)
+        assert base_insert.loc[base_insert['nu_cuit'] == int(data['cuit'].iloc[0]), 'nb_razon_social'].tolist() == ['otra razon social sa']
+        assert base_update.shape[0] == 0
+
+
+def test_sql_igual_a_digest(archivo_rns, backend_embebido):
+
+    # Cargo un periodo y comparo el siguiente (con un cambio solo de tildes) en modo 'sql' y 'digest'
+    path, periodo, data = archivo_rns()
+    base, _ = pf.preparo_periodo(path, periodo, False)
+    base_insert, _ = pf.base_final_para_actualizar_digest(base, pf.descargo_digest_mysql(), 1, periodo)
+    assert pf.inserto_cuits(base_insert, 'empresas') == 1
+
+    data = data.copy()
+    data.loc[0, 'razon_social'] = data.loc[0, 'razon_social'].replace('A', 'Á', 1)
+    path, periodo, _ = archivo_rns(data= data, periodo= 202102)
+    base, _ = pf.preparo_periodo(path, periodo, False)
+
+    sql_insert, sql_update = pf.base_final_para_actualizar_sql(base, 2, periodo)
+    digest_insert, digest_update = pf.base_final_para_actualizar_digest(base, pf.descargo_digest_mysql(), 2, periodo)
+
+    assert sql_insert.shape[0] == digest_insert.shape[0] == 0
+    assert sql_update['nu_cuit'].tolist() == digest_update['nu_cuit'].tolist() == [int(data.loc[0, 'cuit'])]
+    assert sql_update['nu_digest'].tolist() == digest_update['nu_digest'].tolist()
+
+    mysql = pf.make_mysql_connection('step')
+    with mysql.cursor() as cur:
+        cur.execute('select count(*) from novedad_registro_sociedades')
+        assert cur.fetchone()[0] == 0
+    mysql.close()
+
+
+def test_preparo_periodos_en_proceso(archivo_rns, lookups_sinteticos, tmp_path):
+
+    # Dos periodos preparados en orden en otro proceso: el segundo se filtra contra el estado del primero
+    import benchmark_functions as bmk
+    import prefiltro_functions as pfl
+    from concurrent.futures import ProcessPoolExecutor
+
+    archivos = [archivo_rns(data= data, periodo= periodo)[:2] for periodo, data in bmk.genero_periodos_rns(500, 2)]
+    prefiltro = pfl.prefiltro_lineas(str(tmp_path / 'prefiltro'))
+
+    with ProcessPoolExecutor(max_workers= 1, initializer= pf.inicio_preparacion,
+                             initargs= (dict(lookups_sinteticos), {}, prefiltro)) as preparador:
+        preparaciones = [preparador.submit(pf.preparo_periodo_en_proceso, path, periodo, False) for path, periodo in archivos]
+        resultados = [preparacion.result() for preparacion in preparaciones]
+
+    (base, resumen), (base_siguiente, resumen_siguiente) = resultados
+    pf.agrego_preparacion(resumen, archivos[0][1], prefiltro)
+
+    esperada, _ = pf.preparo_periodo(*archivos[0], False)
+    pd.testing.assert_frame_equal(base.reset_index(drop= True), esperada.reset_index(drop= True))
+
+    assert prefiltro.estado(archivos[0][1]) is not None
+    assert 'diccionario_nuevo' not in resumen and 'estado_prefiltro' not in resumen
+    assert resumen_siguiente['prefiltro']['periodo_anterior'] == archivos[0][1]
+    assert resumen_siguiente['prefiltro']['registros_sin_cambios'] > 0
+    assert base_siguiente.shape[0] < base.shape[0]
+
+
+class conexion_falsa:
+
+    '''
+        Conexion a MySql en memoria: executemany deja los registros pendientes hasta el commit y falla en las
+        llamadas de fallas (contadas entre todas las conexiones)
+    '''
+
+    commiteados = []
+    llamadas = 0
+    fallas = set()
+    lock = threading.Lock()
+
+    def __init__(self, database):
+        self.open = True
+        self.pendientes = []
+
+    def cursor(self):
+        conexion = self
+
+        class cursor:
+            rowcount = 0
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def executemany(self, sql, valores):
+                with conexion_falsa.lock:
+                    conexion_falsa.llamadas += 1
+                    if conexion_falsa.llamadas in conexion_falsa.fallas:
+                        raise RuntimeError('Lost connection to MySQL server during query')
+                conexion.pendientes += valores
+                self.rowcount = len(valores)
+
+        return cursor()
+
+    def commit(self):
+        with conexion_falsa.lock:
+            conexion_falsa.commiteados += self.pendientes
+        self.pendientes = []
+
+    def rollback(self):
+        self.pendientes = []
+
+    def close(self):
+        self.open = False
+
+
+@pytest.mark.parametrize('fallas, hechos, resultado', [(set(), None, 1), ({2}, None, 1), ({2}, [(10000, 20000)], 1),
+                                                       (set(range(1, 10)), None, 0)])
+def test_inserto_cuits_paralelo(monkeypatch, fallas, hechos, resultado):
+
+    # Los chunks que fallan se reintentan con otra conexion y cada uno queda commiteado una sola vez. Si un chunk
+    # agota los reintentos el resultado es 0
+    monkeypatch.setattr(pf, 'make_mysql_connection', conexion_falsa)
+    monkeypatch.setattr(pf.time, 'sleep', lambda segundos: None)
+    conexion_falsa.commiteados, conexion_falsa.llamadas, conexion_falsa.fallas = [], 0, fallas
+
+    data = pd.DataFrame({'nu_cuit': range(30000000000, 30000025000), 'nb_razon_social': 'a'})
+    commiteados = []
+    stats = {}
+
+    assert pf.inserto_cuits_paralelo(data, 'empresas', n_conexiones= 2, reintentos= 2, stats= stats, hechos= hechos,
+                                     al_commitear= lambda desde, hasta: commiteados.append((desde, hasta))) == resultado
+    assert stats['metodo'] == 'paralelo' and stats['registros'] == data.shape[0]
+
+    esperados = data['nu_cuit'].tolist()
+    if hechos:
+        esperados = esperados[:10000] + esperados[20000:]
+
+    if resultado == 1:
+        assert sorted(cuit for cuit, _ in conexion_falsa.commiteados) == esperados
+        assert sorted(commiteados) == [rango for rango in [(0, 10000), (10000, 20000), (20000, 25000)] if not hechos or rango != hechos[0]]
+    else:
+        assert conexion_falsa.commiteados == [] and commiteados == []
+
+
+def test_inserto_cuits_paralelo_registros_distintos(monkeypatch):
+
+    # Si el motor informa menos registros que los mandados no doy la carga por buena
+    class conexion_corta(conexion_falsa):
+        def cursor(self):
+            cur = conexion_falsa.cursor(self)
+            executemany = cur.executemany
+
+            def executemany_corto(sql, valores):
+                executemany(sql, valores)
+                cur.rowcount = len(valores) - 1
+
+            cur.executemany = executemany_corto
+            return cur
+
+    monkeypatch.setattr(pf, 'make_mysql_connection', conexion_corta)
+    conexion_falsa.commiteados, conexion_falsa.llamadas, conexion_falsa.fallas = [], 0, set()
+
+    assert pf.inserto_cuits_paralelo(pd.DataFrame({'nu_cuit': range(100), 'nb_razon_social': 'a'}), 'empresas') == 0
+    assert pf.inserto_cuits_paralelo(pd.DataFrame({'nu_cuit': []}), 'empresas') == -1
+
+
+def test_cache_lookups(backend_embebido, monkeypatch):
+
+    # Los lookups se descargan una vez y quedan en cache hasta invalidarla (o forzar la descarga)
+    lookups = {tabla: dict(lookup) for tabla, lookup in pf._cache_lookups.items()}
+    conexiones = []
+    make_connection = pf.make_mysql_connection
+    monkeypatch.setattr(pf, 'make_mysql_connection', lambda database: conexiones.append(database) or make_connection(database))
+
+    pf.invalido_cache_lookups()
+    assert pf.descargo_lookups() == lookups
+    assert pf.descargo_lookups() is pf._cache_lookups
+    assert len(conexiones) == 1
+
+    # Un valor nuevo en la base no se ve hasta invalidar la cache
+    nuevos = {**lookups, 'provincia': {**lookups['provincia'], 'tierra del fuego antartida': 99}}
+    backend_embebido.cargo_lookups_embebido(nuevos)
+    assert 'tierra del fuego antartida' not in pf.descargo_lookups()['provincia']
+    assert len(conexiones) == 1
+
+    pf.invalido_cache_lookups()
+    assert pf.descargo_lookups()['provincia']['tierra del fuego antartida'] == 99
+    assert len(conexiones) == 2
+
+    backend_embebido.cargo_lookups_embebido(lookups)
+    assert pf.descargo_lookups(forzar= True) == lookups
+    assert len(conexiones) == 3
+
+
+def test_aplico_esquema(archivo_rns, lookups_sinteticos):
+
+    # Registros como vienen de MySql: enteros como Decimal o texto, fechas como date o texto y nulos como None
+    from datetime import date
+    from decimal import Decimal
+
+    filas = pd.DataFrame({col: [None, None, None] for col in pf.esquema_registro})
+    filas['nu_cuit'] = [Decimal('30000000001'), '30000000002', 30000000003]
+    filas['cd_tipo_societario'] = [Decimal('10'), None, '11']
+    filas['cd_postal_dom_fiscal'] = [1.6, 'abc', 2 ** 63]
+    filas['nu_digest'] = [Decimal('-9223372036854775807'), '9223372036854775807', None]
+    filas['fh_contrato_social'] = [date(2020, 1, 31), '2021-02-01', 'no es fecha']
+    filas['nb_localidad_dom_fiscal'] = ['rosario', None, 'rosario']
+    filas['otra_columna'] = ['a', 1, None]
+
+    tipada = pf.aplico_esquema(filas)
+
+    assert {col: str(tipo) for col, tipo in tipada.dtypes.items() if col in pf.esquema_registro} == pf.esquema_registro
+    assert tipada['nu_cuit'].tolist() == [30000000001, 30000000002, 30000000003]
+    for col, valores in [('cd_tipo_societario', [10, None, 11]), ('cd_postal_dom_fiscal', [2, None, None]),
+                         ('nu_digest', [-9223372036854775807, 9223372036854775807, None])]:
+        pd.testing.assert_series_equal(tipada[col], pd.Series(valores, dtype= pf.esquema_registro[col], name= col))
+    assert tipada['fh_contrato_social'].tolist()[:2] == [pd.Timestamp('2020-01-31'), pd.Timestamp('2021-02-01')]
+    assert pd.isnull(tipada['fh_contrato_social'].iloc[2])
+    assert list(tipada['nb_localidad_dom_fiscal'].cat.categories) == ['rosario']
+    assert tipada['otra_columna'].dtype == 'object' and tipada['otra_columna'].tolist() == ['a', 1, None]
+
+    # Ya tipada queda igual y la base preparada de un archivo tiene los mismos tipos
+    pd.testing.assert_frame_equal(pf.aplico_esquema(tipada), tipada)
+
+    path, periodo, _ = archivo_rns()
+    base, _ = pf.preparo_periodo(path, periodo, False)
+    assert all(str(tipo) == pf.esquema_registro[col] for col, tipo in base.dtypes.items() if col in pf.esquema_registro)
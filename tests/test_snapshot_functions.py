@@ -0,0 +1,71 @@
+import os
+import pandas as pd
+import process_file_functions as pf
+import snapshot_functions as sf
+
+
+def test_periodo_sin_novedades_no_vence_el_snapshot(archivo_rns, backend_embebido, tmp_path):
+
+    path_snapshot = str(tmp_path / 'snapshot' / 'registro_sociedades_vigente.parquet')
+
+    path, periodo, data = archivo_rns()
+    base, _ = pf.preparo_periodo(path, periodo, False)
+    base_insert, base_update = pf.base_final_para_actualizar_digest(base, pf.descargo_digest_mysql(), 1, periodo)
+    assert pf.inserto_cuits(base_insert, 'empresas') == 1
+
+    vigente = sf.descargo_base_vigente(path_snapshot)
+    assert sf.periodo_mysql_snapshot(path_snapshot) == periodo
+
+    # El periodo siguiente trae el mismo archivo: no hay novedades y MySql no cambia
+    path, siguiente, _ = archivo_rns(data= data, periodo= 202102)
+    base, _ = pf.preparo_periodo(path, siguiente, False)
+    base_insert, base_update = pf.base_final_para_actualizar_digest(base, pf.descargo_digest_mysql(), 2, siguiente)
+    assert base_insert.shape[0] == base_update.shape[0] == 0
+
+    vigente = sf.aplico_novedad(vigente, base_insert, base_update)
+    sf.guardo_snapshot_periodo(vigente, base_insert, base_update, siguiente, path_snapshot)
+
+    assert sf.leo_snapshot(path_snapshot)[1] == siguiente
+    assert sf.periodo_mysql_snapshot(path_snapshot) == pf.descargo_ultimo_periodo_mysql() == periodo
+    assert sf.descargo_base_vigente(path_snapshot).shape[0] == vigente.shape[0]
+    assert sf.leo_snapshot(path_snapshot)[1] == siguiente
+
+
+
+def test_actualizo_snapshot_sin_cargar_la_base(archivo_rns, backend_embebido, tmp_path):
+
+    # En modo 'digest' el snapshot se actualiza en disco y el indice por CUIT se arma desde el snapshot: tienen que
+    # quedar igual que la base vigente en memoria y que MySql
+    import benchmark_functions as bmk
+    import indice_cuit_functions as ic
+
+    path_snapshot = str(tmp_path / 'snapshot' / 'registro_sociedades_vigente.parquet')
+    vigente = None
+
+    for periodo, data in bmk.genero_periodos_rns(1500, 3, p_cambios= 0.1, p_altas= 0.05):
+        path, periodo, _ = archivo_rns(data= data, periodo= periodo)
+        base, _ = pf.preparo_periodo(path, periodo, False)
+        base_insert, base_update = pf.base_final_para_actualizar_digest(base, pf.descargo_digest_mysql(), periodo, periodo)
+        assert pf.inserto_cuits(base_insert, 'empresas') != 0
+        assert pf.update_cuits(base_update) != 0
+
+        if vigente is not None:
+            anteriores = sf.leo_snapshot_cuits(base_update['nu_cuit'], periodo, path_snapshot)
+            assert sorted(anteriores['nu_cuit']) == sorted(base_update['nu_cuit'])
+            vigente = sf.aplico_novedad(vigente, base_insert, base_update)
+        else:
+            vigente = pf.descargo_base_mysql()
+
+        assert sf.actualizo_snapshot(base_insert, base_update, periodo, path_snapshot, registros_por_lote= 500)
+        assert sf.periodo_snapshot(path_snapshot) == periodo
+
+    snapshot, _ = sf.leo_snapshot(path_snapshot)
+    ordeno = lambda base: base.sort_values('nu_cuit').reset_index(drop= True)
+    pd.testing.assert_frame_equal(ordeno(snapshot), ordeno(vigente), check_categorical= False)
+    pd.testing.assert_frame_equal(ordeno(snapshot), ordeno(pf.descargo_base_mysql()), check_categorical= False)
+
+    desde_snapshot = ic.indice_cuit(version= os.path.basename(ic.exporto_indice_cuit(path_snapshot, periodo, str(tmp_path / 'indice'))),
+                                    carpeta= str(tmp_path / 'indice'))
+    desde_base = ic.indice_cuit(version= os.path.basename(ic.exporto_indice_cuit(vigente, periodo, str(tmp_path / 'indice'))),
+                                carpeta= str(tmp_path / 'indice'))
+    pd.testing.assert_frame_equal(desde_snapshot.busco(vigente['nu_cuit']), desde_base.busco(vigente['nu_cuit']))
@@ -0,0 +1,76 @@
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+import utils_file_functions as uf
+import process_file_functions as pf
+
+
+def test_proceso_string_con_diccionario(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(uf, 'diccionario_normalizacion', {})
+    localidades = pd.Series(['Capital  Federal', ' CAPITAL FEDERAL', None, 'Córdoba', 'Capital  Federal', 3], name= 'localidad')
+    esperadas = ['capital federal', 'capital federal', np.nan, 'córdoba', 'capital federal', np.nan]
+
+    # Con y sin diccionario da lo mismo; el diccionario queda con los valores distintos que no son nulos
+    pd.testing.assert_series_equal(uf.proceso_string(localidades), pd.Series(esperadas, name= 'localidad', dtype= 'object'))
+    pd.testing.assert_series_equal(uf.proceso_string(localidades, uf.diccionario_normalizacion), uf.proceso_string(localidades))
+    assert list(uf.diccionario_normalizacion) == ['Capital  Federal', ' CAPITAL FEDERAL', 'Córdoba', 3]
+    assert uf.diccionario_normalizacion['Córdoba'] == 'córdoba' and pd.isnull(uf.diccionario_normalizacion[3])
+
+    # Los valores que ya estan en el diccionario no se vuelven a normalizar
+    uf.diccionario_normalizacion['Córdoba'] = 'cordoba'
+    categorica = uf.proceso_string(localidades, uf.diccionario_normalizacion, categoria= True)
+    assert list(categorica.cat.categories) == ['capital federal', 'cordoba']
+    assert categorica.astype('object').where(categorica.notnull(), None).tolist() == \
+           ['capital federal', 'capital federal', None, 'cordoba', 'capital federal', None]
+
+    # Se guarda sin los valores que no son strings y se carga en la proxima corrida
+    path = str(tmp_path / 'diccionario_normalizacion.json')
+    uf.guardo_diccionario_normalizacion(path)
+
+    monkeypatch.setattr(uf, 'diccionario_normalizacion', {})
+    uf.cargo_diccionario_normalizacion(path)
+    assert uf.diccionario_normalizacion == {'Capital  Federal': 'capital federal', ' CAPITAL FEDERAL': 'capital federal', 'Córdoba': 'cordoba'}
+
+    # Con mas de max_valores no se guarda (queda el de la corrida anterior) y sin archivo no se carga nada
+    uf.diccionario_normalizacion['Rosario'] = 'rosario'
+    uf.guardo_diccionario_normalizacion(path, max_valores= 3)
+    monkeypatch.setattr(uf, 'diccionario_normalizacion', {})
+    uf.cargo_diccionario_normalizacion(path)
+    assert 'Rosario' not in uf.diccionario_normalizacion and len(uf.diccionario_normalizacion) == 3
+
+    uf.cargo_diccionario_normalizacion(str(tmp_path / 'no_existe.json'))
+    assert len(uf.diccionario_normalizacion) == 3
+
+
+def test_leo_csv_dentro_del_zip(archivo_rns, lookups_sinteticos):
+
+    # Un periodo suelto, otro solo dentro del zip y otro en los dos lados (se usa el suelto)
+    os.makedirs('data/zip')
+    archivos = {periodo: archivo_rns(300, periodo= periodo)[0] for periodo in [202101, 202102, 202103]}
+    with zipfile.ZipFile('data/zip/registro-nacional-sociedades-2021.zip', 'w') as zipf:
+        for periodo in [202102, 202103]:
+            zipf.write(archivos[periodo], os.path.basename(archivos[periodo]))
+    for periodo in [202101, 202103]:
+        os.replace(archivos[periodo], os.path.join('data/zip', os.path.basename(archivos[periodo])))
+
+    assert sorted(uf.check_local_files_to_update('202100')) == ['registro-nacional-sociedades-2021.zip/registro-nacional-sociedades-202102.csv',
+                                                                 'registro-nacional-sociedades-202101.csv',
+                                                                 'registro-nacional-sociedades-202103.csv']
+    assert uf.check_local_files_to_update('202102') == ['registro-nacional-sociedades-202103.csv']
+
+    # El member se lee directo del zip, igual que el mismo csv suelto
+    miembro = 'data/zip/registro-nacional-sociedades-2021.zip/registro-nacional-sociedades-202103.csv'
+    suelto = 'data/zip/registro-nacional-sociedades-202103.csv'
+    with uf.abro_archivo(miembro, buffer_size= 4096) as f, open(suelto, 'rb') as g:
+        assert f.peek(10)[:10] == g.read(10)
+        g.seek(0)
+        assert f.read() == g.read()
+
+    with open(suelto, 'rb') as g:
+        assert uf.abro_archivo(g) is g
+
+    base_zip, _ = pf.preparo_periodo(miembro, 202103, False)
+    base_suelto, _ = pf.preparo_periodo(suelto, 202103, False)
+    pd.testing.assert_frame_equal(base_zip, base_suelto)